@@ -2,6 +2,7 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.request import Request
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework.exceptions import AuthenticationFailed,PermissionDenied
+from .tokens import stateless_auth_enabled, is_token_revoked, user_from_claims
 
 class CustomJwtAuthentication(JWTAuthentication) :
 
@@ -17,10 +18,22 @@ class CustomJwtAuthentication(JWTAuthentication) :
         except (InvalidToken , TokenError) as e:
             raise AuthenticationFailed("Invalid or expired access token.") from e
         
-        user= self.get_user(validated_token)
+        user = self.get_stateless_user(validated_token) if stateless_auth_enabled() else None
+        if user is None:
+            user= self.get_user(validated_token)
         # if not user.is_verified:
         #     raise PermissionDenied("Email is not verified.")
         return user, validated_token
 
+    def get_stateless_user(self, validated_token):
+        user = user_from_claims(validated_token)
+        if user is None:
+            return None
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive.")
+        if is_token_revoked(validated_token):
+            raise AuthenticationFailed("Token has been revoked.")
+        return user
+
 
         
\ No newline at end of file
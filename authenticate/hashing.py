@@ -0,0 +1,32 @@
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from rest_framework.exceptions import APIException
+
+from mysite.executors import ExecutorSaturated, _with_db_connections, get_executor
+
+
+class PasswordHashingBusy(APIException):
+    status_code = 503
+    default_detail = 'Too many login attempts are being processed. Please retry shortly.'
+    default_code = 'hashing_busy'
+    wait = 1
+
+
+def _run(fn, *args, **kwargs):
+    try:
+        return get_executor('hashing').run(fn, *args, **kwargs)
+    except ExecutorSaturated as e:
+        raise PasswordHashingBusy() from e
+
+
+def hash_password(raw_password):
+    return _run(make_password, raw_password)
+
+
+def authenticate_user(request, username, password):
+    """
+    Run the authentication backends on the hashing executor. ModelBackend
+    hashes the password for unknown usernames too, upgrades outdated hashes
+    and rejects inactive users.
+    """
+    return _run(_with_db_connections, authenticate, request, username=username, password=password)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from authenticate.tokens import blacklist_key
+
+
+class Command(BaseCommand):
+    help = "Copy blacklisted refresh tokens from the database into the Redis blacklist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--purge', action='store_true',
+                            help="Delete the outstanding/blacklisted token rows once they are in Redis.")
+
+    def handle(self, *args, **options):
+        client = get_redis_connection('default')
+        now = timezone.now()
+        migrated = 0
+
+        rows = (
+            BlacklistedToken.objects
+            .filter(token__expires_at__gt=now)
+            .values_list('token__jti', 'token__expires_at')
+            .iterator(chunk_size=options['batch_size'])
+        )
+        pipe = client.pipeline(transaction=False)
+        for jti, expires_at in rows:
+            ttl = int((expires_at - now).total_seconds())
+            if ttl <= 0:
+                continue
+            pipe.set(blacklist_key(jti), 1, ex=ttl)
+            migrated += 1
+            if migrated % options['batch_size'] == 0:
+                pipe.execute()
+        pipe.execute()
+
+        if options['purge']:
+            deleted, _ = OutstandingToken.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} token rows.")
+
+        self.stdout.write(self.style.SUCCESS(f"Migrated {migrated} blacklisted tokens to Redis."))
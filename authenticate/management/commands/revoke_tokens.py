@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from authenticate.tokens import bump_token_version
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Revoke every token issued to a user by bumping their token version."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+
+        version = bump_token_version(user.pk)
+        self.stdout.write(self.style.SUCCESS(f"Tokens for {user.username} revoked (now at version {version})."))
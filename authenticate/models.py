@@ -1,3 +1,29 @@
-from django.db import models
+from django.contrib.auth import get_user_model
 
-# Create your models here.
+
+User = get_user_model()
+
+
+class ClaimsUserReadOnly(RuntimeError):
+    pass
+
+
+class ClaimsUser(User):
+    """
+    A user rebuilt from the claims of an access token (see
+    ``tokens.user_from_claims``). It carries only the claimed fields, so it
+    must never be written back over the real row.
+    """
+
+    class Meta:
+        proxy = True
+
+    def save(self, *args, **kwargs):
+        raise ClaimsUserReadOnly(
+            f"User {self.pk} was built from token claims; load it from the database before saving."
+        )
+
+    def delete(self, *args, **kwargs):
+        raise ClaimsUserReadOnly(
+            f"User {self.pk} was built from token claims; load it from the database before deleting."
+        )
@@ -1,16 +1,35 @@
 import json
+import threading
 from unittest.mock import patch, MagicMock
 
 from django.test import TestCase
 from django.urls import reverse
-from django.contrib.auth import get_user_model
+from django.contrib.auth import authenticate, get_user_model
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
 
 from authenticate.views import RegisterView, LoginView, RefreshView, GetUser, LogoutView
+from authenticate.tokens import bump_token_version, blacklist_key, user_from_claims
+from authenticate.models import ClaimsUserReadOnly
+from django.core.management import call_command
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from mysite.executors import BoundedExecutor, ExecutorSaturated
 
+# Login runs the auth backends on the hashing pool; keep them on the test
+# thread so they see the test case's transaction.
+TEST_EXECUTORS = {'hashing': {'thread_sensitive': True}}
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
 class AuthenticationAPITests(APITestCase):
     def setUp(self):
+        # Throttle history from earlier tests lives in the shared cache.
+        cache.clear()
         self.User = get_user_model()
 
     def test_register_user_success(self):
@@ -18,8 +37,7 @@ class AuthenticationAPITests(APITestCase):
         data = {
             'username': 'newuser',
             'email': 'newuser@example.com',
-            'password': 'strongpassword123',
-            'password2': 'strongpassword123'
+            'password': 'Str0ng!password',
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -41,18 +59,16 @@ class AuthenticationAPITests(APITestCase):
         data = {
             'username': 'bademail',
             'email': 'bademail',
-            'password': 'password123',
-            'password2': 'password123'
+            'password': 'Str0ng!password',
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('email', response.data)
 
         data = {
-            'username': 'mismatch',
-            'email': 'mismatch@example.com',
+            'username': 'weakpassword',
+            'email': 'weak@example.com',
             'password': 'password123',
-            'password2': 'password456'
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -88,14 +104,14 @@ class AuthenticationAPITests(APITestCase):
             'password': 'wrongpassword',
         }
         response = self.client.post(url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
         data = {
             'username': 'nonexistentuser',
             'password': 'anypassword',
         }
         response = self.client.post(url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_get_user_authenticated(self):
         user = self.User.objects.create_user(
@@ -126,8 +142,8 @@ class AuthenticationAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('refresh_token', response.cookies)
         self.assertIn('access_token', response.cookies)
-        self.assertEqual(response.cookies['refresh_token']['max_age'], 0)
-        self.assertEqual(response.cookies['access_token']['max_age'], 0)
+        self.assertEqual(response.cookies['refresh_token']['max-age'], 0)
+        self.assertEqual(response.cookies['access_token']['max-age'], 0)
 
     def test_refresh_token_success(self):
         user = self.User.objects.create_user(
@@ -155,5 +171,140 @@ class AuthenticationAPITests(APITestCase):
         url = reverse('refresh')
         response = self.client.post(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('refresh_token', response.cookies)
-        self.assertEqual(response.cookies['refresh_token']['max_age'], 0)
+        self.assertNotIn('access_token', response.cookies)
+
+
+@override_settings(STATELESS_AUTH=True, EXECUTORS=TEST_EXECUTORS)
+class StatelessAuthTests(APITestCase):
+    def setUp(self):
+        # Throttle history from earlier tests lives in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(
+            username='statelessuser', email='stateless@example.com', password='password123'
+        )
+        response = self.client.post('/api/auth/login', {'username': 'statelessuser', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_access_token_embeds_user_claims(self):
+        token = AccessToken(self.client.cookies['access_token'].value)
+        self.assertEqual(token['username'], 'statelessuser')
+        self.assertEqual(token['email'], 'stateless@example.com')
+        self.assertTrue(token['is_active'])
+        self.assertFalse(token['is_staff'])
+        self.assertIn('ver', token)
+
+    def test_claims_user_keeps_staff_flag(self):
+        staff = self.User.objects.create_user(
+            username='statelessstaff', email='staff@example.com', password='password123', is_staff=True
+        )
+        response = self.client.post('/api/auth/login', {'username': 'statelessstaff', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        user = user_from_claims(AccessToken(self.client.cookies['access_token'].value))
+        self.assertEqual(user, staff)
+        self.assertTrue(user.is_staff)
+
+    def test_authenticated_request_skips_user_lookup(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/auth/user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], 'statelessuser')
+
+    def test_claims_user_cannot_be_written(self):
+        user = user_from_claims(AccessToken(self.client.cookies['access_token'].value))
+        self.assertEqual(user, self.user)
+        with self.assertRaises(ClaimsUserReadOnly):
+            user.save()
+        with self.assertRaises(ClaimsUserReadOnly):
+            user.delete()
+        self.assertTrue(self.User.objects.filter(pk=self.user.pk).exists())
+
+    def test_bumped_token_version_is_rejected(self):
+        bump_token_version(self.user.pk)
+        response = self.client.get('/api/auth/user')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+        response = self.client.post('/api/auth/refresh')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+class PasswordHashingExecutorTests(APITestCase):
+    def setUp(self):
+        # Throttle history from earlier tests lives in the shared cache.
+        cache.clear()
+
+    def test_bounded_executor_rejects_when_full(self):
+        release = threading.Event()
+        executor = BoundedExecutor('test', max_workers=1, max_pending=1)
+        running = executor.submit(release.wait)
+        queued = executor.submit(lambda: 'done')
+        with self.assertRaises(ExecutorSaturated):
+            executor.submit(lambda: None)
+        release.set()
+        running.result()
+        self.assertEqual(queued.result(), 'done')
+        self.assertEqual(executor.in_flight, 0)
+
+    def test_register_and_login_hash_off_thread(self):
+        response = self.client.post('/api/auth/register', {
+            'username': 'hasheduser', 'email': 'hashed@example.com', 'password': 'Str0ng!pass'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = get_user_model().objects.get(username='hasheduser')
+        self.assertTrue(user.check_password('Str0ng!pass'))
+
+        response = self.client.post('/api/auth/login', {'username': 'hasheduser', 'password': 'Str0ng!pass'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_goes_through_auth_backends(self):
+        get_user_model().objects.create_user(username='backenduser', email='backend@example.com', password='password123')
+        with patch('authenticate.hashing.authenticate', wraps=authenticate) as backends:
+            response = self.client.post('/api/auth/login', {'username': 'backenduser', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(backends.call_args.args[0])
+        self.assertEqual(backends.call_args.kwargs['username'], 'backenduser')
+
+    def test_login_returns_503_when_hashing_pool_is_full(self):
+        get_user_model().objects.create_user(username='busyuser', email='busy@example.com', password='password123')
+        saturated = MagicMock()
+        saturated.run.side_effect = ExecutorSaturated('hashing')
+        with patch('authenticate.hashing.get_executor', return_value=saturated):
+            response = self.client.post('/api/auth/login', {'username': 'busyuser', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+@override_settings(TOKEN_BLACKLIST_BACKEND='redis', EXECUTORS=TEST_EXECUTORS)
+class RedisBlacklistTests(APITestCase):
+    def setUp(self):
+        # Throttle history from earlier tests lives in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(
+            username='redisuser', email='redis@example.com', password='password123'
+        )
+        self.client.post('/api/auth/login', {'username': 'redisuser', 'password': 'password123'}, format='json')
+
+    def test_rotation_blacklists_in_redis_without_rows(self):
+        old_refresh = self.client.cookies['refresh_token'].value
+        response = self.client.post('/api/auth/refresh')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.cookies['refresh_token'].value, old_refresh)
+
+        jti = RefreshToken(old_refresh, verify=False)['jti']
+        self.assertGreater(get_redis_connection('default').ttl(blacklist_key(jti)), 0)
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+        self.client.cookies['refresh_token'] = old_refresh
+        response = self.client.post('/api/auth/refresh')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_migrate_token_blacklist_command(self):
+        token = RefreshToken.for_user(self.user)
+        token.blacklist()
+        call_command('migrate_token_blacklist', '--purge', stdout=MagicMock())
+        self.assertTrue(get_redis_connection('default').exists(blacklist_key(token['jti'])))
+        self.assertFalse(OutstandingToken.objects.exists())
@@ -0,0 +1,132 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+
+from .models import ClaimsUser
+
+
+User = get_user_model()
+
+TOKEN_VERSION_KEY = 'auth:token_version'
+REVOKED_VERSIONS_KEY = 'auth:revoked_versions'
+VERSION_CLAIM = 'ver'
+BLACKLIST_KEY_PREFIX = 'auth:blacklist:'
+
+
+class RedisBlacklistMixin:
+    """
+    Keeps blacklisted JTIs in Redis with a TTL equal to the token's remaining
+    lifetime instead of in the OutstandingToken/BlacklistedToken tables.
+    """
+
+    def check_blacklist(self):
+        if get_redis_connection('default').exists(blacklist_key(self[api_settings.JTI_CLAIM])):
+            raise TokenError("Token is blacklisted")
+
+    def blacklist(self):
+        ttl = int(self['exp'] - time.time())
+        if ttl > 0:
+            get_redis_connection('default').set(blacklist_key(self[api_settings.JTI_CLAIM]), 1, ex=ttl)
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user, which records an OutstandingToken row.
+        return super(BlacklistMixin, cls).for_user(user)
+
+
+class RedisRefreshToken(RedisBlacklistMixin, RefreshToken):
+    pass
+
+
+def blacklist_key(jti):
+    return f"{BLACKLIST_KEY_PREFIX}{jti}"
+
+
+def get_refresh_token_class():
+    if getattr(settings, 'TOKEN_BLACKLIST_BACKEND', 'db') == 'redis':
+        return RedisRefreshToken
+    return RefreshToken
+
+
+def stateless_auth_enabled():
+    return getattr(settings, 'STATELESS_AUTH', False)
+
+
+def get_token_version(user_id):
+    version = get_redis_connection('default').hget(TOKEN_VERSION_KEY, user_id)
+    return int(version) if version else 0
+
+
+def bump_token_version(user_id):
+    """
+    Revoke every token issued to ``user_id`` so far. The old version is kept in
+    a sorted set until the longest-lived token carrying it has expired.
+    """
+    client = get_redis_connection('default')
+    now = time.time()
+    version = client.hincrby(TOKEN_VERSION_KEY, user_id, 1)
+    pipe = client.pipeline()
+    pipe.zadd(REVOKED_VERSIONS_KEY, {f"{user_id}:{version - 1}": now + api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()})
+    pipe.zremrangebyscore(REVOKED_VERSIONS_KEY, '-inf', now)
+    pipe.execute()
+    return version
+
+
+def is_token_revoked(token):
+    if VERSION_CLAIM not in token:
+        return False
+    member = f"{token[api_settings.USER_ID_CLAIM]}:{token[VERSION_CLAIM]}"
+    return get_redis_connection('default').zscore(REVOKED_VERSIONS_KEY, member) is not None
+
+
+def embed_user_claims(token, user):
+    token['username'] = user.username
+    token['email'] = user.email
+    token['is_active'] = user.is_active
+    token['is_staff'] = user.is_staff
+    token[VERSION_CLAIM] = get_token_version(user.pk)
+    return token
+
+
+def tokens_for_user(user):
+    refresh = get_refresh_token_class().for_user(user)
+    if stateless_auth_enabled():
+        embed_user_claims(refresh, user)
+    return refresh
+
+
+def rotate_refresh_token(token):
+    """Apply ROTATE_REFRESH_TOKENS / BLACKLIST_AFTER_ROTATION to ``token`` in place."""
+    if not api_settings.ROTATE_REFRESH_TOKENS:
+        return token
+    if api_settings.BLACKLIST_AFTER_ROTATION:
+        token.blacklist()
+    token.set_jti()
+    token.set_exp()
+    token.set_iat()
+    return token
+
+
+def user_from_claims(token):
+    """
+    Build a ``ClaimsUser`` from the claims of a validated access token without
+    touching the database. Returns None when the token carries no embedded
+    claims, i.e. it was issued before stateless mode was enabled.
+    """
+    if VERSION_CLAIM not in token:
+        return None
+    user = ClaimsUser(
+        pk=token[api_settings.USER_ID_CLAIM],
+        username=token['username'],
+        email=token.get('email', ''),
+        is_active=token['is_active'],
+        is_staff=token.get('is_staff', False),
+    )
+    user._state.adding = False
+    user._state.db = 'default'
+    return user
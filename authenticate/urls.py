@@ -4,9 +4,9 @@ from . views import *
 
 
 urlpatterns = [
-    path('register' ,RegisterView.as_view() ),
-    path('login' , LoginView.as_view() ),
-    path('refresh' , RefreshView.as_view() ),
-    path('logout' , LogoutView.as_view() ),
-    path('user' , GetUser.as_view() ),
+    path('register' ,RegisterView.as_view() , name='register'),
+    path('login' , LoginView.as_view() , name='login'),
+    path('refresh' , RefreshView.as_view() , name='refresh'),
+    path('logout' , LogoutView.as_view() , name='logout'),
+    path('user' , GetUser.as_view() , name='user'),
 ]
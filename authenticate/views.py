@@ -4,6 +4,16 @@ from rest_framework.views import APIView
 from rest_framework import status
 from .serializers import *
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .tokens import (
+    tokens_for_user, stateless_auth_enabled, is_token_revoked, embed_user_claims,
+    get_refresh_token_class, rotate_refresh_token,
+)
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -29,10 +39,10 @@ class LoginView(APIView):
     permission_classes =  []
     def post(self, request):
         data = request.data
-        serializer = LoginSerializer(data=data)
+        serializer = LoginSerializer(data=data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for_user(user)
         response = Response(status=200)
         response.set_cookie(
             key='refresh_token',
@@ -60,9 +70,18 @@ class RefreshView(APIView):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = RefreshToken(refresh_token)
-
-          
+            token = get_refresh_token_class()(refresh_token)
+            access = token.access_token
+
+            if stateless_auth_enabled():
+                if is_token_revoked(token):
+                    raise TokenError("Token has been revoked.")
+                user = User.objects.get(pk=token[api_settings.USER_ID_CLAIM])
+                if not user.is_active:
+                    raise TokenError("User is inactive.")
+                embed_user_claims(access, user)
+
+            rotate_refresh_token(token)
             response = Response(status=status.HTTP_200_OK)
 
             response.set_cookie(
@@ -74,14 +93,14 @@ class RefreshView(APIView):
             )
             response.set_cookie(
                 key='access_token',
-                value=str(token.access_token), 
+                value=str(access), 
                 httponly=True,
                 secure=True,
                 samesite='None'
             )
             return response
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.info("Token refresh rejected", exc_info=True)
             response = Response(status=status.HTTP_400_BAD_REQUEST)
             response.delete_cookie('refresh_token')
             response.delete_cookie('access_token')
@@ -0,0 +1,159 @@
+"""
+Content-addressed attachment storage and resumable uploads.
+
+An upload is appended to ``<ATTACHMENT_ROOT>/uploads/<upload id>.part`` one
+chunk per request, straight from the request stream, so neither a whole file
+nor a whole chunk is held in memory. The part file's size is the resume
+offset. Once the last byte arrives the file is hashed and moved to
+``<ATTACHMENT_ROOT>/<sha256[:2]>/<sha256[2:4]>/<sha256>``; identical content
+uploaded twice is stored once.
+"""
+import fcntl
+import hashlib
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Attachment
+
+
+COPY_BUFFER_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadConflict(Exception):
+    """The chunk does not start at the current offset, or another chunk is being written."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+def storage_root():
+    return Path(settings.ATTACHMENT_ROOT)
+
+
+def blob_path(sha256):
+    return storage_root() / sha256[:2] / sha256[2:4] / sha256
+
+
+def part_path(upload):
+    return storage_root() / 'uploads' / f"{upload.id}.part"
+
+
+def upload_offset(upload):
+    try:
+        return part_path(upload).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def write_chunk(upload, stream, offset, length):
+    """
+    Append ``length`` bytes read from ``stream`` to the upload at ``offset``.
+    Returns the new offset; a short body leaves a shorter part to resume from.
+    """
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'ab') as part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict(upload_offset(upload))
+        current = part.seek(0, os.SEEK_END)
+        if current != offset:
+            raise UploadConflict(current)
+
+        remaining = length
+        while remaining > 0:
+            data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            part.write(data)
+            remaining -= len(data)
+        part.flush()
+        os.fsync(part.fileno())
+        return part.tell()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(COPY_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete_upload(upload):
+    """Move a fully received upload into content-addressed storage."""
+    path = part_path(upload)
+    sha256 = file_sha256(path)
+    target = blob_path(sha256)
+    if target.exists():
+        path.unlink()
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    with transaction.atomic():
+        attachment = Attachment.objects.create(
+            sha256=sha256,
+            size=upload.size,
+            filename=upload.filename,
+            content_type=upload.content_type,
+            created_by=upload.created_by,
+        )
+        upload.delete()
+    return attachment
+
+
+def discard_upload(upload):
+    part_path(upload).unlink(missing_ok=True)
+    upload.delete()
+
+
+def parse_range(header, size):
+    """
+    Resolve a single ``bytes=`` range against ``size``. Returns ``(start, end)``
+    inclusive, None to serve the whole file, or raises ValueError when the
+    range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRange:
+    """Read-only view of ``length`` bytes of ``file`` starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,173 @@
+"""
+Per-node fan-out for broadcast rooms (category '3').
+
+In a chat room every socket joins the ``chat_<id>`` group itself, so each
+event is delivered once per socket by the channel layer. In a broadcast room
+each worker process joins the group once, with one channel per room, and
+hands every event it receives to the handlers of its local sockets. Events
+carry frames that were JSON-encoded once by the publisher, so a message costs
+one channel-layer delivery per node however many listeners there are.
+
+Listener counts are approximate. Every BROADCAST_ROOMS['presence_interval']
+seconds each node writes its local count to Redis and reads back the sum over
+nodes that reported within 'presence_ttl' seconds.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+
+from mysite import metrics
+from mysite.executors import run_async
+from mysite.sharding import get_shard_client
+
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CATEGORY = '3'
+DEFAULT_BROADCAST_ROOMS = {'presence_interval': 5, 'presence_ttl': 30}
+READ_RETRY_DELAY = 1
+NODE_ID = uuid.uuid4().hex
+
+local_listeners = metrics.gauge('broadcast_listeners', 'Broadcast room sockets held by this worker.')
+fanout_events = metrics.counter('broadcast_events_total', 'Channel-layer events fanned out to local broadcast listeners.')
+
+_hubs = {}
+
+
+def get_config():
+    return {**DEFAULT_BROADCAST_ROOMS, **getattr(settings, 'BROADCAST_ROOMS', {})}
+
+
+def nodes_key(group_name):
+    return f"room:{group_name}:nodes"
+
+
+def node_counts_key(group_name):
+    return f"room:{group_name}:node_counts"
+
+
+def report_listeners(group_name, count, now=None):
+    """Record this node's listener count and return the room-wide estimate."""
+    ttl = get_config()['presence_ttl']
+    now = time.time() if now is None else now
+    client = get_shard_client(group_name)
+    pipe = client.pipeline()
+    if count:
+        pipe.zadd(nodes_key(group_name), {NODE_ID: now})
+        pipe.hset(node_counts_key(group_name), NODE_ID, count)
+    else:
+        pipe.zrem(nodes_key(group_name), NODE_ID)
+        pipe.hdel(node_counts_key(group_name), NODE_ID)
+    pipe.zremrangebyscore(nodes_key(group_name), '-inf', now - ttl)
+    pipe.expire(nodes_key(group_name), ttl)
+    pipe.expire(node_counts_key(group_name), ttl)
+    pipe.zrange(nodes_key(group_name), 0, -1)
+    live = pipe.execute()[-1]
+    if not live:
+        return 0
+    return sum(int(value) for value in client.hmget(node_counts_key(group_name), live) if value)
+
+
+class BroadcastRoom:
+    def __init__(self, group_name):
+        self.group_name = group_name
+        self.listeners = set()
+        self.channel = None
+        self.count = None
+        self.tasks = []
+
+
+class BroadcastHub:
+    """One per event loop; holds this node's subscription to each broadcast room."""
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.rooms = {}
+
+    async def join(self, group_name, consumer):
+        room = self.rooms.get(group_name)
+        if room is None:
+            room = self.rooms[group_name] = BroadcastRoom(group_name)
+            # Keep the default prefix: channels_redis reads all of a process's
+            # channels through one lock from one list per prefix, so a list of
+            # our own would wait behind the consumers' (and starve them).
+            room.channel = await self.channel_layer.new_channel()
+            await self.channel_layer.group_add(group_name, room.channel)
+            room.tasks = [asyncio.ensure_future(self.read(room)), asyncio.ensure_future(self.report(room))]
+        room.listeners.add(consumer)
+        local_listeners.inc()
+
+    async def leave(self, group_name, consumer):
+        room = self.rooms.get(group_name)
+        if room is None or consumer not in room.listeners:
+            return
+        room.listeners.discard(consumer)
+        local_listeners.dec()
+        if room.listeners:
+            return
+
+        del self.rooms[group_name]
+        for task in room.tasks:
+            task.cancel()
+        await self.channel_layer.group_discard(group_name, room.channel)
+        try:
+            await run_async('redis', report_listeners, group_name, 0)
+        except Exception:
+            logger.warning("Could not clear broadcast listener count", exc_info=True, extra={'room': group_name})
+
+    async def read(self, room):
+        while True:
+            try:
+                event = await self.channel_layer.receive(room.channel)
+                fanout_events.inc()
+                await self.deliver(room, event)
+            except Exception:
+                # The room's listeners depend on this loop; never let it die.
+                logger.exception("Broadcast reader failed, resubscribing", extra={'room': room.group_name})
+                await asyncio.sleep(READ_RETRY_DELAY)
+                try:
+                    await self.channel_layer.group_add(room.group_name, room.channel)
+                except Exception:
+                    logger.warning("Broadcast resubscribe failed", exc_info=True, extra={'room': room.group_name})
+
+    async def deliver(self, room, event):
+        name = event['type'].replace('.', '_')
+        for consumer in list(room.listeners):
+            handler = getattr(consumer, name, None)
+            if handler is None:
+                continue
+            try:
+                await handler(event)
+            except Exception:
+                logger.exception("Broadcast delivery failed", extra={'room': room.group_name, 'event': name})
+
+    async def report(self, room):
+        interval = get_config()['presence_interval']
+        while True:
+            try:
+                count = await run_async('redis', report_listeners, room.group_name, len(room.listeners))
+                # Re-adding the channel keeps the group membership from expiring.
+                await self.channel_layer.group_add(room.group_name, room.channel)
+            except Exception:
+                logger.warning("Broadcast presence report failed", exc_info=True, extra={'room': room.group_name})
+            else:
+                if count != room.count:
+                    room.count = count
+                    frame = json.dumps({'type': 'user_count', 'count': count, 'approximate': True})
+                    for consumer in list(room.listeners):
+                        await consumer.send(text_data=frame, key='user_count')
+            await asyncio.sleep(interval)
+
+
+def get_hub(channel_layer):
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None or hub.channel_layer is not channel_layer:
+        for stale in [key for key in _hubs if key.is_closed()]:
+            del _hubs[stale]
+        hub = _hubs[loop] = BroadcastHub(channel_layer)
+    return hub
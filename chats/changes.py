@@ -0,0 +1,83 @@
+"""
+Message edits and deletes, ordered by a per-room change sequence.
+
+Every edit or delete takes the next value of ``Room.change_seq`` (an UPDATE
+on the room row, so concurrent changes to one room serialise on its lock)
+and stamps it on the message. A client that remembers the highest sequence
+it has seen asks for ``change_seq > since`` and gets each changed message
+once, in its latest state. Deletes are soft so they can be reported.
+"""
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import history
+from .models import Message, Room
+from .serializers import MessageChangeSerializer
+from .services import message_deleted
+
+
+DEFAULT_CHANGES_LIMIT = 200
+
+
+def next_change_seq(room):
+    Room.objects.filter(pk=room.pk).update(change_seq=F('change_seq') + 1)
+    return Room.objects.values_list('change_seq', flat=True).get(pk=room.pk)
+
+
+def edit_message(message, text):
+    with transaction.atomic():
+        message.change_seq = next_change_seq(message.room)
+        message.message = text
+        message.edited_at = timezone.now()
+        message.save(update_fields=['message', 'edited_at', 'change_seq'])
+        history.bump_version(message.room_id)
+    broadcast_change(message)
+    return message
+
+
+def delete_message(message):
+    with transaction.atomic():
+        message.change_seq = next_change_seq(message.room)
+        message.message = ''
+        message.deleted_at = timezone.now()
+        message.save(update_fields=['message', 'deleted_at', 'change_seq'])
+        message.attachments.clear()
+        message_deleted(message.room, message)
+        history.bump_version(message.room_id)
+    broadcast_change(message)
+    return message
+
+
+def changes_since(room, since, limit=DEFAULT_CHANGES_LIMIT):
+    """
+    Return ``(changes, seq, has_more)``. ``seq`` is what the client should
+    send as ``since`` next time; reading the room's sequence first means a
+    change committed during the query is picked up on the next call.
+    """
+    current = Room.objects.values_list('change_seq', flat=True).get(pk=room.pk)
+    changes = list(
+        Message.objects
+        .filter(room=room, change_seq__gt=since, change_seq__lte=current)
+        .order_by('change_seq')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    if has_more:
+        changes = changes[:limit]
+        current = changes[-1].change_seq
+    return changes, current, has_more
+
+
+def broadcast_change(message):
+    async_to_sync(get_channel_layer().group_send)(
+        f"chat_{message.room_id}",
+        {
+            'type': 'message_changed',
+            'id': str(message.pk),
+            'frame': json.dumps(MessageChangeSerializer(message).data)
+        }
+    )
@@ -1,42 +1,82 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
+import asyncio
 import json
-from channels.db import database_sync_to_async
-from .serializers import MessageSerializer
-from .models import Room, Message
-from django_redis import get_redis_connection
+import time
+from .models import Room, Message, Attachment
+from django.conf import settings
+from .services import messages_created
+from . import unread
+from . import presence
+from .broadcast import BROADCAST_CATEGORY, get_hub
+from .outbound import BoundedSendMixin
+from mysite import admission
+from mysite.executors import ExecutorSaturated, orm_async
+from mysite.profiling import ProfiledDispatchMixin
 import logging
 
 
+logger = logging.getLogger(__name__)
+
 MAX_CHAT_USERS = 10
 MAX_VIDEO_USERS = 2
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# Ephemeral events are relayed to the room but never persisted. Events mapping
+# to the same key coalesce, so at most one broadcast per key per interval goes
+# out and the latest state is flushed when the interval ends.
+EPHEMERAL_EVENTS = {
+    'typing': 'typing',
+    'stop_typing': 'typing',
+    'presence': 'presence',
+}
+EPHEMERAL_EVENT_INTERVAL = 1.0
+
+class ChatConsumer(ProfiledDispatchMixin, BoundedSendMixin, AsyncWebsocketConsumer):
     async def connect(self):
+        if not await admission.admit(self):
+            return
+
+        try:
+            await self.connect_room()
+        except ExecutorSaturated as e:
+            logger.warning("Executor saturated during connect", extra={'event': 'chat.saturated', 'executor': str(e)})
+            await admission.turn_away(self, 'executor')
+
+    async def connect_room(self):
+        # Every executor call here runs before accept(), so a saturated pool
+        # can still turn the client away with TRY_AGAIN_LATER.
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f"chat_{self.room_name}"
         self.user = self.scope['user']
+        self.ephemeral_tasks = {}
+        self.ephemeral_pending = {}
+        self.ephemeral_sent_at = {}
         self.room = await self.get_chat_room()
 
-        if not (self.user and self.user.is_authenticated and self.room and self.room.category == '1'):
+        if not (self.user and self.user.is_authenticated and self.room and self.room.category in ('1', BROADCAST_CATEGORY)):
             await self.close(code=4001, reason="Authentication or room invalid")
             return
 
-        cache_key = f"room:{self.room_group_name}:users"
-        client = await database_sync_to_async(get_redis_connection)('default')
-        await database_sync_to_async(client.sadd)(cache_key, self.user.username.encode('utf-8'))
-        current_users = await database_sync_to_async(client.scard)(cache_key)
+        if self.room.category == BROADCAST_CATEGORY:
+            await self.connect_broadcast()
+            return
+
+        current_users = await presence.join(self.room_group_name, self.user.username)
 
         if current_users > MAX_CHAT_USERS:
+            await presence.leave(self.room_group_name, self.user.username)
             await self.accept()
             await self.send(text_data=json.dumps({
                 'type': 'error',
                 'message': 'Chat room is full. Please try again later.'
             }))
-            await database_sync_to_async(client.srem)(cache_key, self.user.username.encode('utf-8'))
             await self.close(code=4002, reason="Room full")
             return
 
-        print(f"User {self.user} connected to room {self.room_group_name}. Current users: {current_users}")
+        logger.info("User connected", extra={
+            'event': 'chat.connect', 'user': self.user.username, 'room': self.room_group_name, 'users': current_users
+        })
+
+        await orm_async(unread.join_room)(self.user, self.room)
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
@@ -49,14 +89,36 @@ class ChatConsumer(AsyncWebsocketConsumer):
             }
         )
 
+    async def connect_broadcast(self):
+        # Listeners are not capped by MAX_CHAT_USERS and do not join the group
+        # themselves; the node's hub subscribes once and delivers to them.
+        self.broadcast_hub = get_hub(self.channel_layer)
+        await orm_async(unread.join_room)(self.user, self.room)
+        await self.accept()
+        await self.broadcast_hub.join(self.room_group_name, self)
+        logger.info("Listener connected", extra={
+            'event': 'broadcast.connect', 'user': self.user.username, 'room': self.room_group_name
+        })
+
+    @property
+    def is_broadcast_listener(self):
+        return self.room.category == BROADCAST_CATEGORY and self.room.created_by_id != self.user.pk
+
     async def disconnect(self, code):
+        admission.release(self)
+        for task in getattr(self, 'ephemeral_tasks', {}).values():
+            task.cancel()
+
+        if getattr(self, 'broadcast_hub', None):
+            await self.broadcast_hub.leave(self.room_group_name, self)
+            return
+
         if hasattr(self, 'room_group_name') and self.user and self.user.is_authenticated:
-            cache_key = f"room:{self.room_group_name}:users"
-            client = await database_sync_to_async(get_redis_connection)('default')
-            await database_sync_to_async(client.srem)(cache_key, self.user.username.encode('utf-8'))
-            current_users = await database_sync_to_async(client.scard)(cache_key)
+            current_users = await presence.leave(self.room_group_name, self.user.username)
 
-            print(f"User {self.user} disconnected from room {self.room_group_name}. Current users: {current_users}")
+            logger.info("User disconnected", extra={
+                'event': 'chat.disconnect', 'user': self.user.username, 'room': self.room_group_name, 'users': current_users
+            })
 
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
@@ -71,19 +133,52 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data=None, bytes_data=None):
         try:
             text_data_json = json.loads(text_data)
-            message = text_data_json.get('message')
-            if not message:
-                print("Empty message received")
+            if text_data_json.get('type') in EPHEMERAL_EVENTS:
+                if not self.is_broadcast_listener:
+                    await self.send_ephemeral(text_data_json)
+                return
+
+            if text_data_json.get('type') == 'read':
+                read_at = await orm_async(unread.mark_read)(self.user, self.room)
+                if self.room.category == BROADCAST_CATEGORY:
+                    return
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'read_receipt',
+                        'from': self.user.username,
+                        'frame': json.dumps({
+                            'type': 'read',
+                            'from': self.user.username,
+                            'read_at': read_at.isoformat()
+                        })
+                    }
+                )
+                return
+
+            if self.is_broadcast_listener:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'Only the host can post in a broadcast room.'
+                }))
                 return
 
-            db_message = await self.save_message(message)
+            message = text_data_json.get('message') or ''
+            attachment_ids = text_data_json.get('attachments') or []
+            if not isinstance(attachment_ids, list):
+                attachment_ids = []
+            if not (message or attachment_ids):
+                logger.debug("Empty message received", extra={'event': 'chat.message_dropped', 'room': self.room_group_name})
+                return
+
+            db_message = await self.save_message(message, attachment_ids)
             if not db_message:
-                print("Failed to save message")
+                logger.warning("Failed to save message", extra={'room': self.room_group_name})
                 return
 
             serialized_message = await self.serialize_message(db_message)
             if not serialized_message:
-                print("Failed to serialize message")
+                logger.warning("Failed to serialize message", extra={'room': self.room_group_name})
                 return
 
             await self.channel_layer.group_send(
@@ -94,67 +189,161 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }
             )
         except json.JSONDecodeError:
-            print("Invalid JSON received")
-        except Exception as e:
-            print(f"Error processing message: {e}")
+            logger.debug("Invalid JSON received", extra={'event': 'chat.message_dropped', 'room': self.room_group_name})
+        except ExecutorSaturated as e:
+            logger.warning("Executor saturated, message dropped", extra={
+                'event': 'chat.message_dropped', 'room': self.room_group_name, 'executor': str(e)
+            })
+            await self.send(text_data=admission.busy_frame(admission.retry_after()))
+        except Exception:
+            logger.exception("Error processing message", extra={'room': self.room_group_name})
+
+    async def send_ephemeral(self, data):
+        event_type = data['type']
+        frame = {'type': event_type, 'from': self.user.username}
+        status = data.get('status')
+        if event_type == 'presence' and isinstance(status, str):
+            frame['status'] = status[:32]
+
+        key = EPHEMERAL_EVENTS[event_type]
+        self.ephemeral_pending[key] = json.dumps(frame)
+        if key in self.ephemeral_tasks:
+            return
+
+        wait = self.ephemeral_sent_at.get(key, 0) + EPHEMERAL_EVENT_INTERVAL - time.monotonic()
+        if wait <= 0:
+            await self.flush_ephemeral(key)
+        else:
+            self.ephemeral_tasks[key] = asyncio.ensure_future(self.flush_ephemeral(key, wait))
+
+    async def flush_ephemeral(self, key, delay=0):
+        if delay:
+            await asyncio.sleep(delay)
+        self.ephemeral_tasks.pop(key, None)
+        frame = self.ephemeral_pending.pop(key, None)
+        if frame is None:
+            return
+        self.ephemeral_sent_at[key] = time.monotonic()
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'ephemeral_event',
+                'frame': frame,
+                'key': f"{key}:{self.user.username}",
+                'exclude_channel': self.channel_name
+            }
+        )
 
     async def chat_message(self, event):
         message = event['message']
         await self.send(text_data=message)
 
+    async def read_receipt(self, event):
+        await self.send(text_data=event['frame'], key=f"read:{event.get('from')}", droppable=True)
+
+    async def ephemeral_event(self, event):
+        if self.channel_name != event.get('exclude_channel'):
+            await self.send(text_data=event['frame'], key=event.get('key'), droppable=True)
+
     async def user_count_update(self, event):
         await self.send(text_data=json.dumps({
             'type': 'user_count',
             'count': event['count']
+        }), key='user_count')
+
+    async def message_changed(self, event):
+        # A newer change to the same message supersedes a queued one.
+        await self.send(text_data=event['frame'], key=f"message:{event['id']}")
+
+    async def messages_imported(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'messages_imported',
+            'count': event['count']
         }))
 
-    @database_sync_to_async
+    @orm_async
     def get_chat_room(self):
         try:
             room = Room.objects.get(id=self.room_name)
             return room
-        except Room.DoesNotExist as e:
-            print(f"Room not found: {e}")
+        except Room.DoesNotExist:
+            logger.debug("Room not found", extra={'room': self.room_name})
             return None
-        except Exception as e:
-            print(f"Error fetching room: {e}")
+        except Exception:
+            logger.exception("Error fetching room", extra={'room': self.room_name})
             return None
 
-    @database_sync_to_async
-    def save_message(self, message):
+    @orm_async
+    def save_message(self, message, attachment_ids=()):
         try:
+            # Only the uploader can attach a file; the socket frame carries
+            # its metadata and clients fetch the bytes over HTTP.
+            attachments = list(Attachment.objects.filter(
+                id__in=[str(pk) for pk in attachment_ids[:settings.MAX_ATTACHMENTS_PER_MESSAGE]],
+                created_by=self.user
+            )) if attachment_ids else []
+            if not (message or attachments):
+                return None
             db_message = Message.objects.create(
                 room=self.room,
                 created_by=self.user,
                 message=message
             )
+            if attachments:
+                db_message.attachments.set(attachments)
+            messages_created(self.room, [db_message])
             return db_message
-        except Exception as e:
-            print(f"Error saving message: {e}")
+        except Exception:
+            logger.exception("Error saving message", extra={'room': self.room_group_name})
             return None
 
-    @database_sync_to_async
+    @orm_async
     def serialize_message(self, message):
+        # DRF is imported on first use so WebSocket-only workers boot without it.
+        from .serializers import MessageSerializer
         try:
             serializer = MessageSerializer(message)
             return serializer.data
-        except Exception as e:
-            print(f"Error serializing message: {e}")
+        except Exception:
+            logger.exception("Error serializing message", extra={'room': self.room_group_name})
             return None
 
 
 
 
-logger = logging.getLogger(__name__)
 MAX_VIDEO_USERS = 4
 
-class VideoCallConsumer(AsyncWebsocketConsumer):
+# Trickle ICE produces bursts of tiny frames. Candidates for the same peer are
+# held for SIGNALING_BATCH_WINDOW seconds and relayed as one channel-layer
+# event; clients that announce {"type": "capabilities", "batching": true} also
+# receive them as a single {"type": "batch", "messages": [...]} frame.
+# Batches sent by clients may hold at most SIGNALING_MAX_BATCH messages.
+SIGNALING_BATCH_WINDOW = 0.02
+SIGNALING_MAX_BATCH = 50
+SIGNALING_BATCH_TYPES = {'candidate', 'ice-candidate', 'ice_candidate'}
+
+class VideoCallConsumer(ProfiledDispatchMixin, BoundedSendMixin, AsyncWebsocketConsumer):
   
 
     async def connect(self):
+        if not await admission.admit(self):
+            return
+
+        try:
+            await self.connect_room()
+        except ExecutorSaturated as e:
+            logger.warning("Executor saturated during connect", extra={'event': 'video.saturated', 'executor': str(e)})
+            await admission.turn_away(self, 'executor')
+
+    async def connect_room(self):
+        # Every executor call here runs before accept(), so a saturated pool
+        # can still turn the client away with TRY_AGAIN_LATER.
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"video_call_{self.room_name}"
         self.user = self.scope["user"]
+        self.batching = False
+        self.signal_buffer = {}
+        self.signal_flush_tasks = {}
 
         if not (self.user and self.user.is_authenticated):
             await self.close(code=4001, reason="User not authenticated")
@@ -165,10 +354,7 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             await self.close(code=4001, reason="Room not found or is not a video room")
             return
 
-        self.redis = get_redis_connection("default")
-        self.cache_key = f"room:{self.room_group_name}:users"
-        
-        current_users_list = await self.get_room_users()
+        current_users_list = await presence.members(self.room_group_name)
 
         if len(current_users_list) >= MAX_VIDEO_USERS:
             await self.accept()
@@ -179,11 +365,11 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             await self.close(code=4002, reason="Room is full")
             return
 
+        await presence.join(self.room_group_name, self.user.username)
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
-        await database_sync_to_async(self.redis.sadd)(self.cache_key, self.user.username)
-        
-        logger.info(f"{self.user.username} connected to room {self.room_group_name}")
+
+        logger.info("User connected", extra={'event': 'video.connect', 'user': self.user.username, 'room': self.room_group_name})
 
         await self.send(text_data=json.dumps({
             'type': 'existing_users',
@@ -200,11 +386,14 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
-      
+        admission.release(self)
+        for task in getattr(self, 'signal_flush_tasks', {}).values():
+            task.cancel()
+
         if hasattr(self, 'room_group_name') and self.user and self.user.is_authenticated:
-            await database_sync_to_async(self.redis.srem)(self.cache_key, self.user.username)
+            await presence.leave(self.room_group_name, self.user.username)
             
-            logger.info(f"{self.user.username} disconnected from room {self.room_group_name}")
+            logger.info("User disconnected", extra={'event': 'video.disconnect', 'user': self.user.username, 'room': self.room_group_name})
 
             await self.channel_layer.group_send(
                 self.room_group_name,
@@ -220,23 +409,73 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
     
         try:
             data = json.loads(text_data)
-            to_user = data.get('to')
-            
-            if not to_user:
-                return
 
-            data['from'] = self.user.username
+            if data.get('type') == 'capabilities':
+                self.batching = bool(data.get('batching'))
+                await self.send(text_data=json.dumps({
+                    'type': 'capabilities',
+                    'batching': self.batching,
+                    'batch_window_ms': int(SIGNALING_BATCH_WINDOW * 1000),
+                    'max_batch': SIGNALING_MAX_BATCH
+                }))
+                return
 
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'relay.signaling_message',
-                    'to_user': to_user,
-                    'payload': data
-                }
-            )
+            messages = data.get('messages') if data.get('type') == 'batch' else [data]
+            if not isinstance(messages, list) or len(messages) > SIGNALING_MAX_BATCH:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': f"A batch must be a list of at most {SIGNALING_MAX_BATCH} messages."
+                }))
+                return
+            for message in messages:
+                if isinstance(message, dict):
+                    await self.relay(message)
         except Exception:
-            logger.exception(f"Error in receive from {self.user.username}")
+            logger.exception("Error in receive", extra={'user': self.user.username, 'room': self.room_group_name})
+
+    async def relay(self, data):
+        to_user = data.get('to')
+        if not to_user:
+            return
+
+        data['from'] = self.user.username
+        self.signal_buffer.setdefault(to_user, []).append(data)
+
+        if data.get('type') in SIGNALING_BATCH_TYPES and SIGNALING_BATCH_WINDOW > 0:
+            if to_user not in self.signal_flush_tasks:
+                self.signal_flush_tasks[to_user] = asyncio.ensure_future(
+                    self.flush_signaling(to_user, SIGNALING_BATCH_WINDOW)
+                )
+            return
+
+        # Offers, answers and anything else go out at once, behind any
+        # candidates already queued for the same peer so ordering holds.
+        task = self.signal_flush_tasks.pop(to_user, None)
+        if task:
+            task.cancel()
+        await self.flush_signaling(to_user)
+
+    async def flush_signaling(self, to_user, delay=0):
+        if delay:
+            await asyncio.sleep(delay)
+            self.signal_flush_tasks.pop(to_user, None)
+        payloads = self.signal_buffer.pop(to_user, None)
+        if not payloads:
+            return
+
+        if len(payloads) == 1:
+            event = {
+                'type': 'relay.signaling_message',
+                'to_user': to_user,
+                'payload': payloads[0]
+            }
+        else:
+            event = {
+                'type': 'relay.signaling_batch',
+                'to_user': to_user,
+                'payloads': payloads
+            }
+        await self.channel_layer.group_send(self.room_group_name, event)
 
 
     async def broadcast_new_peer(self, event):
@@ -256,15 +495,19 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         if event['to_user'] == self.user.username:
             await self.send(text_data=json.dumps(event['payload']))
 
-    @database_sync_to_async
+    async def relay_signaling_batch(self, event):
+        if event['to_user'] != self.user.username:
+            return
+        if self.batching:
+            await self.send(text_data=json.dumps({'type': 'batch', 'messages': event['payloads']}))
+        else:
+            for payload in event['payloads']:
+                await self.send(text_data=json.dumps(payload))
+
+    @orm_async
     def get_room(self):
         try:
             return Room.objects.get(id=self.room_name)
         except Room.DoesNotExist:
             return None
 
-    @database_sync_to_async
-    def get_room_users(self) -> list:
-        users = self.redis.smembers(self.cache_key)
-        return [user.decode('utf-8') for user in users]
-
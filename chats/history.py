@@ -0,0 +1,95 @@
+"""
+Cached, precompressed pages of room history.
+
+A page of ``get-messages`` that is full and followed by more messages is
+closed: new messages only append, so its content changes only when a message
+is edited, deleted or imported into the room. Closed pages are cached with
+their rendered JSON, an ETag and each compressed encoding once it has been
+asked for, under a per-room version that those writes bump. Repeat requests
+are answered without touching the database, compressing anything again or,
+with If-None-Match, sending the body at all.
+"""
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+from mysite import metrics
+from mysite.compression import choose_encoding, compress, get_config as get_compression_config
+
+
+DEFAULT_HISTORY_CACHE_TIMEOUT = 24 * 60 * 60
+
+page_cache = metrics.counter('history_page_cache_total', 'Closed history page lookups, by result.')
+
+
+def version_key(room_id):
+    return f"history:{room_id}:version"
+
+
+def get_version(room_id):
+    version = cache.get(version_key(room_id))
+    if version is None:
+        # Seeded from the clock so an evicted version never comes back as one
+        # that older cached pages were stored under.
+        cache.add(version_key(room_id), time.time_ns(), timeout=None)
+        version = cache.get(version_key(room_id))
+    return version
+
+
+def _bump_version(room_id):
+    try:
+        cache.incr(version_key(room_id))
+    except ValueError:
+        cache.set(version_key(room_id), time.time_ns(), timeout=None)
+
+
+def bump_version(room_id):
+    """Invalidate every cached page of the room once the current transaction commits."""
+    transaction.on_commit(partial(_bump_version, room_id))
+
+
+def page_key(room_id, page, page_size):
+    return f"history:{room_id}:{get_version(room_id)}:{page}:{page_size}"
+
+
+def get_page(key):
+    entry = cache.get(key)
+    page_cache.inc(result='hit' if entry is not None else 'miss')
+    return entry
+
+
+def store_page(key, body):
+    entry = {'etag': f'"{hashlib.sha256(body).hexdigest()[:32]}"', 'body': body}
+    cache.set(key, entry, timeout=getattr(settings, 'HISTORY_CACHE_TIMEOUT', DEFAULT_HISTORY_CACHE_TIMEOUT))
+    return entry
+
+
+def page_response(request, key, entry):
+    if entry['etag'] in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = entry['etag']
+        return response
+
+    body = entry['body']
+    encoding = None
+    if len(body) >= get_compression_config()['min_size']:
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        if encoding not in entry:
+            entry[encoding] = compress(body, encoding)
+            cache.set(key, entry, timeout=getattr(settings, 'HISTORY_CACHE_TIMEOUT', DEFAULT_HISTORY_CACHE_TIMEOUT))
+        body = entry[encoding]
+
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = f"W/{entry['etag']}" if encoding else entry['etag']
+    response['Cache-Control'] = 'private, no-cache'
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
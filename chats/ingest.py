@@ -0,0 +1,130 @@
+import json
+import logging
+from itertools import islice
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from . import history
+from .models import Message
+from .serializers import MessageImportSerializer
+from .services import messages_created
+
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 50
+
+
+def iter_ndjson(lines):
+    """Yield one record per non-empty line; undecodable lines yield None."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+
+
+def _batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def ingest_messages(room, records, default_user=None, batch_size=DEFAULT_BATCH_SIZE, broadcast=False,
+                    allowed_authors=None):
+    """
+    Validate and insert ``records`` into ``room`` in chunks of ``batch_size``.
+
+    Each record is ``{"message": str, "created_by": username?, "created_at": iso?}``.
+    When ``allowed_authors`` is given, records attributed to anyone else are
+    rejected. Invalid records are skipped and reported; valid ones are written
+    with one ``bulk_create`` per batch. Returns a summary dict.
+    """
+    user_ids = {}
+    if default_user is not None:
+        user_ids[default_user.username] = default_user.pk
+
+    imported = 0
+    failed = 0
+    errors = []
+    offset = 0
+
+    for batch in _batches(records, batch_size):
+        usernames = {
+            record['created_by'] for record in batch
+            if isinstance(record, dict) and isinstance(record.get('created_by'), str)
+        } - user_ids.keys()
+        if usernames:
+            user_ids.update(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+        rows = []
+        for index, record in enumerate(batch, start=offset):
+            if not isinstance(record, dict):
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'index': index, 'errors': 'Invalid record.'})
+                continue
+
+            serializer = MessageImportSerializer(data=record)
+            if not serializer.is_valid():
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'index': index, 'errors': serializer.errors})
+                continue
+
+            data = serializer.validated_data
+            username = data.get('created_by', default_user.username if default_user else None)
+            if allowed_authors is not None and username not in allowed_authors:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'index': index, 'errors': {'created_by': "You can only import your own messages."}})
+                continue
+            if username not in user_ids:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'index': index, 'errors': {'created_by': f"Unknown user '{username}'."}})
+                continue
+
+            message = Message(room=room, created_by_id=user_ids[username], message=data['message'])
+            if 'created_at' in data:
+                message.created_at = data['created_at']
+            rows.append(message)
+
+        with transaction.atomic():
+            Message.objects.bulk_create(rows, batch_size=batch_size)
+            messages_created(room, rows)
+        imported += len(rows)
+        offset += len(batch)
+
+    if imported:
+        # History pages are ordered by creation time, and imported messages
+        # can be older than existing ones and land inside closed pages.
+        history.bump_version(room.pk)
+
+    logger.info("Imported %s messages into room %s (%s rejected)", imported, room.id, failed, extra={
+        'event': 'chat.import', 'room': str(room.id), 'imported': imported, 'failed': failed
+    })
+
+    if broadcast and imported:
+        async_to_sync(get_channel_layer().group_send)(
+            f"chat_{room.id}",
+            {
+                'type': 'messages_imported',
+                'count': imported
+            }
+        )
+
+    return {'imported': imported, 'failed': failed, 'errors': errors}
@@ -0,0 +1,117 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+from chats.ids import uuid7
+
+
+SCHEMES = {'uuid4': uuid.uuid4, 'uuid7': uuid7}
+REPORTS = 10
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert --rows rows keyed by random UUID4 and by time-ordered UUIDv7 into scratch "
+        "tables and compare insert throughput as the table grows and the size of the "
+        "primary-key index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000,
+                            help="Rows per scheme; use tens of millions on a production-sized database.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--schemes', default=','.join(SCHEMES))
+        parser.add_argument('--keep', action='store_true', help="Leave the scratch tables in place.")
+
+    def handle(self, *args, **options):
+        schemes = [scheme.strip() for scheme in options['schemes'].split(',') if scheme.strip()]
+        unknown = set(schemes) - SCHEMES.keys()
+        if unknown:
+            raise CommandError(f"Unknown schemes: {', '.join(sorted(unknown))}")
+        if options['rows'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--rows and --batch-size must be positive.")
+
+        for scheme in schemes:
+            table = f"bench_ids_{scheme}"
+            self.create_table(table)
+            try:
+                elapsed = self.fill(table, SCHEMES[scheme], options['rows'], options['batch_size'], scheme)
+                index_size = self.index_size(table)
+            finally:
+                if not options['keep']:
+                    self.drop_table(table)
+            self.stdout.write(
+                f"{scheme}: {options['rows']} rows in {elapsed:.1f}s "
+                f"({options['rows'] / elapsed:,.0f} rows/s), "
+                f"primary key index {self.format_size(index_size)}"
+            )
+
+    def create_table(self, table):
+        uuid_type = models.UUIDField().db_type(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(table)}")
+            cursor.execute(
+                f"CREATE TABLE {connection.ops.quote_name(table)} "
+                f"(id {uuid_type} PRIMARY KEY, payload varchar(64) NOT NULL)"
+            )
+
+    def drop_table(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(table)}")
+
+    def fill(self, table, make_id, rows, batch_size, scheme):
+        field = models.UUIDField()
+        sql = f"INSERT INTO {connection.ops.quote_name(table)} (id, payload) VALUES (%s, %s)"
+        report_every = max(rows // REPORTS, batch_size)
+        next_report = report_every
+        inserted = 0
+        started = interval_started = time.perf_counter()
+        interval_rows = 0
+
+        while inserted < rows:
+            count = min(batch_size, rows - inserted)
+            batch = [(field.get_db_prep_value(make_id(), connection), 'x' * 64) for _ in range(count)]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            inserted += count
+            interval_rows += count
+
+            if inserted >= next_report or inserted == rows:
+                now = time.perf_counter()
+                self.stdout.write(f"  {scheme} {inserted:>12,} rows: {interval_rows / (now - interval_started):,.0f} rows/s")
+                interval_started, interval_rows = now, 0
+                next_report += report_every
+        return time.perf_counter() - started
+
+    def index_size(self, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT pg_relation_size(indexrelid) FROM pg_index WHERE indrelid = %s::regclass AND indisprimary",
+                    [table],
+                )
+                return cursor.fetchone()[0]
+            if connection.vendor == 'mysql':
+                cursor.execute(
+                    "SELECT stat_value * @@innodb_page_size FROM mysql.innodb_index_stats "
+                    "WHERE database_name = DATABASE() AND table_name = %s AND index_name = 'PRIMARY' "
+                    "AND stat_name = 'size'",
+                    [table],
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+            if connection.vendor == 'sqlite':
+                try:
+                    cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", [f"sqlite_autoindex_{table}_1"])
+                except Exception:
+                    # dbstat is a compile-time option of SQLite.
+                    return None
+                return cursor.fetchone()[0]
+        return None
+
+    def format_size(self, size):
+        if size is None:
+            return "size unavailable"
+        return f"{size / (1024 * 1024):.1f} MiB"
@@ -0,0 +1,67 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+PROFILES = ('full', 'websocket')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare worker start-up for the full and WebSocket-only ASGI profiles: "
+        "interpreter plus import time, and time until the first socket is handled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--room', default=None,
+                            help="Chat room to connect to; a random id (rejected handshake) when omitted.")
+        parser.add_argument('--access-token', default=None,
+                            help="Access token sent as the access_token cookie so the socket is accepted.")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("--runs must be at least 1.")
+
+        path = f"/ws/chat/{options['room'] or uuid.uuid4()}/"
+        cookie = f"access_token={options['access_token']}" if options['access_token'] else ''
+        results = {profile: [] for profile in PROFILES}
+
+        for _ in range(options['runs']):
+            for profile in PROFILES:
+                results[profile].append(self.probe(profile, path, cookie))
+
+        for profile, runs in results.items():
+            accepted = sum(run['accepted'] for run in runs)
+            self.stdout.write(
+                f"{profile:>9}: ready in {self.median(runs, 'wall_seconds')} "
+                f"(import {self.median(runs, 'import_seconds')}, "
+                f"first socket {self.median(runs, 'first_socket_seconds')}), "
+                f"{int(statistics.median(run['modules'] for run in runs))} modules, "
+                f"{accepted}/{len(runs)} sockets accepted"
+            )
+
+    def probe(self, profile, path, cookie):
+        env = {**os.environ, 'ASGI_PROFILE': profile}
+
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-m', 'mysite.startup_probe', '--path', path, '--cookie', cookie],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise CommandError(f"{profile} probe failed:\n{completed.stderr}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['wall_seconds'] = wall
+        return result
+
+    def median(self, runs, key):
+        return f"{statistics.median(run[key] for run in runs) * 1000:.0f} ms"
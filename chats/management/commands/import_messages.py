@@ -0,0 +1,59 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.ingest import DEFAULT_BATCH_SIZE, ingest_messages, iter_ndjson
+from chats.models import Room
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Bulk import chat history into a room from a JSON array or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_id')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['json', 'ndjson'], default=None,
+                            help="Input format; guessed from the file extension when omitted.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--default-user', default=None,
+                            help="Username used for records without a created_by field.")
+        parser.add_argument('--broadcast', action='store_true',
+                            help="Notify connected sockets once the import finishes.")
+
+    def handle(self, *args, **options):
+        try:
+            room = Room.objects.get(id=options['room_id'])
+        except Room.DoesNotExist:
+            raise CommandError(f"Room {options['room_id']} does not exist.")
+
+        default_user = None
+        if options['default_user']:
+            try:
+                default_user = User.objects.get(username=options['default_user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['default_user']} does not exist.")
+
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        fmt = options['format'] or ('ndjson' if options['path'].endswith(('.ndjson', '.jsonl')) else 'json')
+
+        with open(options['path'], encoding='utf-8') as f:
+            records = iter_ndjson(f) if fmt == 'ndjson' else json.load(f)
+            summary = ingest_messages(
+                room,
+                records,
+                default_user=default_user,
+                batch_size=options['batch_size'],
+                broadcast=options['broadcast'],
+            )
+
+        for error in summary['errors']:
+            self.stderr.write(f"record {error['index']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']} messages ({summary['failed']} rejected)."
+        ))
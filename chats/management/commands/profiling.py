@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mysite import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch request and socket-handler profiling on or off on every worker. "
+        "Profiles are merged per endpoint into PROFILING['dir']."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['enable', 'disable', 'status'])
+        parser.add_argument('--rate', type=float, default=0.01,
+                            help="Fraction of requests and handler calls to profile.")
+        parser.add_argument('--user', action='append', default=[], dest='users',
+                            help="Only profile this user (repeatable); overrides --rate.")
+        parser.add_argument('--minutes', type=float, default=10,
+                            help="Switch profiling off again after this long.")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'enable':
+            if not 0 < options['rate'] <= 1:
+                raise CommandError("--rate must be in (0, 1].")
+            profiling.enable(options['rate'], options['users'], options['minutes'])
+            target = ', '.join(options['users']) if options['users'] else f"{options['rate']:.1%} of calls"
+            self.stdout.write(self.style.SUCCESS(f"Profiling {target} for {options['minutes']:g} minutes."))
+        elif options['action'] == 'disable':
+            profiling.disable()
+            self.stdout.write(self.style.SUCCESS("Profiling disabled."))
+        else:
+            config = profiling.cache.get(profiling.CONFIG_CACHE_KEY)
+            self.stdout.write(f"Profiling: {config if config else 'off'}")
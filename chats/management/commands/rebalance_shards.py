@@ -0,0 +1,58 @@
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysite.sharding import HashRing, get_client, shard_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Move presence sets and channel-layer groups to the shard that owns them "
+        "under the current REDIS_SHARDS. Run after adding or removing a shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--channel-prefix', default='asgi',
+                            help="Key prefix used by the channel layer.")
+
+    def handle(self, *args, **options):
+        ring = HashRing(settings.REDIS_SHARDS)
+        moved = 0
+
+        for url in settings.REDIS_SHARDS:
+            presence = get_client(url)
+            for key in presence.scan_iter(match='room:*:users'):
+                target = ring.get_node(shard_key(key.decode('utf-8')))
+                if target != url:
+                    moved += 1
+                    if not options['dry_run']:
+                        self.move_set(presence, get_client(target), key)
+
+            layer = redis.Redis.from_url(url)
+            group_prefix = f"{options['channel_prefix']}:group:"
+            for key in layer.scan_iter(match=f"{group_prefix}*"):
+                group = key.decode('utf-8')[len(group_prefix):]
+                target = ring.get_node(shard_key(group))
+                if target != url:
+                    moved += 1
+                    if not options['dry_run']:
+                        self.move_zset(layer, redis.Redis.from_url(target), key)
+
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} keys."))
+
+    def move_set(self, source, target, key):
+        members = source.smembers(key)
+        if members:
+            target.sadd(key, *members)
+        source.delete(key)
+
+    def move_zset(self, source, target, key):
+        members = dict(source.zrange(key, 0, -1, withscores=True))
+        if members:
+            target.zadd(key, members)
+            ttl = source.ttl(key)
+            if ttl > 0:
+                target.expire(key, ttl)
+        source.delete(key)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chats.unread import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the Redis unread counters from messages and read states."
+
+    def handle(self, *args, **options):
+        rebuild_counters()
+        self.stdout.write(self.style.SUCCESS("Unread counters rebuilt."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from chats.models import Room
+from chats.stats import reconcile_room
+
+
+class Command(BaseCommand):
+    help = "Recompute message counts, author counts and last activity for rooms."
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_ids', nargs='*', help="Rooms to reconcile; all rooms when omitted.")
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.all()
+        if options['room_ids']:
+            rooms = rooms.filter(id__in=options['room_ids'])
+
+        count = 0
+        for room in rooms.iterator():
+            reconcile_room(room)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {count} rooms."))
@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-19 18:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_last_message(apps, schema_editor):
+    Room = apps.get_model('chats', 'Room')
+    Message = apps.get_model('chats', 'Message')
+    for room in Room.objects.all().iterator():
+        latest = Message.objects.filter(room=room).order_by('-created_at').first()
+        if latest is not None:
+            Room.objects.filter(pk=room.pk).update(last_message=latest, last_activity_at=latest.created_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_readstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
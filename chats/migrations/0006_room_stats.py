@@ -0,0 +1,52 @@
+# Generated by Django 5.0 on 2026-10-19 18:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_room_stats(apps, schema_editor):
+    Room = apps.get_model('chats', 'Room')
+    Message = apps.get_model('chats', 'Message')
+    RoomAuthor = apps.get_model('chats', 'RoomAuthor')
+    for room in Room.objects.all().iterator():
+        authors = dict(Message.objects.filter(room=room).values_list('created_by').annotate(count=Count('id')).order_by())
+        RoomAuthor.objects.bulk_create(
+            RoomAuthor(room=room, user_id=user_id, message_count=count) for user_id, count in authors.items()
+        )
+        Room.objects.filter(pk=room.pk).update(message_count=sum(authors.values()), author_count=len(authors))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_room_last_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='author_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='RoomAuthor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chats.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('room', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_room_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_message_changes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='room',
+            name='category',
+            field=models.CharField(choices=[('1', 'Chat'), ('2', 'Video'), ('3', 'Broadcast')], max_length=255),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-19 18:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0009_room_broadcast_category'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['created_by', 'category'], name='chats_room_created_b72fa4_idx'),
+        ),
+    ]
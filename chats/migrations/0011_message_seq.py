@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_seqs(apps, schema_editor):
+    Room = apps.get_model('chats', 'Room')
+    Message = apps.get_model('chats', 'Message')
+    for room_id in Room.objects.values_list('id', flat=True).iterator():
+        seq = 0
+        batch = []
+        for message in Message.objects.filter(room_id=room_id).order_by('created_at', 'id').only('id').iterator():
+            seq += 1
+            message.seq = seq
+            batch.append(message)
+            if len(batch) >= BATCH_SIZE:
+                Message.objects.bulk_update(batch, ['seq'])
+                batch = []
+        if batch:
+            Message.objects.bulk_update(batch, ['seq'])
+        Room.objects.filter(id=room_id).update(message_seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0010_room_owner_category_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='message_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_seqs, migrations.RunPython.noop),
+    ]
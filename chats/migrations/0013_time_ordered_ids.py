@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-19 19:00
+
+import chats.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0012_message_seq_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='id',
+            field=models.UUIDField(default=chats.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='id',
+            field=models.UUIDField(default=chats.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 import uuid
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from .ids import new_id
 
 # Create your models here.
 
@@ -8,12 +11,24 @@ User = get_user_model()
 class Room(models.Model):
     CHOICES = (
         ('1','Chat'),
-        ('2' , 'Video')
+        ('2' , 'Video'),
+        ('3' , 'Broadcast')
     )
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
     name = models.CharField(max_length=255)
     created_by = models.ForeignKey(User , on_delete=models.CASCADE)
     category = models.CharField(max_length=255 , choices=CHOICES)
+    last_message = models.ForeignKey('Message' , null=True , blank=True , on_delete=models.SET_NULL , related_name='+')
+    last_activity_at = models.DateTimeField(null=True , blank=True , db_index=True)
+    message_count = models.PositiveIntegerField(default=0)
+    author_count = models.PositiveIntegerField(default=0)
+    change_seq = models.PositiveBigIntegerField(default=0)
+    message_seq = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_by', 'category']),
+        ]
 
     def __str__(self):
         return self.name
@@ -22,13 +37,109 @@ class Room(models.Model):
 
 
 
-class Message(models.Model):
+class Attachment(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    sha256 = models.CharField(max_length=64 , db_index=True)
+    size = models.PositiveBigIntegerField()
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    created_by = models.ForeignKey(User , on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.filename
+
+
+class Upload(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    created_by = models.ForeignKey(User , on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.filename} ({self.size} bytes)"
+
+
+def allocate_message_seqs(room_id, count):
+    """
+    Reserve ``count`` consecutive message sequence numbers in the room and
+    return the first. The UPDATE locks the room row until the caller's
+    transaction ends, so concurrent writers queue behind it and an insert
+    that rolls back returns its numbers, keeping the sequence dense.
+    """
+    Room.objects.filter(pk=room_id).update(message_seq=F('message_seq') + count)
+    return Room.objects.values_list('message_seq', flat=True).get(pk=room_id) - count + 1
+
+
+class MessageQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        pending = {}
+        for message in objs:
+            if message.seq is None:
+                pending.setdefault(message.room_id, []).append(message)
+        with transaction.atomic(using=self.db):
+            for room_id, messages in pending.items():
+                first = allocate_message_seqs(room_id, len(messages))
+                # Within a batch, sequence follows creation time rather than input order.
+                for offset, message in enumerate(sorted(messages, key=lambda message: message.created_at)):
+                    message.seq = first + offset
+            return super().bulk_create(objs, *args, **kwargs)
+
+
+class Message(models.Model):
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
     room = models.ForeignKey(Room , on_delete=models.CASCADE)
+    seq = models.PositiveBigIntegerField(editable=False)
     message = models.TextField()
     created_by = models.ForeignKey(User , on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    attachments = models.ManyToManyField(Attachment , blank=True , related_name='messages')
+    edited_at = models.DateTimeField(null=True , blank=True)
+    deleted_at = models.DateTimeField(null=True , blank=True)
+    change_seq = models.PositiveBigIntegerField(default=0)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'change_seq']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'seq'], name='chats_message_room_seq_uniq'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.seq is None and self._state.adding:
+            with transaction.atomic(using=kwargs.get('using')):
+                self.seq = allocate_message_seqs(self.room_id, 1)
+                return super().save(*args, **kwargs)
+        return super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.id
+
+class ReadState(models.Model):
+    user = models.ForeignKey(User , on_delete=models.CASCADE)
+    room = models.ForeignKey(Room , on_delete=models.CASCADE)
+    last_read_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'room')
+
+    def __str__(self):
+        return f"{self.user} @ {self.room}"
+
+
+class RoomAuthor(models.Model):
+    room = models.ForeignKey(Room , on_delete=models.CASCADE)
+    user = models.ForeignKey(User , on_delete=models.CASCADE)
+    message_count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        unique_together = ('room', 'user')
 
     def __str__(self):
-        return self.id
\ No newline at end of file
+        return f"{self.user} in {self.room}"
@@ -0,0 +1,178 @@
+"""
+Bounded per-socket send queue.
+
+Handlers enqueue frames and return at once; a writer task per connection
+drains the queue into the socket. When a client reads slower than the room
+produces, the queue fills and SOCKET_SEND_QUEUE['policy'] decides what gives:
+
+- ``drop_oldest``: discard the oldest droppable (ephemeral) frame.
+- ``coalesce``: replace a queued frame carrying the same state key with the
+  newer one, then fall back to ``drop_oldest``.
+- ``close``: disconnect the client with SLOW_CONSUMER_CLOSE_CODE.
+
+A frame that is neither droppable nor coalescable and still does not fit
+closes the connection under every policy, so memory per socket stays bounded.
+"""
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+from mysite import metrics
+
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+POLICIES = ('drop_oldest', 'coalesce', 'close')
+DEFAULT_SEND_QUEUE = {'max_frames': 256, 'max_bytes': 1024 * 1024, 'policy': 'coalesce'}
+
+queued_frames = metrics.gauge('ws_send_queue_frames', 'Frames waiting in socket send queues.')
+queue_depth = metrics.histogram(
+    'ws_send_queue_depth', 'Send queue depth seen when a frame is enqueued.',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+shed_frames = metrics.counter('ws_send_queue_shed_total', 'Frames dropped or coalesced because a socket fell behind.')
+slow_closes = metrics.counter('ws_slow_consumer_closed_total', 'Sockets closed because their send queue overflowed.')
+
+
+class _Entry:
+    __slots__ = ('message', 'size', 'key', 'droppable')
+
+    def __init__(self, message, size, key, droppable):
+        self.message = message
+        self.size = size
+        self.key = key
+        self.droppable = droppable
+
+
+class BoundedSendMixin:
+    """
+    Mix into an ``AsyncWebsocketConsumer`` (before it in the bases).
+
+    ``send()`` takes two extra keyword arguments: ``key`` names the piece of
+    state a frame carries (e.g. a user count) so a newer frame may replace it,
+    and ``droppable`` marks ephemeral frames that may be discarded.
+    """
+
+    send_queue_config = None
+
+    def _init_send_queue(self):
+        config = {**DEFAULT_SEND_QUEUE, **getattr(settings, 'SOCKET_SEND_QUEUE', {}), **(self.send_queue_config or {})}
+        if config['policy'] not in POLICIES:
+            raise ValueError(f"Unknown send queue policy '{config['policy']}'")
+        self._send_config = config
+        self._send_queue = deque()
+        self._send_queue_bytes = 0
+        self._send_ready = asyncio.Event()
+        self._send_closing = False
+        self._send_writer = asyncio.ensure_future(self._drain_send_queue())
+        self._metric_labels = {'consumer': type(self).__name__}
+
+    async def send(self, text_data=None, bytes_data=None, close=False, key=None, droppable=False):
+        if text_data is not None:
+            message = {'type': 'websocket.send', 'text': text_data}
+            size = len(text_data)
+        elif bytes_data is not None:
+            message = {'type': 'websocket.send', 'bytes': bytes_data}
+            size = len(bytes_data)
+        else:
+            raise ValueError("You must pass one of bytes_data or text_data")
+
+        if not hasattr(self, '_send_queue'):
+            self._init_send_queue()
+        if self._send_closing:
+            return
+
+        if self._enqueue(_Entry(message, size, key, droppable)):
+            queue_depth.observe(len(self._send_queue), **self._metric_labels)
+        else:
+            slow_closes.inc(**self._metric_labels)
+            self._discard_queue()
+            await self.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Too slow")
+            return
+
+        if close:
+            await self.close(close)
+
+    async def close(self, code=None, reason=None):
+        if not hasattr(self, '_send_queue'):
+            await super().close(code=code, reason=reason)
+            return
+        if self._send_closing:
+            return
+        # Queue the close behind frames already accepted, e.g. an error
+        # message sent just before rejecting the socket.
+        message = {'type': 'websocket.close'}
+        if code is not None and code is not True:
+            message['code'] = code
+        if reason:
+            message['reason'] = reason
+        self._send_closing = True
+        self._append(_Entry(message, 0, None, False))
+
+    async def websocket_disconnect(self, message):
+        writer = getattr(self, '_send_writer', None)
+        if writer is not None:
+            writer.cancel()
+            self._discard_queue()
+        await super().websocket_disconnect(message)
+
+    def _enqueue(self, entry):
+        config = self._send_config
+        while self._send_queue and (
+            len(self._send_queue) >= config['max_frames']
+            or self._send_queue_bytes + entry.size > config['max_bytes']
+        ):
+            if config['policy'] == 'close':
+                return False
+            if config['policy'] == 'coalesce' and entry.key is not None and self._coalesce(entry):
+                return True
+            if not self._drop_oldest():
+                if entry.droppable:
+                    shed_frames.inc(reason='dropped', **self._metric_labels)
+                    return True
+                return False
+        self._append(entry)
+        return True
+
+    def _append(self, entry):
+        self._send_queue.append(entry)
+        self._send_queue_bytes += entry.size
+        queued_frames.inc(**self._metric_labels)
+        self._send_ready.set()
+
+    def _coalesce(self, entry):
+        for queued in self._send_queue:
+            if queued.key == entry.key:
+                self._send_queue_bytes += entry.size - queued.size
+                queued.message, queued.size = entry.message, entry.size
+                shed_frames.inc(reason='coalesced', **self._metric_labels)
+                return True
+        return False
+
+    def _drop_oldest(self):
+        for queued in self._send_queue:
+            if queued.droppable:
+                self._send_queue.remove(queued)
+                self._send_queue_bytes -= queued.size
+                queued_frames.dec(**self._metric_labels)
+                shed_frames.inc(reason='dropped', **self._metric_labels)
+                return True
+        return False
+
+    def _discard_queue(self):
+        queued_frames.dec(len(self._send_queue), **self._metric_labels)
+        self._send_queue.clear()
+        self._send_queue_bytes = 0
+
+    async def _drain_send_queue(self):
+        while True:
+            if not self._send_queue:
+                self._send_ready.clear()
+                await self._send_ready.wait()
+                continue
+            entry = self._send_queue.popleft()
+            self._send_queue_bytes -= entry.size
+            queued_frames.dec(**self._metric_labels)
+            await self.base_send(entry.message)
+            if entry.message['type'] == 'websocket.close':
+                return
@@ -0,0 +1,49 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+class RoomPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class MessagePagination(BasePagination):
+    """
+    Page-number pagination for room history without a COUNT query: one extra
+    row is fetched to tell whether another page follows. Next and previous are
+    page numbers rather than links, so the body of a page depends only on the
+    messages in it and can be cached (see chats.history).
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_params(self, request):
+        try:
+            page = int(request.query_params.get('page', 1))
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise NotFound('Invalid page.')
+        if page < 1 or page_size < 1:
+            raise NotFound('Invalid page.')
+        return page, min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page, self.page_size = self.get_page_params(request)
+        start = (self.page - 1) * self.page_size
+        rows = list(queryset[start:start + self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_paginated_data(self, data):
+        return {
+            'page': self.page,
+            'next': self.page + 1 if self.has_next else None,
+            'previous': self.page - 1 if self.page > 1 else None,
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
@@ -0,0 +1,38 @@
+from mysite.executors import run_async
+from mysite.sharding import get_shard_client
+
+
+def presence_key(group_name):
+    return f"room:{group_name}:users"
+
+
+def _join(group_name, username):
+    pipe = get_shard_client(group_name).pipeline()
+    pipe.sadd(presence_key(group_name), username)
+    pipe.scard(presence_key(group_name))
+    return pipe.execute()[1]
+
+
+def _leave(group_name, username):
+    pipe = get_shard_client(group_name).pipeline()
+    pipe.srem(presence_key(group_name), username)
+    pipe.scard(presence_key(group_name))
+    return pipe.execute()[1]
+
+
+def _members(group_name):
+    return [user.decode('utf-8') for user in get_shard_client(group_name).smembers(presence_key(group_name))]
+
+
+async def join(group_name, username):
+    """Add ``username`` to the room's presence set and return the new size."""
+    return await run_async('redis', _join, group_name, username)
+
+
+async def leave(group_name, username):
+    """Remove ``username`` from the room's presence set and return the new size."""
+    return await run_async('redis', _leave, group_name, username)
+
+
+async def members(group_name):
+    return await run_async('redis', _members, group_name)
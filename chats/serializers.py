@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from . models import Room , Message
+from django.conf import settings
+from . models import Room , Message , RoomAuthor , Attachment , Upload
 from authenticate.serializers import UserSerializer
 
 
@@ -9,13 +10,96 @@ class RoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = Room
         fields = '__all__'
-        read_only_fields = ['created_by']
+        read_only_fields = ['created_by', 'last_message', 'last_activity_at', 'message_count', 'author_count', 'change_seq', 'message_seq']
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    id = serializers.CharField()
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attachment
+        fields = ('id', 'filename', 'content_type', 'size', 'sha256', 'url')
+
+    def get_url(self, attachment):
+        return f"/api/chat/attachments/{attachment.id}"
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    content_type = serializers.CharField(max_length=255, default='application/octet-stream')
+    size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = Upload
+        fields = ('id', 'filename', 'content_type', 'size')
+        read_only_fields = ('id',)
+
+    def validate_size(self, value):
+        if value > settings.ATTACHMENT_MAX_SIZE:
+            raise serializers.ValidationError(f"Attachments are limited to {settings.ATTACHMENT_MAX_SIZE} bytes.")
+        return value
 
 
 class MessageSerializer(serializers.ModelSerializer):
     id = serializers.CharField()
     room = serializers.CharField()
     created_by = UserSerializer(read_only=True)
+    attachments = AttachmentSerializer(many=True, read_only=True)
+    class Meta:
+        model = Message
+        fields = '__all__'
+
+class MessageChangeSerializer(serializers.ModelSerializer):
+    type = serializers.SerializerMethodField()
+    id = serializers.CharField()
+    seq = serializers.IntegerField(source='change_seq')
+
+    class Meta:
+        model = Message
+        fields = ('type', 'id', 'seq', 'message', 'edited_at', 'deleted_at')
+
+    def get_type(self, message):
+        return 'message_deleted' if message.deleted_at else 'message_edited'
+
+
+class MessageEditSerializer(serializers.Serializer):
+    message = serializers.CharField()
+
+
+class MessageImportSerializer(serializers.Serializer):
+    message = serializers.CharField()
+    created_by = serializers.CharField(required=False)
+    created_at = serializers.DateTimeField(required=False)
+
+
+class LastMessageSerializer(serializers.ModelSerializer):
+    id = serializers.CharField()
+    created_by = serializers.CharField(source='created_by.username')
+
     class Meta:
         model = Message
-        fields = '__all__'
\ No newline at end of file
+        fields = ('id', 'message', 'created_by', 'created_at')
+
+
+class RoomStatsSerializer(serializers.ModelSerializer):
+    top_authors = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Room
+        fields = ('id', 'message_count', 'author_count', 'last_activity_at', 'top_authors')
+
+    def get_top_authors(self, room):
+        authors = RoomAuthor.objects.filter(room=room).select_related('user').order_by('-message_count')[:5]
+        return [{'username': author.user.username, 'message_count': author.message_count} for author in authors]
+
+
+class InboxRoomSerializer(serializers.ModelSerializer):
+    last_message = LastMessageSerializer(read_only=True)
+    unread = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Room
+        fields = ('id', 'name', 'category', 'created_by', 'last_activity_at', 'last_message', 'unread')
+
+    def get_unread(self, room):
+        return self.context.get('unread', {}).get(str(room.id), 0)
@@ -0,0 +1,14 @@
+from . import stats, unread
+
+
+def messages_created(room, messages):
+    """Write-path bookkeeping for ``messages`` just inserted into ``room``."""
+    if not messages:
+        return
+    stats.record_messages(room, messages)
+    unread.record_messages(room.pk, len(messages))
+
+
+def message_deleted(room, message):
+    """Write-path bookkeeping for ``message`` just soft-deleted from ``room``."""
+    stats.record_deletion(room, message)
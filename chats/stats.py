@@ -0,0 +1,69 @@
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+
+from .models import Message, Room, RoomAuthor
+
+
+def record_messages(room, messages):
+    """
+    Fold ``messages`` into the room's counters: one UPDATE per author already
+    seen in the room, one INSERT per new author and a single UPDATE on the room.
+    """
+    authors = Counter(message.created_by_id for message in messages)
+    latest = max(messages, key=lambda message: message.created_at)
+    new_authors = 0
+
+    with transaction.atomic():
+        for user_id, count in authors.items():
+            updated = RoomAuthor.objects.filter(room=room, user_id=user_id).update(message_count=F('message_count') + count)
+            if updated:
+                continue
+            _, created = RoomAuthor.objects.get_or_create(room=room, user_id=user_id, defaults={'message_count': count})
+            if created:
+                new_authors += 1
+            else:
+                RoomAuthor.objects.filter(room=room, user_id=user_id).update(message_count=F('message_count') + count)
+
+        newer = Q(last_activity_at__isnull=True) | Q(last_activity_at__lte=latest.created_at)
+        Room.objects.filter(pk=room.pk).update(
+            message_count=F('message_count') + len(messages),
+            author_count=F('author_count') + new_authors,
+            last_message=Case(When(newer, then=Value(latest.pk, output_field=models.UUIDField())), default=F('last_message')),
+            last_activity_at=Case(When(newer, then=Value(latest.created_at)), default=F('last_activity_at')),
+        )
+
+
+def record_deletion(room, message):
+    """Take a deleted message out of the counters and, if it was the latest, out of ``last_message``."""
+    with transaction.atomic():
+        authors = RoomAuthor.objects.filter(room=room, user_id=message.created_by_id)
+        authors.update(message_count=F('message_count') - 1)
+        emptied, _ = authors.filter(message_count=0).delete()
+
+        updates = {'message_count': F('message_count') - 1, 'author_count': F('author_count') - emptied}
+        if Room.objects.filter(pk=room.pk, last_message=message).exists():
+            latest = Message.objects.filter(room=room, deleted_at__isnull=True).order_by('-created_at').first()
+            updates['last_message'] = latest
+            updates['last_activity_at'] = latest.created_at if latest else None
+        Room.objects.filter(pk=room.pk).update(**updates)
+
+
+def reconcile_room(room):
+    """Recompute the room's counters and author rows from its messages."""
+    messages = Message.objects.filter(room=room, deleted_at__isnull=True)
+    authors = dict(messages.values_list('created_by').annotate(count=Count('id')).order_by())
+    latest = messages.order_by('-created_at').first()
+
+    with transaction.atomic():
+        RoomAuthor.objects.filter(room=room).delete()
+        RoomAuthor.objects.bulk_create(
+            RoomAuthor(room=room, user_id=user_id, message_count=count) for user_id, count in authors.items()
+        )
+        Room.objects.filter(pk=room.pk).update(
+            message_count=sum(authors.values()),
+            author_count=len(authors),
+            last_message=latest,
+            last_activity_at=latest.created_at if latest else None,
+        )
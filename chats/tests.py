@@ -1,5 +1,5 @@
 import json
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
 from django.test import TestCase
 from django.urls import reverse
@@ -7,22 +7,84 @@ from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from channels.testing import WebsocketCommunicator
-from channels.layers import get_channel_layer
-from asgiref.sync import sync_to_async
-
-from chat.views import CreateRoomView, GetRoom, GetRoomById, GetMessages
-from chat.consumers import ChatConsumer, VideoCallConsumer
-
-mock_redis_client = MagicMock()
-mock_redis_client.sadd.return_value = 1
-mock_redis_client.srem.return_value = 1
-mock_redis_client.scard.return_value = 1
-mock_redis_client.smembers.return_value = {b'testuser1'}
-
-@patch('django_redis.get_redis_connection', return_value=mock_redis_client)
+from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers, get_channel_layer
+from asgiref.sync import async_to_sync, sync_to_async
+
+from chats.consumers import MAX_CHAT_USERS, MAX_VIDEO_USERS
+from chats.presence import presence_key
+from chats.models import Room, Message, ReadState
+from chats import unread
+from chats.ingest import ingest_messages
+from chats.services import messages_created
+from django_redis import get_redis_connection
+from django.core.management import call_command
+from django.core.cache import cache
+from mysite.sharding import HashRing, ShardedRedisChannelLayer, shard_key
+from chats.routers import websocket_urlpatterns
+from channels.routing import URLRouter
+from channels.generic.websocket import AsyncWebsocketConsumer
+from chats.outbound import BoundedSendMixin, SLOW_CONSUMER_CLOSE_CODE, slow_closes
+import asyncio
+import io
+import logging
+from mysite.log import QueueLogHandler, SamplingFilter
+from mysite import admission
+from mysite.querybudget import QueryBudgetExceeded, query_budget
+from mysite import profiling
+from mysite import looplag
+from mysite.looplag import get_loop_monitor, lag_histogram, stalls
+import time
+import pstats
+from django.test import override_settings
+import hashlib
+import shutil
+import tempfile
+from pathlib import Path
+from chats.models import Attachment
+from chats.attachments import blob_path
+import threading
+import uuid
+from chats import broadcast
+from chats.ids import new_id, uuid7, uuid7_time
+import gzip
+from chats.changes import delete_message, edit_message
+from mysite.executors import BoundedExecutor, ExecutorSaturated, get_executor, run_async, queue_depth, in_flight_jobs
+
+# Consumers run ORM calls on the 'orm' pool; keep them on the test thread so
+# they see the test case's transaction.
+TEST_EXECUTORS = {'orm': {'thread_sensitive': True}}
+
+
+def reset_socket_state():
+    """
+    Drop per-process socket state that outlives a test's event loop: the
+    admission count, broadcast hubs and loop monitors bound to that loop, and
+    the channel layer with its groups, buffers and receive lock.
+    """
+    admission._active = 0
+    broadcast._hubs.clear()
+    looplag._monitors.clear()
+    layer = channel_layers.backends.pop(DEFAULT_CHANNEL_LAYER, None)
+    if layer is not None:
+        async_to_sync(layer.flush)()
+
+
+def isolate_socket_state(test):
+    reset_socket_state()
+    test.addCleanup(reset_socket_state)
+
+def presence_store(group_name):
+    return get_redis_connection('default')
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
 class BaseConsumerTest(APITestCase):
     def setUp(self):
+        isolate_socket_state(self)
         super().setUp()
+        shard_client = patch('chats.presence.get_shard_client', side_effect=presence_store)
+        shard_client.start()
+        self.addCleanup(shard_client.stop)
         self.User = get_user_model()
         self.test_user = self.User.objects.create_user(
             username='testuser', email='test@example.com', password='password123'
@@ -30,6 +92,7 @@ class BaseConsumerTest(APITestCase):
         self.test_user2 = self.User.objects.create_user(
             username='testuser2', email='test2@example.com', password='password123'
         )
+        self.application = URLRouter(websocket_urlpatterns)
         self.channel_layer = get_channel_layer()
 
     def get_auth_communicator(self, path, user):
@@ -40,127 +103,15 @@ class BaseConsumerTest(APITestCase):
         communicator.scope['user'] = user
         return communicator
 
-class MockRoom:
-    objects = MagicMock()
-    DoesNotExist = type('DoesNotExist', (Exception,), {})
-
-    def __init__(self, id, room_name, category, created_by=None):
-        self.id = id
-        self.room_name = room_name
-        self.category = category
-        self.created_by = created_by
-        self.created_at = '2023-01-01T12:00:00Z'
-
-class MockMessage:
-    objects = MagicMock()
-
-    def __init__(self, id, room, created_by, message):
-        self.id = id
-        self.room = room
-        self.created_by = created_by
-        self.message = message
-        self.created_at = '2023-01-01T12:00:00Z'
-
-class MockRoomSerializer:
-    def __init__(self, instance=None, data=None, many=False):
-        self.instance = instance
-        self.data = data
-        self.many = many
-        self.errors = {}
-        if data:
-            if not data.get('room_name'):
-                self.errors['room_name'] = ['This field is required.']
-            if not data.get('category'):
-                self.errors['category'] = ['This field is required.']
-
-    def is_valid(self, raise_exception=False):
-        if self.errors and raise_exception:
-            raise Exception("Validation Error")
-        return not bool(self.errors)
-
-    def save(self, created_by):
-        if not self.errors:
-            self.instance = MockRoom(
-                id='mock-room-id-123',
-                room_name=self.data['room_name'],
-                category=self.data['category'],
-                created_by=created_by
-            )
-            return self.instance
-        return None
-
-    @property
-    def data(self):
-        if self.instance:
-            if self.many:
-                return [{
-                    'id': room.id,
-                    'room_name': room.room_name,
-                    'category': room.category,
-                    'created_by': room.created_by.username if room.created_by else None
-                } for room in self.instance]
-            return {
-                'id': self.instance.id,
-                'room_name': self.instance.room_name,
-                'category': self.instance.category,
-                'created_by': self.instance.created_by.username if self.instance.created_by else None
-            }
-        return self._data
-
-    @data.setter
-    def data(self, value):
-        self._data = value
-
-class MockMessageSerializer:
-    def __init__(self, instance=None, data=None, many=False):
-        self.instance = instance
-        self.data = data
-        self.many = many
-
-    def is_valid(self):
-        return True
-
-    def save(self, room, created_by):
-        self.instance = MockMessage(
-            id='mock-msg-id-123',
-            room=room,
-            created_by=created_by,
-            message=self.data['message']
-        )
-        return self.instance
-
-    @property
-    def data(self):
-        if self.instance:
-            if self.many:
-                return [{
-                    'id': msg.id,
-                    'room_id': msg.room.id,
-                    'created_by': msg
-
-.created_by.username,
-                    'message': msg.message,
-                    'created_at': msg.created_at
-                } for msg in self.instance]
-            return {
-                'id': self.instance.id,
-                'room_id': self.instance.room.id,
-                'created_by': self.instance.created_by.username,
-                'message': self.instance.message,
-                'created_at': self.instance.created_at
-            }
-        return self._data
-
-    @data.setter
-    def data(self, value):
-        self._data = value
-
-@patch('chat.models.Room', new=MockRoom)
-@patch('chat.models.Message', new=MockMessage)
-@patch('chat.serializers.RoomSerializer', new=MockRoomSerializer)
-@patch('chat.serializers.MessageSerializer', new=MockMessageSerializer)
+    def fill_room(self, group_name, count):
+        get_redis_connection('default').sadd(presence_key(group_name), *[f'user{i}' for i in range(count)])
+        self.addCleanup(get_redis_connection('default').delete, presence_key(group_name))
+
+
 class ChatAPITests(APITestCase):
     def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
         self.User = get_user_model()
         self.user1 = self.User.objects.create_user(
             username='chatuser1', email='chat1@example.com', password='password123'
@@ -170,58 +121,36 @@ class ChatAPITests(APITestCase):
         )
         self.client.force_authenticate(user=self.user1)
 
-        self.chat_room = MockRoom(id='chat-room-1', room_name='General Chat', category='1', created_by=self.user1)
-        self.video_room = MockRoom(id='video-room-2', room_name='Video Call', category='2', created_by=self.user1)
-
-        MockRoom.objects.get.side_effect = lambda **kwargs: {
-            'id': self.chat_room.id
-        }.get(kwargs.get('id')) or {
-            'id': self.video_room.id
-        }.get(kwargs.get('id')) or MockRoom.DoesNotExist()
-
-        MockRoom.objects.filter.return_value = [self.chat_room, self.video_room]
-        MockRoom.objects.filter.side_effect = lambda **kwargs: [
-            room for room in [self.chat_room, self.video_room]
-            if (kwargs.get('created_by') == room.created_by and
-                ('category' not in kwargs or kwargs.get('category') == room.category) and
-                ('room_name__icontains' not in kwargs or kwargs.get('room_name__icontains').lower() in room.room_name.lower()))
-        ]
-
-        self.message1 = MockMessage(id='msg1', room=self.chat_room, created_by=self.user1, message='Hello world!')
-        self.message2 = MockMessage(id='msg2', room=self.chat_room, created_by=self.user2, message='Hi there!')
-        MockMessage.objects.filter.return_value = [self.message1, self.messagebygg
-
-.message2]
-        MockMessage.objects.filter.side_effect = lambda **kwargs: [
-            msg for msg in [self.message1, self.message2]
-            if kwargs.get('room__id') == msg.room.id
-        ]
+        self.chat_room = Room.objects.create(name='General Chat', category='1', created_by=self.user1)
+        self.video_room = Room.objects.create(name='Video Call', category='2', created_by=self.user1)
+        self.message1 = Message.objects.create(room=self.chat_room, created_by=self.user1, message='Hello world!')
+        self.message2 = Message.objects.create(room=self.chat_room, created_by=self.user2, message='Hi there!')
 
     def test_create_room_success(self):
         url = reverse('create-room')
         data = {
-            'room_name': 'New Test Chat Room',
+            'name': 'New Test Chat Room',
             'category': '1'
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertIn('id', response.data)
-        self.assertEqual(response.data['room_name'], 'New Test Chat Room')
+        self.assertEqual(response.data['name'], 'New Test Chat Room')
         self.assertEqual(response.data['category'], '1')
-        self.assertEqual(response.data['created_by'], self.user1.username)
+        self.assertEqual(response.data['created_by'], self.user1.pk)
 
     def test_create_room_invalid_data(self):
         url = reverse('create-room')
         data = {
-            'room_name': '',
+            'name': '',
             'category': '1'
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('room_name', response.data)
+        self.assertIn('name', response.data)
 
         data = {
-            'room_name': 'Valid Name',
+            'name': 'Valid Name',
             'category': ''
         }
         response = self.client.post(url, data, format='json')
@@ -232,33 +161,33 @@ class ChatAPITests(APITestCase):
         url_chat = reverse('get-rooms') + '?category=chat'
         response_chat = self.client.get(url_chat, format='json')
         self.assertEqual(response_chat.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response_chat.data), 1)
-        self.assertEqual(response_chat.data[0]['category'], '1')
-        self.assertEqual(response_chat.data[0]['room_name'], 'General Chat')
+        self.assertEqual(len(response_chat.data['results']), 1)
+        self.assertEqual(response_chat.data['results'][0]['category'], '1')
+        self.assertEqual(response_chat.data['results'][0]['name'], 'General Chat')
 
         url_video = reverse('get-rooms') + '?category=video'
         response_video = self.client.get(url_video, format='json')
         self.assertEqual(response_video.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response_video.data), 1)
-        self.assertEqual(response_video.data[0]['category'], '2')
-        self.assertEqual(response_video.data[0]['room_name'], 'Video Call')
+        self.assertEqual(len(response_video.data['results']), 1)
+        self.assertEqual(response_video.data['results'][0]['category'], '2')
+        self.assertEqual(response_video.data['results'][0]['name'], 'Video Call')
 
     def test_get_rooms_default_category(self):
         url = reverse('get-rooms')
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['category'], '1')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['category'], '1')
 
     def test_get_room_by_id_success(self):
         url = reverse('get-room-by-id', args=[self.chat_room.id])
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['id'], self.chat_room.id)
-        self.assertEqual(response.data['room_name'], 'General Chat')
+        self.assertEqual(response.data['id'], str(self.chat_room.id))
+        self.assertEqual(response.data['name'], 'General Chat')
 
     def test_get_room_by_id_not_found(self):
-        url = reverse('get-room-by-id', args=['non-existent-id'])
+        url = reverse('get-room-by-id', args=[uuid.uuid4()])
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn('error', response.data)
@@ -270,247 +199,1310 @@ class ChatAPITests(APITestCase):
         self.assertEqual(len(response.data), 2)
         self.assertEqual(response.data[0]['message'], 'Hello world!')
         self.assertEqual(response.data[1]['message'], 'Hi there!')
-        self.assertEqual(response.data[0]['created_by'], self.user1.username)
+        self.assertEqual(response.data[0]['created_by']['username'], self.user1.username)
 
     def test_get_messages_no_messages_found(self):
-        empty_room = MockRoom(id='empty-room-id', room_name='Empty Room', category='1', created_by=self.user1)
-        MockMessage.objects.filter.return_value = []
+        empty_room = Room.objects.create(name='Empty Room', category='1', created_by=self.user1)
 
         url = reverse('get-messages', args=[empty_room.id])
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)
 
+
 class ChatConsumerTests(BaseConsumerTest):
-    async def setUp(self):
-        await super().setUp()
-        self.chat_room_id = 'test-chat-room-123'
-        await sync_to_async(MockRoom.objects.get.reset_mock)()
-        await sync_to_async(MockRoom.objects.get.return_value.__setattr__)('id', self.chat_room_id)
-        await sync_to_async(MockRoom.objects.get.return_value.__setattr__)('category', '1')
+    def setUp(self):
+        super().setUp()
+        self.chat_room = Room.objects.create(name='Test Chat', category='1', created_by=self.test_user)
+        self.chat_room_id = str(self.chat_room.id)
 
     async def test_chat_consumer_connect_success(self):
-        with patch('chat.consumers.ChatConsumer.get_chat_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.chat_room_id, room_name="Test Chat", category='1', created_by=self.test_user))):
-            communicator = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
-            connected, subprotocol = await communicator.connect()
-            self.assertTrue(connected)
-            await communicator.disconnect()
+        communicator = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
 
     async def test_chat_consumer_connect_authentication_fail(self):
-        communicator = 我们bsocketCommunicator(
+        communicator = WebsocketCommunicator(
             application=self.application,
             path=f'/ws/chat/{self.chat_room_id}/'
         )
         communicator.scope['user'] = MagicMock(is_authenticated=False)
-        connected, subprotocol = await communicator.connect()
+        connected, close_code = await communicator.connect()
         self.assertFalse(connected)
-        self.assertEqual(communicator.scope['close_code'], 4001)
+        self.assertEqual(close_code, 4001)
 
     async def test_chat_consumer_connect_room_full(self):
-        mock_redis_client.scard.return_value = 11
-        with patch('chat.consumers.ChatConsumer.get_chat_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.chat_room_id, room_name="Full Chat", category='1', created_by=self.test_user))):
-            communicator = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
-            connected, subprotocol = await communicator.connect()
-            self.assertTrue(connected)
-            response = await communicator.receive_json()
-            self.assertEqual(response['type'], 'error')
-            self.assertIn('room is full', response['message'])
-            await communicator.wait_until_closed()
-            self.assertFalse(communicator.connected)
-            self.assertEqual(communicator.scope['close_code'], 4002)
-        mock_redis_client.scard.return_value = 1
+        await sync_to_async(self.fill_room)(f'chat_{self.chat_room_id}', MAX_CHAT_USERS)
+        communicator = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'error')
+        self.assertIn('room is full', response['message'])
+        self.assertEqual((await communicator.receive_output())['code'], 4002)
 
     async def test_chat_consumer_send_and_receive_message(self):
-        with patch('chat.consumers.ChatConsumer.get_chat_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.chat_room_id, room_name="Test Chat", category='1', created_by=self.test_user))):
-            communicator1 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
-            communicator2 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user2)
+        communicator1 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
+        communicator2 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user2)
 
-            connected1, _ = await communicator1.connect()
-            connected2, _ = await communicator2.connect()
-            self.assertTrue(connected1)
-            self.assertTrue(connected2)
+        connected1, _ = await communicator1.connect()
+        self.assertEqual((await communicator1.receive_json_from())['count'], 1)
+        connected2, _ = await communicator2.connect()
+        self.assertTrue(connected1)
+        self.assertTrue(connected2)
+        self.assertEqual((await communicator1.receive_json_from())['count'], 2)
+        self.assertEqual((await communicator2.receive_json_from())['count'], 2)
 
-            await communicator1.receive_json()
-            await communicator2.receive_json()
+        test_message = "Hello, chat room!"
+        await communicator1.send_json_to({'message': test_message})
 
-            test_message = "Hello, chat room!"
-            await communicator1.send_json_to({'message': test_message})
+        response2 = await communicator2.receive_json_from()
+        self.assertEqual(response2['message'], test_message)
+        self.assertEqual(response2['created_by']['username'], self.test_user.username)
 
-            response2 = await communicator2.receive_json()
-            self.assertEqual(response2['id'], 'mock-msg-id-123')
-            self.assertEqual(response2['message'], test_message)
-            self.assertEqual(response2['created_by'], self.test_user.username)
+        response1 = await communicator1.receive_json_from()
+        self.assertEqual(response1['id'], response2['id'])
+        self.assertEqual(response1['message'], test_message)
+        self.assertEqual(response1['created_by']['username'], self.test_user.username)
 
-            response1 = await communicator1.receive_json()
-            self.assertEqual(response1['id'], 'mock-msg-id-123')
-            self.assertEqual(response1['message'], test_message)
-            self.assertEqual(response1['created_by'], self.test_user.username)
-
-            await communicator1.disconnect()
-            await communicator2.disconnect()
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+        self.assertEqual(await sync_to_async(Message.objects.filter(room=self.chat_room).count)(), 1)
 
     async def test_chat_consumer_user_count_update(self):
-        with patch('chat.consumers.ChatConsumer.get_chat_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.chat_room_id, room_name="Test Chat", category='1', created_by=self.test_user))):
-            mock_redis_client.scard.return_value = 1
-
-            communicator1 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
-            connected1, _ = await communicator1.connect()
-            self.assertTrue(connected1)
-            initial_count_msg = await communicator1.receive_json()
-            self.assertEqual(initial_count_msg['type'], 'user_count')
-            self.assertEqual(initial_count_msg['count'], 1)
-
-            mock_redis_client.scard.return_value = 2
-            communicator2 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user2)
-            connected2, _ = await communicator2.connect()
-            self.assertTrue(connected2)
-
-            count_update_msg1 = await communicator1.receive_json()
-            self.assertEqual(count_update_msg1['type'], 'user_count')
-            self.assertEqual(count_update_msg1['count'], 2)
-
-            count_update_msg2 = await communicator2.receive_json()
-            self.assertEqual(count_update_msg2['type'], 'user_count')
-            self.assertEqual(count_update_msg2['count'], 2)
-
-            await communicator1.disconnect()
-            mock_redis_client.scard.return_value = 1
-            count_update_msg2_disc = await communicator2.receive_json()
-            self.assertEqual(count_update_msg2_disc['type'], 'user_count')
-            self.assertEqual(count_update_msg2_disc['count'], 1)
-
-            await communicator2.disconnect()
-        mock_redis_client.scard.return_value = 1
+        communicator1 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user)
+        connected1, _ = await communicator1.connect()
+        self.assertTrue(connected1)
+        initial_count_msg = await communicator1.receive_json_from()
+        self.assertEqual(initial_count_msg['type'], 'user_count')
+        self.assertEqual(initial_count_msg['count'], 1)
 
-class VideoCallConsumerTests(BaseConsumerTest):
-    async def setUp(self):
-        await super().setUp()
-        self.video_room_id = 'test-video-room-456'
-        await sync_to_async(MockRoom.objects.get.reset_mock)()
-        await sync_to_async(MockRoom.objects.get.return_value.__setattr__)('id', self.video_room_id)
-        await sync_to_async(MockRoom.objects.get.return_value.__setattr__)('category', '2')
+        communicator2 = self.get_auth_communicator(f'/ws/chat/{self.chat_room_id}/', self.test_user2)
+        connected2, _ = await communicator2.connect()
+        self.assertTrue(connected2)
 
-        mock_redis_client.smembers.return_value = set()
-        mock_redis_client.sadd.return_value = 1
-        mock_redis_client.srem.return_value = 1
+        count_update_msg1 = await communicator1.receive_json_from()
+        self.assertEqual(count_update_msg1['type'], 'user_count')
+        self.assertEqual(count_update_msg1['count'], 2)
+
+        count_update_msg2 = await communicator2.receive_json_from()
+        self.assertEqual(count_update_msg2['type'], 'user_count')
+        self.assertEqual(count_update_msg2['count'], 2)
+
+        await communicator1.disconnect()
+        count_update_msg2_disc = await communicator2.receive_json_from()
+        self.assertEqual(count_update_msg2_disc['type'], 'user_count')
+        self.assertEqual(count_update_msg2_disc['count'], 1)
+
+        await communicator2.disconnect()
+
+
+class VideoCallConsumerTests(BaseConsumerTest):
+    def setUp(self):
+        super().setUp()
+        self.video_room = Room.objects.create(name='Test Video', category='2', created_by=self.test_user)
+        self.video_room_id = str(self.video_room.id)
+
+    async def connect_both(self):
+        communicator1 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
+        communicator2 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user2)
+        await communicator1.connect()
+        await communicator1.receive_json_from()
+        await communicator2.connect()
+        await communicator2.receive_json_from()
+        await communicator1.receive_json_from()
+        return communicator1, communicator2
 
     async def test_video_consumer_connect_success(self):
-        with patch('chat.consumers.VideoCallConsumer.get_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.video_room_id, room_name="Test Video", category='2', created_by=self.test_user))):
-            communicator = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
-            connected, subprotocol = await communicator.connect()
-            self.assertTrue(connected)
-            response = await communicator.receive_json()
-            self.assertEqual(response['type'], 'existing_users')
-            self.assertEqual(response['users'], [])
+        communicator = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'existing_users')
+        self.assertEqual(response['users'], [])
 
-            await communicator.disconnect()
+        await communicator.disconnect()
 
     async def test_video_consumer_connect_room_full(self):
-        mock_redis_client.smembers.return_value = {f'user{i}'.encode('utf-8') for i in range(VideoCallConsumer.MAX_VIDEO_USERS)}
-        with patch('chat.consumers.VideoCallConsumer.get_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.video_room_id, room_name="Full Video", category='2', created_by=self.test_user))):
-            communicator = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
-            connected, subprotocol = await communicator.connect()
-            self.assertTrue(connected)
-            response = await communicator.receive_json()
-            self.assertEqual(response['type'], 'error')
-            self.assertIn('room is currently full', response['message'])
-            await communicator.wait_until_closed()
-            self.assertFalse(communicator.connected)
-            self.assertEqual(communicator.scope['close_code'], 4002)
-        mock_redis_client.smembers.return_value = set()
+        await sync_to_async(self.fill_room)(f'video_call_{self.video_room_id}', MAX_VIDEO_USERS)
+        communicator = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'error')
+        self.assertIn('room is currently full', response['message'])
+        self.assertEqual((await communicator.receive_output())['code'], 4002)
 
     async def test_video_consumer_new_peer_broadcast(self):
-        mock_redis_client.smembers.return_value = set()
-        with patch('chat.consumers.VideoCallConsumer.get_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.video_room_id, room_name="Test Video", category='2', created_by=self.test_user))):
-            communicator1 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
-            connected1, _ = await communicator1.connect()
-            self.assertTrue(connected1)
-            await communicator1.receive_json()
-
-            mock_redis_client.smembers.return_value = {self.test_user.username.encode('utf-8')}
-            communicator2 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user2)
-            connected2, _ = await communicator2.connect()
-            self.assertTrue(connected2)
-            await communicator2.receive_json()
-
-            new_peer_msg = await communicator1.receive_json()
-            self.assertEqual(new_peer_msg['type'], 'new_peer')
-            self.assertEqual(new_peer_msg['username'], self.test_user2.username)
-
-            await communicator1.disconnect()
-            await communicator2.disconnect()
-        mock_redis_client.smembers.return_value = set()
+        communicator1 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
+        connected1, _ = await communicator1.connect()
+        self.assertTrue(connected1)
+        await communicator1.receive_json_from()
 
-    async def test_video_consumer_user_left_broadcast(self):
-        with patch('chat.consumers.VideoCallConsumer.get_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.video_room_id, room_name="Test Video", category='2', created_by=self.test_user))):
-            communicator1 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
-            communicator2 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user2)
+        communicator2 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user2)
+        connected2, _ = await communicator2.connect()
+        self.assertTrue(connected2)
+        existing = await communicator2.receive_json_from()
+        self.assertEqual(existing['users'], [self.test_user.username])
 
-            await communicator1.connect()
-            await communicator2.connect()
+        new_peer_msg = await communicator1.receive_json_from()
+        self.assertEqual(new_peer_msg['type'], 'new_peer')
+        self.assertEqual(new_peer_msg['username'], self.test_user2.username)
+        self.assertTrue(await communicator2.receive_nothing())
 
-            await communicator1.receive_json()
-            await communicator2.receive_json()
-            await communicator1.receive_json()
-            await communicator2.receive_json()
+        await communicator1.disconnect()
+        await communicator2.disconnect()
 
-            mock_redis_client.srem.return_value = 1
-            await communicator1.disconnect()
+    async def test_video_consumer_user_left_broadcast(self):
+        communicator1, communicator2 = await self.connect_both()
 
-            user_left_msg = await communicator2.receive_json()
-            self.assertEqual(user_left_msg['type'], 'user_left')
-            self.assertEqual(user_left_msg['from'], self.test_user.username)
+        await communicator1.disconnect()
 
-            await communicator2.disconnect()
-        mock_redis_client.smembers.return_value = set()
+        user_left_msg = await communicator2.receive_json_from()
+        self.assertEqual(user_left_msg['type'], 'user_left')
+        self.assertEqual(user_left_msg['from'], self.test_user.username)
+
+        await communicator2.disconnect()
 
     async def test_video_consumer_relay_signaling_message(self):
-        with patch('chat.consumers.VideoCallConsumer.get_room',
-                   new_callable=sync_to_async(lambda: MockRoom(id=self.video_room_id, room_name="Test Video", category='2', created_by=self.test_user))):
-            communicator1 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user)
-            communicator2 = self.get_auth_communicator(f'/ws/video-call/{self.video_room_id}/', self.test_user2)
-
-            await communicator1.connect()
-            await communicator2.connect()
-
-            await communicator1.receive_json()
-            await communicator2.receive_json()
-            await communicator1.receive_json()
-            await communicator2.receive_json()
-
-            offer_payload = {
-                'type': 'offer',
-                'sdp': 'v=0...',
-                'to': self.test_user2.username
-            }
-            await communicator1.send_json_to(offer_payload)
-
-            received_offer = await communicator2.receive_json()
-            self.assertEqual(received_offer['type'], 'offer')
-            self.assertEqual(received_offer['sdp'], 'v=0...')
-            self.assertEqual(received_offer['from'], self.test_user.username)
-            self.assertEqual(received_offer['to'], self.test_user2.username)
-
-            answer_payload = {
-                'type': 'answer',
-                'sdp': 'v=0...',
-                'to': self.test_user.username
-            }
-            await communicator2.send_json_to(answer_payload)
-
-            received_answer = await communicator1.receive_json()
-            self.assertEqual(received_answer['type'], 'answer')
-            self.assertEqual(received_answer['sdp'], 'v=0...')
-            self.assertEqual(received_answer['from'], self.test_user2.username)
-            self.assertEqual(received_answer['to'], self.test_user.username)
-
-            await communicator1.disconnect()
-            await communicator2.disconnect()
+        communicator1, communicator2 = await self.connect_both()
+
+        offer_payload = {
+            'type': 'offer',
+            'sdp': 'v=0...',
+            'to': self.test_user2.username
+        }
+        await communicator1.send_json_to(offer_payload)
+
+        received_offer = await communicator2.receive_json_from()
+        self.assertEqual(received_offer['type'], 'offer')
+        self.assertEqual(received_offer['sdp'], 'v=0...')
+        self.assertEqual(received_offer['from'], self.test_user.username)
+        self.assertEqual(received_offer['to'], self.test_user2.username)
+
+        answer_payload = {
+            'type': 'answer',
+            'sdp': 'v=0...',
+            'to': self.test_user.username
+        }
+        await communicator2.send_json_to(answer_payload)
+
+        received_answer = await communicator1.receive_json_from()
+        self.assertEqual(received_answer['type'], 'answer')
+        self.assertEqual(received_answer['sdp'], 'v=0...')
+        self.assertEqual(received_answer['from'], self.test_user2.username)
+        self.assertEqual(received_answer['to'], self.test_user.username)
+
+        await communicator1.disconnect()
+        await communicator2.disconnect()
+
+
+class BulkIngestAPITests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.owner = self.User.objects.create_user(
+            username='importer', email='importer@example.com', password='password123', is_staff=True
+        )
+        self.other = self.User.objects.create_user(
+            username='author', email='author@example.com', password='password123'
+        )
+        self.room = Room.objects.create(name='Imported', created_by=self.owner, category='1')
+        self.client.force_authenticate(user=self.owner)
+        self.url = f'/api/chat/bulk-messages/{self.room.id}'
+
+    def test_bulk_ingest_json(self):
+        data = [
+            {'message': 'first', 'created_at': '2024-01-01T10:00:00Z'},
+            {'message': 'second', 'created_by': 'author'},
+            {'message': ''},
+            {'message': 'ghost', 'created_by': 'nobody'},
+        ]
+        response = self.client.post(self.url + '?batch_size=2', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([e['index'] for e in response.data['errors']], [2, 3])
+        first = Message.objects.get(message='first')
+        self.assertEqual(first.created_by, self.owner)
+        self.assertEqual(first.created_at.year, 2024)
+        self.assertEqual(Message.objects.get(message='second').created_by, self.other)
+
+    def test_bulk_ingest_ndjson(self):
+        body = '{"message": "one"}\n\nnot json\n{"message": "two", "created_by": "author"}\n'
+        response = self.client.generic('POST', self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 2)
+
+    def test_bulk_ingest_non_staff_cannot_impersonate(self):
+        self.owner.is_staff = False
+        self.owner.save()
+        data = [{'message': 'mine'}, {'message': 'forged', 'created_by': 'author'}]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1])
+        self.assertEqual(Message.objects.get(message='mine').created_by, self.owner)
+        self.assertFalse(Message.objects.filter(message='forged').exists())
+
+    def test_bulk_ingest_requires_room_owner(self):
+        self.client.force_authenticate(user=self.other)
+        response = self.client.post(self.url, [{'message': 'hi'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Message.objects.exists())
+
+
+mock_shard_client = MagicMock()
+mock_shard_client.pipeline.return_value.execute.return_value = [1, 1]
+mock_shard_client.smembers.return_value = set()
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+@patch('chats.presence.get_shard_client', return_value=mock_shard_client)
+class EphemeralEventTests(TestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        self.User = get_user_model()
+        self.alice = self.User.objects.create_user(username='alice', email='alice@example.com', password='password123')
+        self.bob = self.User.objects.create_user(username='bob', email='bob@example.com', password='password123')
+        self.room = Room.objects.create(name='Typing', created_by=self.alice, category='1')
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_typing_is_coalesced_and_not_persisted(self, _):
+        with patch('chats.consumers.EPHEMERAL_EVENT_INTERVAL', 0.2), \
+                patch('chats.consumers.ChatConsumer.save_message') as save_message:
+            alice, bob = self.communicator(self.alice), self.communicator(self.bob)
+            await alice.connect()
+            await bob.connect()
+            await alice.receive_json_from()
+            await alice.receive_json_from()
+            await bob.receive_json_from()
+
+            await alice.send_json_to({'type': 'typing'})
+            await alice.send_json_to({'type': 'typing'})
+            await alice.send_json_to({'type': 'stop_typing'})
+
+            self.assertEqual(await bob.receive_json_from(), {'type': 'typing', 'from': 'alice'})
+            self.assertEqual(await bob.receive_json_from(), {'type': 'stop_typing', 'from': 'alice'})
+            self.assertTrue(await bob.receive_nothing(0.3))
+            self.assertTrue(await alice.receive_nothing())
+            save_message.assert_not_called()
+
+            await alice.disconnect()
+            await bob.disconnect()
+
+
+class UnreadCounterTests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.owner = self.User.objects.create_user(username='unreadowner', email='uo@example.com', password='password123')
+        self.reader = self.User.objects.create_user(username='unreadreader', email='ur@example.com', password='password123')
+        self.room = Room.objects.create(name='Unread', created_by=self.owner, category='1')
+        get_redis_connection('default').delete(unread.read_key(self.reader.pk))
+        unread.rebuild_counters()
+        unread.join_room(self.reader, self.room)
+        self.client.force_authenticate(user=self.reader)
+
+    def test_counts_are_incremental_and_reset_on_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_messages(self.room, [{'message': f'm{i}'} for i in range(3)], default_user=self.owner)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/chat/unread-counts')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {str(self.room.id): 3})
+
+        response = self.client.post(f'/api/chat/mark-read/{self.room.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/chat/unread-counts').data, {str(self.room.id): 0})
+
+    def test_counts_rebuild_from_database_on_cold_start(self):
+        ingest_messages(self.room, [{'message': 'old'}], default_user=self.owner)
+        unread.mark_read(self.reader, self.room)
+        ReadState.objects.filter(user=self.reader).update(last_read_at=Message.objects.get().created_at)
+        ingest_messages(self.room, [{'message': 'new'}, {'message': 'newer'}], default_user=self.owner)
+
+        client = get_redis_connection('default')
+        client.delete(unread.READY_KEY, unread.TOTALS_KEY, unread.read_key(self.reader.pk))
+
+        response = self.client.get('/api/chat/unread-counts')
+        self.assertEqual(response.data, {str(self.room.id): 2})
+
+    def test_counts_only_move_when_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            ingest_messages(self.room, [{'message': 'pending'}], default_user=self.owner)
+        self.assertEqual(self.client.get('/api/chat/unread-counts').data, {str(self.room.id): 0})
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get('/api/chat/unread-counts').data, {str(self.room.id): 1})
+
+    def test_rebuild_replaces_counters_without_leaving_temporary_keys(self):
+        client = get_redis_connection('default')
+        client.hset(unread.TOTALS_KEY, 'stale-room', 99)
+        Message.objects.create(room=self.room, created_by=self.owner, message='counted')
+
+        unread.rebuild_counters()
+
+        self.assertEqual(client.hgetall(unread.TOTALS_KEY), {str(self.room.id).encode(): b'1'})
+        self.assertEqual(client.hgetall(unread.read_key(self.reader.pk)), {str(self.room.id).encode(): b'0'})
+        self.assertEqual(client.keys(f'{unread.TOTALS_KEY}:*'), [])
+
+
+class InboxAPITests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='inboxuser', email='inbox@example.com', password='password123')
+        self.friend = self.User.objects.create_user(username='inboxfriend', email='friend@example.com', password='password123')
+        self.quiet = Room.objects.create(name='Quiet', created_by=self.user, category='1')
+        self.older = Room.objects.create(name='Older', created_by=self.user, category='1')
+        self.newer = Room.objects.create(name='Newer', created_by=self.friend, category='1')
+        unread.rebuild_counters()
+        unread.join_room(self.user, self.newer)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_messages(self.older, [{'message': 'old news', 'created_at': '2024-01-01T00:00:00Z'}], default_user=self.user)
+            ingest_messages(self.newer, [
+                {'message': 'hello', 'created_at': '2024-02-01T00:00:00Z'},
+                {'message': 'latest', 'created_at': '2024-02-02T00:00:00Z'},
+            ], default_user=self.friend)
+        self.client.force_authenticate(user=self.user)
+
+    def test_inbox_returns_latest_message_in_constant_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/chat/inbox')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        results = response.data['results']
+        self.assertEqual([room['name'] for room in results], ['Newer', 'Older', 'Quiet'])
+        self.assertEqual(results[0]['last_message']['message'], 'latest')
+        self.assertEqual(results[0]['last_message']['created_by'], 'inboxfriend')
+        self.assertEqual(results[0]['unread'], 2)
+        self.assertIsNone(results[2]['last_message'])
+
+    def test_imported_history_does_not_move_last_message_backwards(self):
+        ingest_messages(self.newer, [{'message': 'ancient', 'created_at': '2020-01-01T00:00:00Z'}], default_user=self.friend)
+        self.newer.refresh_from_db()
+        self.assertEqual(self.newer.last_message.message, 'latest')
+
+    def test_inbox_is_paginated(self):
+        response = self.client.get('/api/chat/inbox?page_size=1&page=2')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Older')
+
+
+class RoomStatsTests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='statsuser', email='stats@example.com', password='password123')
+        self.friend = self.User.objects.create_user(username='statsfriend', email='sf@example.com', password='password123')
+        self.room = Room.objects.create(name='Stats', created_by=self.user, category='1')
+        self.client.force_authenticate(user=self.user)
+
+    def test_write_path_maintains_counters(self):
+        ingest_messages(self.room, [{'message': 'a'}, {'message': 'b'}], default_user=self.user)
+        ingest_messages(self.room, [{'message': 'c'}, {'message': 'd', 'created_by': 'statsfriend'}], default_user=self.user)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 4)
+        self.assertEqual(self.room.author_count, 2)
+        self.assertEqual(self.room.last_message.message, 'd')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/chat/room-stats/{self.room.id}')
+        self.assertEqual(response.data['message_count'], 4)
+        self.assertEqual(response.data['top_authors'][0], {'username': 'statsuser', 'message_count': 3})
+
+    def test_reconcile_command_recomputes_from_messages(self):
+        ingest_messages(self.room, [{'message': 'a'}, {'message': 'b', 'created_by': 'statsfriend'}], default_user=self.user)
+        Room.objects.filter(pk=self.room.pk).update(message_count=99, author_count=0)
+        call_command('reconcile_room_stats', str(self.room.id), stdout=MagicMock())
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.message_count, self.room.author_count), (2, 2))
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+class SignalingBatchTests(TestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        self.User = get_user_model()
+        self.alice = self.User.objects.create_user(username='videoalice', email='va@example.com', password='password123')
+        self.bob = self.User.objects.create_user(username='videobob', email='vb@example.com', password='password123')
+        self.room = Room.objects.create(name='Call', created_by=self.alice, category='2')
+
+    async def connect_pair(self):
+        alice = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/video-call/{self.room.id}/')
+        alice.scope['user'] = self.alice
+        bob = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/video-call/{self.room.id}/')
+        bob.scope['user'] = self.bob
+        await alice.connect()
+        await alice.receive_json_from()
+        await bob.connect()
+        await bob.receive_json_from()
+        await alice.receive_json_from()
+        return alice, bob
+
+    def candidate(self, n):
+        return {'type': 'candidate', 'candidate': f'c{n}', 'to': 'videobob'}
+
+    async def test_candidates_are_batched_for_negotiating_clients(self):
+        with patch('chats.presence.get_shard_client', return_value=mock_shard_client):
+            alice, bob = await self.connect_pair()
+            await bob.send_json_to({'type': 'capabilities', 'batching': True})
+            self.assertTrue((await bob.receive_json_from())['batching'])
+
+            for n in range(3):
+                await alice.send_json_to(self.candidate(n))
+            frame = await bob.receive_json_from()
+            self.assertEqual(frame['type'], 'batch')
+            self.assertEqual([m['candidate'] for m in frame['messages']], ['c0', 'c1', 'c2'])
+            self.assertTrue(all(m['from'] == 'videoalice' for m in frame['messages']))
+            self.assertTrue(await bob.receive_nothing())
+
+            await alice.disconnect()
+            await bob.disconnect()
+
+    async def test_batches_are_unpacked_for_legacy_clients_and_keep_order(self):
+        with patch('chats.presence.get_shard_client', return_value=mock_shard_client):
+            alice, bob = await self.connect_pair()
+            await alice.send_json_to(self.candidate(0))
+            await alice.send_json_to(self.candidate(1))
+            await alice.send_json_to({'type': 'offer', 'sdp': 'v=0', 'to': 'videobob'})
+
+            received = [await bob.receive_json_from() for _ in range(3)]
+            self.assertEqual([m.get('candidate', m['type']) for m in received], ['c0', 'c1', 'offer'])
+
+            await alice.disconnect()
+            await bob.disconnect()
+
+    @patch('chats.consumers.SIGNALING_MAX_BATCH', 2)
+    async def test_oversized_batches_are_rejected(self):
+        with patch('chats.presence.get_shard_client', return_value=mock_shard_client):
+            alice, bob = await self.connect_pair()
+            await alice.send_json_to({'type': 'batch', 'messages': [self.candidate(n) for n in range(3)]})
+            self.assertEqual((await alice.receive_json_from())['type'], 'error')
+            self.assertTrue(await bob.receive_nothing())
+
+            await alice.send_json_to({'type': 'batch', 'messages': [self.candidate(n) for n in range(2)]})
+            received = [await bob.receive_json_from() for _ in range(2)]
+            self.assertEqual([m['candidate'] for m in received], ['c0', 'c1'])
+
+            await alice.disconnect()
+            await bob.disconnect()
+
+
+class ShardingTests(TestCase):
+    def test_room_state_hashes_on_room_id(self):
+        room_id = '0b8a4f0e-5d0c-4a8e-9a53-6c1f2f0e1d11'
+        self.assertEqual(shard_key(f'chat_{room_id}'), room_id)
+        self.assertEqual(shard_key(f'video_call_{room_id}'), room_id)
+        self.assertEqual(shard_key(f'room:chat_{room_id}:users'), room_id)
+        self.assertEqual(shard_key('specific.abc!'), 'specific.abc!')
+
+        layer = ShardedRedisChannelLayer(hosts=['redis://a:6379', 'redis://b:6379', 'redis://c:6379'])
+        self.assertEqual(layer.consistent_hash(f'chat_{room_id}'), layer.ring.get_index(room_id))
+        self.assertEqual(layer.consistent_hash('specific.abc!def'), layer.consistent_hash('specific.abc!'))
+
+    def test_adding_a_shard_moves_a_fraction_of_rooms(self):
+        keys = [f'room-{i}' for i in range(2000)]
+        before = HashRing(['redis://a', 'redis://b', 'redis://c'])
+        after = HashRing(['redis://a', 'redis://b', 'redis://c', 'redis://d'])
+        moved = [key for key in keys if before.get_node(key) != after.get_node(key)]
+        self.assertTrue(all(after.get_node(key) == 'redis://d' for key in moved))
+        self.assertLess(len(moved), len(keys) * 0.35)
+
+
+class QueuedConsumer(BoundedSendMixin, AsyncWebsocketConsumer):
+    pass
+
+
+class BoundedSendQueueTests(TestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+
+    def make_consumer(self, policy, max_frames=3):
+        consumer = QueuedConsumer()
+        consumer.send_queue_config = {'policy': policy, 'max_frames': max_frames}
+        consumer.sent = []
+        consumer.gate = asyncio.Event()
+
+        async def base_send(message):
+            await consumer.gate.wait()
+            consumer.sent.append(message)
+        consumer.base_send = base_send
+        return consumer
+
+    async def drain(self, consumer, count):
+        consumer.gate.set()
+        for _ in range(50):
+            if len(consumer.sent) >= count:
+                break
+            await asyncio.sleep(0)
+        return [message.get('text', message['type']) for message in consumer.sent]
+
+    async def test_drop_oldest_sheds_ephemeral_frames_first(self):
+        consumer = self.make_consumer('drop_oldest')
+        await consumer.send(text_data='m1')
+        await consumer.send(text_data='typing', droppable=True)
+        await consumer.send(text_data='m2')
+        await consumer.send(text_data='m3')
+
+        self.assertEqual(await self.drain(consumer, 3), ['m1', 'm2', 'm3'])
+
+    async def test_coalesce_replaces_queued_state(self):
+        consumer = self.make_consumer('coalesce', max_frames=2)
+        await consumer.send(text_data='count:1', key='user_count')
+        await consumer.send(text_data='m1')
+        await consumer.send(text_data='count:2', key='user_count')
+
+        self.assertEqual(await self.drain(consumer, 2), ['count:2', 'm1'])
+
+    async def test_overflow_closes_slow_socket(self):
+        closed = slow_closes.value(consumer='QueuedConsumer')
+        consumer = self.make_consumer('drop_oldest', max_frames=2)
+        await consumer.send(text_data='m1')
+        await consumer.send(text_data='m2')
+        await consumer.send(text_data='m3')
+        await consumer.send(text_data='m4')
+
+        self.assertEqual(await self.drain(consumer, 1), ['websocket.close'])
+        self.assertEqual(consumer.sent[0]['code'], SLOW_CONSUMER_CLOSE_CODE)
+        self.assertEqual(slow_closes.value(consumer='QueuedConsumer'), closed + 1)
+
+
+class StructuredLoggingTests(TestCase):
+    def test_queue_handler_writes_json_with_extra_fields(self):
+        stream = io.StringIO()
+        handler = QueueLogHandler(stream=stream)
+        log = logging.getLogger('chats.tests.structured')
+        log.addHandler(handler)
+        log.propagate = False
+        try:
+            log.warning("User %s connected", 'alice', extra={'event': 'chat.connect', 'room': 'chat_1'})
+        finally:
+            log.removeHandler(handler)
+            handler.close()
+
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['message'], 'User alice connected')
+        self.assertEqual(entry['level'], 'WARNING')
+        self.assertEqual((entry['event'], entry['room']), ('chat.connect', 'chat_1'))
+
+    def test_sampling_only_applies_to_listed_events_below_warning(self):
+        sampler = SamplingFilter({'chat.connect': 0.0})
+
+        def record(level, **extra):
+            record = logging.LogRecord('chats', level, __file__, 1, 'msg', (), None)
+            record.__dict__.update(extra)
+            return record
+
+        self.assertFalse(sampler.filter(record(logging.INFO, event='chat.connect')))
+        self.assertTrue(sampler.filter(record(logging.WARNING, event='chat.connect')))
+        self.assertTrue(sampler.filter(record(logging.INFO, event='chat.other')))
+        self.assertTrue(sampler.filter(record(logging.INFO)))
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+@patch('chats.presence.get_shard_client', return_value=mock_shard_client)
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        self.User = get_user_model()
+        self.alice = self.User.objects.create_user(username='admitalice', email='aa@example.com', password='password123')
+        self.bob = self.User.objects.create_user(username='admitbob', email='ab@example.com', password='password123')
+        self.room = Room.objects.create(name='Admission', created_by=self.alice, category='1')
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def assert_rejected(self, communicator):
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        error = await communicator.receive_json_from()
+        self.assertEqual(error['type'], 'error')
+        self.assertGreaterEqual(error['retry_after'], 5)
+        self.assertEqual((await communicator.receive_output())['code'], admission.TRY_AGAIN_LATER)
+
+    @override_settings(WEBSOCKET_ADMISSION={'max_connections': 1})
+    async def test_worker_connection_budget(self, _):
+        with patch.object(admission, '_active', 0):
+            alice, bob = self.communicator(self.alice), self.communicator(self.bob)
+            connected, _ = await alice.connect()
+            self.assertTrue(connected)
+            await alice.receive_json_from()
+
+            await self.assert_rejected(bob)
+
+            await alice.disconnect()
+            self.assertEqual(admission._active, 0)
+
+    async def test_rejects_while_event_loop_lags(self, _):
+        admission.get_loop_monitor().lag = 1.0
+        try:
+            await self.assert_rejected(self.communicator(self.alice))
+        finally:
+            admission.get_loop_monitor().lag = 0.0
+
+    async def test_saturated_executor_turns_connects_away(self, _):
+        with patch('chats.consumers.ChatConsumer.get_chat_room', side_effect=ExecutorSaturated('orm')):
+            await self.assert_rejected(self.communicator(self.alice))
+
+    async def test_saturated_executor_drops_messages(self, _):
+        alice = self.communicator(self.alice)
+        connected, _ = await alice.connect()
+        self.assertTrue(connected)
+        await alice.receive_json_from()
+        with patch('chats.consumers.ChatConsumer.save_message', side_effect=ExecutorSaturated('orm')):
+            await alice.send_json_to({'message': 'dropped'})
+            error = await alice.receive_json_from()
+        self.assertEqual(error['type'], 'error')
+        self.assertIn('retry_after', error)
+        self.assertFalse(await sync_to_async(Message.objects.exists)())
+        await alice.disconnect()
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+class AttachmentUploadTests(APITestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='uploader', email='up@example.com', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        overrides = override_settings(ATTACHMENT_ROOT=self.root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.content = bytes(range(256)) * 40
+
+    def start_upload(self):
+        response = self.client.post('/api/chat/uploads', {'filename': 'notes.bin', 'size': len(self.content)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return f"/api/chat/uploads/{response.data['id']}"
+
+    def send_chunk(self, url, offset, data):
+        return self.client.patch(url, data=data, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self):
+        url = self.start_upload()
+        self.send_chunk(url, 0, self.content[:4000])
+        return self.send_chunk(url, 4000, self.content[4000:])
+
+    def test_resumable_upload_is_content_addressed(self):
+        url = self.start_upload()
+        self.assertEqual(self.send_chunk(url, 0, self.content[:4000]).data['offset'], 4000)
+
+        conflict = self.send_chunk(url, 0, self.content[:4000])
+        self.assertEqual(conflict.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(conflict.data['offset'], 4000)
+        self.assertEqual(self.client.get(url).data['offset'], 4000)
+
+        response = self.send_chunk(url, 4000, self.content[4000:])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(response.data['sha256'], sha256)
+        with open(blob_path(sha256), 'rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+        self.assertEqual(self.upload().data['sha256'], sha256)
+        self.assertEqual(Attachment.objects.filter(sha256=sha256).count(), 2)
+        self.assertEqual(len(list(blob_path(sha256).parent.iterdir())), 1)
+
+    def test_range_download(self):
+        url = self.upload().data['url']
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    @patch('chats.presence.get_shard_client', return_value=mock_shard_client)
+    async def test_message_broadcasts_attachment_metadata(self, _):
+        attachment = (await sync_to_async(self.upload)()).data
+        room = await Room.objects.acreate(name='Files', created_by=self.user, category='1')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{room.id}/')
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({'message': '', 'attachments': [attachment['id']]})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['attachments'], [attachment])
+        await communicator.disconnect()
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+class MessageChangeTests(APITestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.author = self.User.objects.create_user(username='editor', email='ed@example.com', password='password123')
+        self.other = self.User.objects.create_user(username='bystander', email='by@example.com', password='password123')
+        self.room = Room.objects.create(name='Edits', created_by=self.other, category='1')
+        self.messages = [
+            Message.objects.create(room=self.room, created_by=self.author, message=f'm{i}') for i in range(3)
+        ]
+        messages_created(self.room, self.messages)
+        self.client.force_authenticate(user=self.author)
+
+    def test_changes_since_returns_latest_state_once(self):
+        first, second, _ = self.messages
+        self.client.patch(f'/api/chat/messages/{first.id}', {'message': 'edited once'}, format='json')
+        self.client.patch(f'/api/chat/messages/{first.id}', {'message': 'edited twice'}, format='json')
+        response = self.client.delete(f'/api/chat/messages/{second.id}')
+        self.assertEqual(response.data['type'], 'message_deleted')
+
+        response = self.client.get(f'/api/chat/changes/{self.room.id}', {'since': 0})
+        self.assertEqual(response.data['seq'], 3)
+        self.assertEqual(
+            [(change['id'], change['seq'], change['message']) for change in response.data['changes']],
+            [(str(first.id), 2, 'edited twice'), (str(second.id), 3, '')]
+        )
+        self.assertEqual(len(self.client.get(f'/api/chat/changes/{self.room.id}', {'since': 2}).data['changes']), 1)
+
+        page = self.client.get(f'/api/chat/changes/{self.room.id}', {'since': 0, 'limit': 1}).data
+        self.assertEqual((page['seq'], page['has_more']), (2, True))
+
+        history = self.client.get(f'/api/chat/get-messages/{self.room.id}').data
+        self.assertNotIn(str(second.id), [message['id'] for message in history])
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 2)
+
+    def test_only_author_can_edit(self):
+        self.client.force_authenticate(user=self.other)
+        response = self.client.patch(f'/api/chat/messages/{self.messages[0].id}', {'message': 'nope'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('chats.presence.get_shard_client', return_value=mock_shard_client)
+    async def test_changes_are_pushed_to_the_room(self, _):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = self.other
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await sync_to_async(self.client.patch)(f'/api/chat/messages/{self.messages[0].id}', {'message': 'fixed'}, format='json')
+        frame = await communicator.receive_json_from()
+        self.assertEqual((frame['type'], frame['seq'], frame['message']), ('message_edited', 1, 'fixed'))
+        await communicator.disconnect()
+
+
+class StartupProfileTests(TestCase):
+    # The probes are fresh interpreters on the real settings, database and
+    # Redis, so the suite only checks how their results are reported.
+    PROBE_RESULT = {
+        'import_seconds': 0.2, 'handshake_seconds': 0.01, 'first_socket_seconds': 0.25,
+        'accepted': False, 'close_code': None, 'modules': 700, 'wall_seconds': 0.3,
+    }
+
+    @patch('chats.management.commands.bench_startup.Command.probe', side_effect=lambda *args: dict(StartupProfileTests.PROBE_RESULT))
+    def test_bench_startup_reports_both_profiles(self, probe):
+        out = io.StringIO()
+        call_command('bench_startup', runs=1, stdout=out)
+        self.assertEqual([call.args[0] for call in probe.call_args_list], ['full', 'websocket'])
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split(':')[0].strip() for line in lines], ['full', 'websocket'])
+
+
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.authors = [
+            self.User.objects.create_user(username=f'budget{i}', email=f'b{i}@example.com', password='password123')
+            for i in range(6)
+        ]
+        self.room = Room.objects.create(name='Budget', created_by=self.authors[0], category='1')
+        Message.objects.bulk_create(
+            Message(room=self.room, created_by=author, message=f'from {author.username}') for author in self.authors
+        )
+        self.client.force_authenticate(user=self.authors[0])
+
+    def test_endpoints_stay_within_budget(self):
+        for route, url in [
+            ('api/chat/get-messages/<id>', f'/api/chat/get-messages/{self.room.id}'),
+            ('api/chat/get-rooms', '/api/chat/get-rooms'),
+            ('api/chat/room-stats/<id>', f'/api/chat/room-stats/{self.room.id}'),
+        ]:
+            with self.subTest(route=route), query_budget(route=route):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_n_plus_one_is_flagged(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget():
+                [message.created_by.username for message in Message.objects.all()]
+
+    def test_recorder_keeps_bounded_aggregates(self):
+        with query_budget(max_duplicates=1, allow_similar=True) as recorder:
+            recorder.max_tracked = 2
+            Room.objects.get(pk=self.room.pk)
+            Room.objects.get(pk=self.room.pk)
+            for author in self.authors:
+                Message.objects.filter(created_by=author).count()
+        self.assertEqual(recorder.count, 2 + len(self.authors))
+        self.assertEqual(recorder.duplicates, 1)
+        self.assertEqual(len(recorder.shapes), 2)
+        self.assertEqual(len(recorder.seen), 2)
+        self.assertEqual(sorted(count for count, _ in recorder.shapes.values()), [2, len(self.authors)])
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers(self):
+        response = self.client.get(f'/api/chat/get-messages/{self.room.id}')
+        self.assertEqual(response['X-DB-Query-Count'], '2')
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+        self.assertIn('X-DB-Query-Time-Ms', response)
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='profiled', email='prof@example.com', password='password123')
+        self.room = Room.objects.create(name='Profiled', created_by=self.user, category='1')
+        self.client.force_authenticate(user=self.user)
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        overrides = override_settings(PROFILING={'dir': self.dir, 'header_token': 'secret', 'poll_interval': 0})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(profiling.disable)
+        self.addCleanup(setattr, profiling, '_config', None)
+
+    def profiles(self):
+        return sorted(path.name for path in Path(self.dir).iterdir())
+
+    def test_disabled_by_default(self):
+        self.client.get('/api/chat/get-rooms')
+        self.client.get('/api/chat/get-rooms', HTTP_X_PROFILE='wrong')
+        self.assertEqual(self.profiles(), [])
+
+    def test_header_token_profiles_request_per_endpoint(self):
+        self.client.get('/api/chat/get-rooms', HTTP_X_PROFILE='secret')
+        self.client.get('/api/chat/get-rooms', HTTP_X_PROFILE='secret')
+        self.assertEqual(self.profiles(), ['http_GET_api_chat_get-rooms.prof'])
+        stats = pstats.Stats(str(Path(self.dir) / 'http_GET_api_chat_get-rooms.prof'))
+        self.assertTrue(any(name == 'get' for _, _, name in stats.stats))
+
+    def test_consumer_switch_is_read_off_the_calling_thread(self):
+        readers = []
+
+        def read(key):
+            readers.append(threading.current_thread())
+            return {'rate': 1.0, 'users': []}
+
+        with patch('mysite.profiling.cache') as fake_cache:
+            fake_cache.get.side_effect = read
+            profiling.schedule_refresh()
+            for _ in range(100):
+                if profiling._config:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(profiling._config, {'rate': 1.0, 'users': []})
+        self.assertNotIn(threading.current_thread(), readers)
+
+    @patch('chats.presence.get_shard_client', return_value=mock_shard_client)
+    async def test_runtime_switch_targets_user_socket_handlers(self, _):
+        await sync_to_async(profiling.enable)(users=['profiled'])
+        # Consumers pick the switch up from a background read; wait for one.
+        await run_async('redis', profiling.refresh_config)
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        await asyncio.sleep(0.1)
+        self.assertIn('ws_ChatConsumer.websocket.connect.prof', self.profiles())
+
+
+class LoopLagMonitorTests(TestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+
+    @override_settings(LOOP_MONITOR={'interval': 0.02, 'stall_threshold': 0.1})
+    async def test_blocking_call_is_reported_with_its_stack(self):
+        samples, blocked = lag_histogram.value(), stalls.value()
+        monitor = get_loop_monitor()
+        await asyncio.sleep(0.05)
+
+        with self.assertLogs('mysite.looplag', 'WARNING') as logs:
+            time.sleep(0.3)
+            await asyncio.sleep(0.05)
+
+        self.assertIn('test_blocking_call_is_reported_with_its_stack', logs.records[0].stack)
+        self.assertEqual(stalls.value(), blocked + 1)
+        self.assertGreater(lag_histogram.value(), samples)
+        self.assertGreater(monitor.lag, 0.1)
+
+    @override_settings(DEBUG=True)
+    async def test_asyncio_debug_mode_is_opt_in(self):
+        loop = asyncio.get_running_loop()
+        loop.set_debug(False)
+        get_loop_monitor()
+        self.assertFalse(loop.get_debug())
+
+        looplag._monitors.clear()
+        with override_settings(LOOP_MONITOR={'debug': True, 'slow_callback': 0.05}):
+            get_loop_monitor()
+        self.assertTrue(loop.get_debug())
+        self.assertEqual(loop.slow_callback_duration, 0.05)
+
+
+class WorkloadExecutorTests(TestCase):
+    def test_queue_depth_is_reported_per_executor(self):
+        release = threading.Event()
+        executor = BoundedExecutor('depth-test', max_workers=1, max_pending=2)
+        running = executor.submit(release.wait)
+        queued = executor.submit(lambda: 'done')
+        self.assertEqual(queue_depth.value(executor='depth-test'), 1)
+        self.assertEqual(in_flight_jobs.value(executor='depth-test'), 2)
+        release.set()
+        running.result()
+        self.assertEqual(queued.result(), 'done')
+        executor.shutdown()
+        self.assertEqual(queue_depth.value(executor='depth-test'), 0)
+        self.assertEqual(in_flight_jobs.value(executor='depth-test'), 0)
+
+    @override_settings(EXECUTORS={'redis': {'max_workers': 1, 'max_pending': 10}, 'orm': {'max_workers': 1, 'max_pending': 10}})
+    async def test_blocked_pool_does_not_delay_other_workloads(self):
+        release = threading.Event()
+        blocked = asyncio.ensure_future(run_async('redis', release.wait))
+        await asyncio.sleep(0.05)
+        self.assertEqual(get_executor('redis').in_flight, 1)
+
+        thread_name = await asyncio.wait_for(run_async('orm', lambda: threading.current_thread().name), timeout=1)
+        self.assertTrue(thread_name.startswith('orm-executor'))
+        self.assertFalse(blocked.done())
+
+        release.set()
+        await blocked
+
+
+@override_settings(BROADCAST_ROOMS={'presence_interval': 60}, EXECUTORS=TEST_EXECUTORS)
+@patch('chats.broadcast.get_shard_client', side_effect=lambda group_name: get_redis_connection('default'))
+class BroadcastRoomTests(TestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        self.User = get_user_model()
+        self.host = self.User.objects.create_user(username='lecturer', email='lecturer@example.com', password='password123')
+        self.listeners = [
+            self.User.objects.create_user(username=f'listener{i}', email=f'listener{i}@example.com', password='password123')
+            for i in range(2)
+        ]
+        self.room = Room.objects.create(name='Lecture', created_by=self.host, category='3')
+        group_name = f'chat_{self.room.id}'
+        get_redis_connection('default').delete(broadcast.nodes_key(group_name), broadcast.node_counts_key(group_name))
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def receive_frame(self, communicator):
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame.get('type') != 'user_count':
+                return frame
+
+    @patch('chats.consumers.MAX_CHAT_USERS', 1)
+    async def test_listeners_share_one_node_subscription(self, _):
+        layer = get_channel_layer()
+        with patch.object(layer, 'group_add', wraps=layer.group_add) as group_add:
+            sockets = [self.communicator(user) for user in [self.host, *self.listeners]]
+            for socket in sockets:
+                connected, _ = await socket.connect()
+                self.assertTrue(connected)
+
+            await sockets[0].send_json_to({'message': 'Welcome'})
+            for socket in sockets:
+                self.assertEqual((await self.receive_frame(socket))['message'], 'Welcome')
+
+            channels = {call.args[1] for call in group_add.call_args_list if call.args[0] == f'chat_{self.room.id}'}
+            self.assertEqual(len(channels), 1)
+
+            for socket in sockets:
+                await socket.disconnect()
+        self.assertEqual(await sync_to_async(Message.objects.filter(room=self.room).count)(), 1)
+
+    async def test_listeners_cannot_post(self, _):
+        listener = self.communicator(self.listeners[0])
+        await listener.connect()
+        await listener.send_json_to({'message': 'Question'})
+        self.assertEqual((await self.receive_frame(listener))['type'], 'error')
+        await listener.disconnect()
+        self.assertFalse(await sync_to_async(Message.objects.filter(room=self.room).exists)())
+
+    async def test_reader_survives_channel_layer_errors(self, _):
+        delivered = asyncio.Event()
+        outcomes = [ConnectionError('Redis went away'), {'type': 'chat.message'}]
+
+        async def receive(channel):
+            if not outcomes:
+                await asyncio.Event().wait()
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        class Listener:
+            async def chat_message(self, event):
+                delivered.set()
+
+        layer = MagicMock(receive=receive, group_add=AsyncMock())
+        room = broadcast.BroadcastRoom('chat_reader')
+        room.channel = 'specific.test!reader'
+        room.listeners.add(Listener())
+        with patch.object(broadcast, 'READ_RETRY_DELAY', 0), self.assertLogs('chats.broadcast', 'ERROR'):
+            reader = asyncio.ensure_future(broadcast.BroadcastHub(layer).read(room))
+            await asyncio.wait_for(delivered.wait(), 1)
+            reader.cancel()
+        layer.group_add.assert_awaited_with('chat_reader', 'specific.test!reader')
+
+    def test_listener_count_sums_live_nodes(self, _):
+        group_name = f'chat_{self.room.id}'
+        now = time.time()
+        self.assertEqual(broadcast.report_listeners(group_name, 3, now=now), 3)
+        with patch.object(broadcast, 'NODE_ID', 'other-node'):
+            self.assertEqual(broadcast.report_listeners(group_name, 2, now=now), 5)
+        self.assertEqual(broadcast.report_listeners(group_name, 4, now=now + 60), 4)
+        self.assertEqual(broadcast.report_listeners(group_name, 0, now=now + 60), 0)
+
+
+class RoomListingTests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='collector', email='collector@example.com', password='password123')
+        Room.objects.bulk_create(Room(name=f'Room {i:02d}', created_by=self.user, category='1') for i in range(25))
+        Room.objects.create(name='Lecture Hall', created_by=self.user, category='3')
+        self.client.force_authenticate(user=self.user)
+
+    def test_room_listings_are_paginated(self):
+        response = self.client.get('/api/chat/get-rooms')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['name'], 'Room 00')
+
+        response = self.client.get('/api/chat/create-room', {'page': 2})
+        self.assertEqual(response.data['count'], 26)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_sparse_fields(self):
+        with query_budget(route='api/chat/get-rooms'):
+            response = self.client.get('/api/chat/get-rooms', {'fields': 'id,name', 'category': 'broadcast'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name'])
+        self.assertEqual(response.data['results'][0]['name'], 'Lecture Hall')
+
+        response = self.client.get('/api/chat/get-rooms', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_rooms_by_name(self):
+        response = self.client.get('/api/chat/search-rooms', {'room_name': 'lecture', 'fields': 'name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'name': 'Lecture Hall'}])
+        self.assertEqual(self.client.get('/api/chat/search-rooms').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HistoryCompressionTests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='historian', email='historian@example.com', password='password123')
+        self.room = Room.objects.create(name='Archive', created_by=self.user, category='1')
+        Message.objects.bulk_create(
+            Message(room=self.room, created_by=self.user, message=f'Entry {i} of a long and repetitive history') for i in range(25)
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = f'/api/chat/get-messages/{self.room.id}'
+
+    def test_large_responses_are_gzipped(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 25)
+
+        response = self.client.get(f'/api/chat/get-room/{self.room.id}', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_closed_pages_are_cached_with_etag(self):
+        first = self.client.get(self.url, {'page': 1, 'page_size': 10}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        page = json.loads(gzip.decompress(first.content))
+        self.assertEqual((page['page'], page['next'], len(page['results'])), (1, 2, 10))
+
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url, {'page': 1, 'page_size': 10}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(again.content, first.content)
+
+        etag = first['ETag']
+        not_modified = self.client.get(self.url, {'page': 1, 'page_size': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        last = self.client.get(self.url, {'page': 3, 'page_size': 10})
+        self.assertEqual(len(last.data['results']), 5)
+        self.assertIsNone(last.data['next'])
+        self.assertFalse(last.has_header('ETag'))
+
+    def test_edit_invalidates_cached_pages(self):
+        cached = json.loads(self.client.get(self.url, {'page': 1, 'page_size': 10}).content)
+        message = Message.objects.get(id=cached['results'][0]['id'])
+        with self.captureOnCommitCallbacks(execute=True):
+            edit_message(message, 'Corrected entry')
+
+        response = self.client.get(self.url, {'page': 1, 'page_size': 10})
+        self.assertEqual(json.loads(response.content)['results'][0]['message'], 'Corrected entry')
+
+    def test_edit_invalidates_pages_cached_under_another_spelling_of_the_id(self):
+        url = f'/api/chat/get-messages/{self.room.id.hex.upper()}'
+        cached = json.loads(self.client.get(url, {'page': 1, 'page_size': 10}).content)
+        message = Message.objects.get(id=cached['results'][0]['id'])
+        with self.captureOnCommitCallbacks(execute=True):
+            edit_message(message, 'Corrected entry')
+
+        response = self.client.get(url, {'page': 1, 'page_size': 10})
+        self.assertEqual(json.loads(response.content)['results'][0]['message'], 'Corrected entry')
+
+        response = self.client.get('/api/chat/get-messages/not-a-room', {'page': 1, 'page_size': 10})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_page(self):
+        response = self.client.get(self.url, {'page': 0})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(EXECUTORS=TEST_EXECUTORS)
+class MessageSequenceTests(APITestCase):
+    def setUp(self):
+        isolate_socket_state(self)
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+        self.User = get_user_model()
+        self.user = self.User.objects.create_user(username='sequencer', email='seq@example.com', password='password123')
+        self.room = Room.objects.create(name='Ordered', created_by=self.user, category='1')
+        self.other = Room.objects.create(name='Elsewhere', created_by=self.user, category='1')
+        self.client.force_authenticate(user=self.user)
+
+    def test_sequence_is_dense_per_room(self):
+        Message.objects.create(room=self.room, created_by=self.user, message='one')
+        Message.objects.create(room=self.other, created_by=self.user, message='elsewhere')
+        Message.objects.bulk_create(Message(room=self.room, created_by=self.user, message=f'bulk {i}') for i in range(3))
+        ingest_messages(self.room, [{'message': 'imported', 'created_by': 'sequencer', 'created_at': '2020-01-01T00:00:00Z'}])
+
+        self.assertEqual(list(Message.objects.filter(room=self.room).order_by('seq').values_list('seq', flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(Message.objects.get(room=self.other).seq, 1)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_seq, 5)
+
+        # History reads keep creation order, so the backdated import comes first.
+        history = self.client.get(f'/api/chat/get-messages/{self.room.id}').data
+        self.assertEqual(history[0]['message'], 'imported')
+
+    def test_batch_sequence_follows_creation_time(self):
+        ingest_messages(self.room, [
+            {'message': 'later', 'created_by': 'sequencer', 'created_at': '2024-01-02T00:00:00Z'},
+            {'message': 'earlier', 'created_by': 'sequencer', 'created_at': '2024-01-01T00:00:00Z'},
+        ])
+        self.assertEqual(
+            list(Message.objects.filter(room=self.room).order_by('seq').values_list('message', flat=True)),
+            ['earlier', 'later'],
+        )
+
+    def test_range_fetch(self):
+        messages_created(self.room, Message.objects.bulk_create(
+            Message(room=self.room, created_by=self.user, message=f'm{i}') for i in range(1, 7)
+        ))
+        delete_message(Message.objects.get(room=self.room, seq=4))
+        url = f'/api/chat/get-messages/{self.room.id}'
+
+        response = self.client.get(url, {'after_seq': 2, 'limit': 2})
+        self.assertEqual([m['seq'] for m in response.data['results']], [3, 4])
+        self.assertIsNotNone(response.data['results'][1]['deleted_at'])
+        self.assertTrue(response.data['has_more'])
+
+        response = self.client.get(url, {'before_seq': 6, 'limit': 2})
+        self.assertEqual([m['seq'] for m in response.data['results']], [4, 5])
+
+        response = self.client.get(url, {'after_seq': 1, 'before_seq': 4})
+        self.assertEqual([m['seq'] for m in response.data['results']], [2, 3])
+        self.assertFalse(response.data['has_more'])
+
+        self.assertEqual(self.client.get(url, {'after_seq': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('chats.presence.get_shard_client', return_value=mock_shard_client)
+    async def test_broadcast_frames_carry_seq(self, _):
+        await sync_to_async(Message.objects.create)(room=self.room, created_by=self.user, message='earlier')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'message': 'latest'})
+        frame = await communicator.receive_json_from()
+        self.assertEqual((frame['message'], frame['seq']), ('latest', 2))
+        await communicator.disconnect()
+
+
+class TimeOrderedIdTests(APITestCase):
+    def setUp(self):
+        # Throttle history and cached pages from earlier tests live in the shared cache.
+        cache.clear()
+
+    def test_uuid7_is_ordered_and_well_formed(self):
+        ids = [uuid7() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(value.version == 7 and value.variant == uuid.RFC_4122 for value in ids))
+        self.assertAlmostEqual(uuid7_time(ids[-1]), time.time(), delta=5)
+
+    def test_setting_selects_scheme_for_new_rows(self):
+        user = get_user_model().objects.create_user(username='ordered', email='ordered@example.com', password='password123')
+        with override_settings(TIME_ORDERED_IDS=True):
+            room = Room.objects.create(name='Ordered ids', created_by=user, category='1')
+            message = Message.objects.create(room=room, created_by=user, message='first')
+        self.assertEqual((room.id.version, message.id.version), (7, 7))
+        self.assertEqual(new_id().version, 4)
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f'/api/chat/get-room/{room.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], str(room.id))
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('bench_ids', rows=200, batch_size=50, stdout=out)
+        output = out.getvalue()
+        self.assertIn('uuid4: 200 rows', output)
+        self.assertIn('uuid7: 200 rows', output)
@@ -0,0 +1,119 @@
+"""
+Unread counters kept in Redis.
+
+``unread:totals`` maps room id -> number of messages ever posted, and
+``unread:read:<user_id>`` maps room id -> the room total when that user last
+read it. Unread count is the difference, so posting a message is one HINCRBY
+and reading a room is one HSET, whatever the number of members.
+"""
+import uuid
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from .models import Message, ReadState
+
+
+TOTALS_KEY = 'unread:totals'
+READY_KEY = 'unread:ready'
+REBUILD_LOCK_KEY = 'unread:rebuilding'
+
+
+def read_key(user_id):
+    return f"unread:read:{user_id}"
+
+
+def _record_messages(room_id, count):
+    get_redis_connection('default').hincrby(TOTALS_KEY, str(room_id), count)
+
+
+def record_messages(room_id, count=1):
+    """Count ``count`` new messages in the room once the current transaction commits."""
+    transaction.on_commit(partial(_record_messages, room_id, count))
+
+
+def join_room(user, room):
+    """Start tracking ``room`` for ``user``; history before joining counts as read."""
+    state, created = ReadState.objects.get_or_create(user=user, room=room)
+    if created:
+        client = get_redis_connection('default')
+        total = client.hget(TOTALS_KEY, str(room.pk)) or 0
+        client.hsetnx(read_key(user.pk), str(room.pk), total)
+    return state
+
+
+def mark_read(user, room):
+    now = timezone.now()
+    ReadState.objects.update_or_create(user=user, room=room, defaults={'last_read_at': now})
+    client = get_redis_connection('default')
+    total = client.hget(TOTALS_KEY, str(room.pk)) or 0
+    client.hset(read_key(user.pk), str(room.pk), total)
+    return now
+
+
+def get_unread_counts(user):
+    ensure_counters()
+    client = get_redis_connection('default')
+    read = client.hgetall(read_key(user.pk))
+    if not read:
+        return {}
+    rooms = list(read)
+    totals = client.hmget(TOTALS_KEY, rooms)
+    return {
+        room.decode('utf-8'): max(int(total or 0) - int(read[room]), 0)
+        for room, total in zip(rooms, totals)
+    }
+
+
+def ensure_counters():
+    client = get_redis_connection('default')
+    if client.exists(READY_KEY):
+        return
+    if client.set(REBUILD_LOCK_KEY, 1, nx=True, ex=60):
+        try:
+            rebuild_counters()
+        finally:
+            client.delete(REBUILD_LOCK_KEY)
+
+
+def rebuild_counters():
+    """
+    Recompute every counter from the database, e.g. after Redis lost its data.
+
+    The new hashes are written under temporary keys and renamed over the live
+    ones in one transaction, so readers never see a half-built counter.
+    """
+    client = get_redis_connection('default')
+    suffix = uuid.uuid4().hex
+    totals = {
+        str(row['room']): row['total']
+        for row in Message.objects.values('room').annotate(total=Count('id')).order_by()
+    }
+    reads = (
+        ReadState.objects
+        .annotate(read=Count('room__message', filter=Q(room__message__created_at__lte=F('last_read_at'))))
+        .values_list('user_id', 'room_id', 'read')
+        .iterator()
+    )
+
+    staged = {}
+    pipe = client.pipeline(transaction=False)
+    if totals:
+        staged[TOTALS_KEY] = f"{TOTALS_KEY}:{suffix}"
+        pipe.hset(staged[TOTALS_KEY], mapping=totals)
+    for user_id, room_id, read in reads:
+        key = read_key(user_id)
+        staged.setdefault(key, f"{key}:{suffix}")
+        pipe.hset(staged[key], str(room_id), read)
+    pipe.execute()
+
+    pipe = client.pipeline()
+    if TOTALS_KEY not in staged:
+        pipe.delete(TOTALS_KEY)
+    for key, temp in staged.items():
+        pipe.rename(temp, key)
+    pipe.set(READY_KEY, 1)
+    pipe.execute()
@@ -3,8 +3,19 @@ from django.urls import path
 from . views import *
 
 urlpatterns = [
-    path('create-room' , CreateRoomView.as_view()),
-    path('get-rooms', GetRoom.as_view()),
-    path('get-room/<id>', GetRoomById.as_view()),
-    path('get-messages/<id>', GetMessages.as_view())
+    path('create-room' , CreateRoomView.as_view(), name='create-room'),
+    path('get-rooms', GetRoom.as_view(), name='get-rooms'),
+    path('search-rooms', SearchRoom.as_view()),
+    path('get-room/<id>', GetRoomById.as_view(), name='get-room-by-id'),
+    path('get-messages/<id>', GetMessages.as_view(), name='get-messages'),
+    path('room-stats/<id>', GetRoomStats.as_view()),
+    path('bulk-messages/<id>', BulkIngestMessages.as_view()),
+    path('inbox', Inbox.as_view()),
+    path('unread-counts', UnreadCounts.as_view()),
+    path('mark-read/<id>', MarkRead.as_view()),
+    path('uploads', CreateUpload.as_view()),
+    path('uploads/<id>', UploadChunk.as_view()),
+    path('attachments/<id>', DownloadAttachment.as_view()),
+    path('messages/<id>', EditMessage.as_view()),
+    path('changes/<id>', MessageChanges.as_view()),
 ]
@@ -1,16 +1,54 @@
+import uuid
+
 from django.shortcuts import render
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 from .serializers import *
 from .models import *
+from django.db.models import F, Q
+from .ingest import DEFAULT_BATCH_SIZE, ingest_messages, iter_ndjson
+from .pagination import MessagePagination, RoomPagination
+from . import history, unread
+from .attachments import (
+    FileRange, UploadConflict, blob_path, complete_upload, discard_upload, parse_range, upload_offset, write_chunk,
+)
+from .changes import DEFAULT_CHANGES_LIMIT, changes_since, delete_message, edit_message
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.throttling import ScopedRateThrottle
+
+
+ROOM_CATEGORY_FILTERS = {'chat': '1', 'video': '2', 'broadcast': '3'}
+ROOM_LIST_FIELDS = tuple(field.name for field in Room._meta.concrete_fields)
+ROOM_LIST_ORDERING = ('name', 'id')
+
+
+def room_list_response(view, request, rooms):
+    """
+    One page of ``rooms``. With ``?fields=id,name`` only those columns are
+    selected and returned as plain dicts, without building Room instances.
+    """
+    paginator = RoomPagination()
+    fields = [field.strip() for field in request.query_params.get('fields', '').split(',') if field.strip()]
+    if not fields:
+        page = paginator.paginate_queryset(rooms, request, view=view)
+        return paginator.get_paginated_response(RoomSerializer(page, many=True).data)
+
+    unknown = sorted(set(fields) - set(ROOM_LIST_FIELDS))
+    if unknown:
+        return Response({'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
+    page = paginator.paginate_queryset(rooms.values(*fields), request, view=view)
+    return paginator.get_paginated_response(page)
 
 
 class CreateRoomView(APIView):
     def post(self, request):
         try:
             data = request.data
-            print(data)
             serializer = RoomSerializer(data=data)
             if serializer.is_valid():
                 serializer.save(created_by=request.user)
@@ -21,9 +59,8 @@ class CreateRoomView(APIView):
 
     def get(self, request):
         try:
-            rooms = Room.objects.filter(created_by=request.user)
-            serializer = RoomSerializer(rooms, many=True)
-            return Response(serializer.data, status=200)
+            rooms = Room.objects.filter(created_by=request.user).order_by(*ROOM_LIST_ORDERING)
+            return room_list_response(self, request, rooms)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
@@ -31,10 +68,11 @@ class CreateRoomView(APIView):
 class SearchRoom(APIView):
     def get(self, request):
         try:
-            room_name = request.query_params.get('room_name')
-            rooms = Room.objects.filter(room_name__icontains=room_name)
-            serializer = RoomSerializer(rooms, many=True)
-            return Response(serializer.data, status=200)
+            room_name = request.query_params.get('room_name', '').strip()
+            if not room_name:
+                return Response({'error': 'room_name is required'}, status=400)
+            rooms = Room.objects.filter(name__icontains=room_name).order_by(*ROOM_LIST_ORDERING)
+            return room_list_response(self, request, rooms)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
@@ -43,12 +81,15 @@ class GetRoom(APIView):
     def get(self, request):
         try:
             filter_category = request.query_params.get('category', 'chat')
-            print(filter_category)
-            rooms = Room.objects.filter(created_by=request.user, category='1' if filter_category == 'chat' else '2')
-            print(rooms)
-
-            serializer = RoomSerializer(rooms, many=True)
-            return Response(serializer.data, status=200)
+            rooms = Room.objects.filter(created_by=request.user, category=ROOM_CATEGORY_FILTERS.get(filter_category, '2'))
+            sort = request.query_params.get('sort')
+            if sort == 'recent':
+                rooms = rooms.order_by(F('last_activity_at').desc(nulls_last=True), 'id')
+            elif sort == 'busiest':
+                rooms = rooms.order_by('-message_count', 'id')
+            else:
+                rooms = rooms.order_by(*ROOM_LIST_ORDERING)
+            return room_list_response(self, request, rooms)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
@@ -68,8 +109,314 @@ class GetRoomById(APIView):
 class GetMessages(APIView):
     def get(self, request, id):
         try:
-            message = Message.objects.filter(room__id=id).select_related('created_by').order_by('created_at')
-            serializer = MessageSerializer(message, many=True)
+            # Cached pages are keyed and invalidated by the canonical room id.
+            id = str(uuid.UUID(id))
+        except ValueError:
+            return Response({'error': 'Room not found'}, status=404)
+        try:
+            if 'after_seq' in request.query_params or 'before_seq' in request.query_params:
+                return self.get_seq_range(request, id)
+
+            message = Message.objects.filter(room__id=id, deleted_at__isnull=True).select_related('created_by', 'room').prefetch_related('attachments').order_by('created_at', 'seq')
+            if 'page' not in request.query_params and 'page_size' not in request.query_params:
+                serializer = MessageSerializer(message, many=True)
+                return Response(serializer.data, status=200)
+
+            paginator = MessagePagination()
+            key = history.page_key(id, *paginator.get_page_params(request))
+            entry = history.get_page(key)
+            if entry is None:
+                page = paginator.paginate_queryset(message, request, view=self)
+                data = paginator.get_paginated_data(MessageSerializer(page, many=True).data)
+                if not paginator.has_next:
+                    return Response(data, status=200)
+                entry = history.store_page(key, JSONRenderer().render(data))
+            return history.page_response(request, key, entry)
+        except NotFound as e:
+            return Response({'error': str(e.detail)}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+    def get_seq_range(self, request, id):
+        """
+        Messages with ``after_seq < seq < before_seq``, oldest first. With only
+        ``before_seq`` the ``limit`` messages just before it are returned.
+        Deleted messages are included (with ``deleted_at`` set) so a range
+        has no gaps.
+        """
+        try:
+            after = request.query_params.get('after_seq')
+            before = request.query_params.get('before_seq')
+            limit = min(int(request.query_params.get('limit', MessagePagination.page_size)), MessagePagination.max_page_size)
+            after = int(after) if after is not None else None
+            before = int(before) if before is not None else None
+        except ValueError:
+            return Response({'error': 'after_seq, before_seq and limit must be integers.'}, status=400)
+        if limit < 1:
+            return Response({'error': 'limit must be positive.'}, status=400)
+
+        messages = Message.objects.filter(room__id=id).select_related('created_by', 'room').prefetch_related('attachments')
+        if after is not None:
+            messages = messages.filter(seq__gt=after)
+        if before is not None:
+            messages = messages.filter(seq__lt=before)
+        if after is None:
+            rows = list(messages.order_by('-seq')[:limit + 1])
+            has_more = len(rows) > limit
+            rows = rows[:limit][::-1]
+        else:
+            rows = list(messages.order_by('seq')[:limit + 1])
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        return Response({'results': MessageSerializer(rows, many=True).data, 'has_more': has_more}, status=200)
+
+
+class GetRoomStats(APIView):
+    def get(self, request, id):
+        try:
+            room = Room.objects.get(id=id)
+            serializer = RoomStatsSerializer(room)
             return Response(serializer.data, status=200)
+        except Room.DoesNotExist:
+            return Response({'error': 'Room not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class Inbox(APIView):
+    def get(self, request):
+        try:
+            rooms = (
+                Room.objects
+                .filter(Q(created_by=request.user) | Q(readstate__user=request.user))
+                .distinct()
+                .select_related('last_message__created_by')
+                .order_by(F('last_activity_at').desc(nulls_last=True), '-id')
+            )
+            paginator = RoomPagination()
+            page = paginator.paginate_queryset(rooms, request, view=self)
+            serializer = InboxRoomSerializer(page, many=True, context={'unread': unread.get_unread_counts(request.user)})
+            return paginator.get_paginated_response(serializer.data)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class UnreadCounts(APIView):
+    def get(self, request):
+        try:
+            return Response(unread.get_unread_counts(request.user), status=200)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class MarkRead(APIView):
+    def post(self, request, id):
+        try:
+            room = Room.objects.get(id=id)
+            read_at = unread.mark_read(request.user, room)
+            return Response({'room': str(room.id), 'read_at': read_at}, status=200)
+        except Room.DoesNotExist:
+            return Response({'error': 'Room not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class BulkIngestMessages(APIView):
+    def post(self, request, id):
+        try:
+            room = Room.objects.get(id=id, created_by=request.user)
+
+            if request.content_type.startswith('application/x-ndjson'):
+                records = iter_ndjson(request.stream or [])
+            else:
+                records = request.data
+                if isinstance(records, dict):
+                    records = records.get('messages')
+                if not isinstance(records, list):
+                    return Response({'error': 'Expected a list of messages.'}, status=400)
+
+            try:
+                batch_size = int(request.query_params.get('batch_size', DEFAULT_BATCH_SIZE))
+            except ValueError:
+                return Response({'error': 'Invalid batch_size.'}, status=400)
+
+            summary = ingest_messages(
+                room,
+                records,
+                default_user=request.user,
+                batch_size=max(1, min(batch_size, DEFAULT_BATCH_SIZE)),
+                broadcast=request.query_params.get('broadcast') in ('1', 'true'),
+                # Only staff may attribute imported messages to other users.
+                allowed_authors=None if request.user.is_staff else {request.user.username},
+            )
+            return Response(summary, status=201 if summary['imported'] else 400)
+        except Room.DoesNotExist:
+            return Response({'error': 'Room not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class CreateUpload(APIView):
+    def post(self, request):
+        try:
+            serializer = UploadSerializer(data=request.data)
+            if serializer.is_valid():
+                upload = serializer.save(created_by=request.user)
+                return Response({
+                    'id': str(upload.id),
+                    'offset': 0,
+                    'max_chunk_size': settings.ATTACHMENT_MAX_CHUNK_SIZE
+                }, status=201)
+            return Response(serializer.errors, status=400)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class UploadChunk(APIView):
+    """
+    Resumable upload in the style of tus: ``GET`` returns the current offset
+    and ``PATCH`` appends the raw request body at ``Upload-Offset``.
+    """
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'attachment_chunks'
+
+    def get(self, request, id):
+        try:
+            upload = Upload.objects.get(id=id, created_by=request.user)
+            offset = upload_offset(upload)
+            return Response({'id': str(upload.id), 'offset': offset, 'size': upload.size}, status=200,
+                            headers={'Upload-Offset': str(offset)})
+        except Upload.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+    def patch(self, request, id):
+        try:
+            upload = Upload.objects.get(id=id, created_by=request.user)
+            try:
+                offset = int(request.headers['Upload-Offset'])
+                length = int(request.headers.get('Content-Length') or 0)
+            except (KeyError, ValueError):
+                return Response({'error': 'Upload-Offset and Content-Length are required.'}, status=400)
+            if length <= 0 or offset < 0 or offset + length > upload.size:
+                return Response({'error': 'Chunk does not fit the declared size.'}, status=400)
+            if length > settings.ATTACHMENT_MAX_CHUNK_SIZE:
+                return Response({'error': f"Chunks are limited to {settings.ATTACHMENT_MAX_CHUNK_SIZE} bytes."}, status=413)
+
+            offset = write_chunk(upload, request.stream, offset, length)
+            if offset < upload.size:
+                return Response({'offset': offset}, status=200, headers={'Upload-Offset': str(offset)})
+
+            attachment = complete_upload(upload)
+            return Response(AttachmentSerializer(attachment).data, status=201)
+        except Upload.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=404)
+        except UploadConflict as e:
+            return Response({'error': str(e), 'offset': e.offset}, status=409, headers={'Upload-Offset': str(e.offset)})
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+    def delete(self, request, id):
+        try:
+            upload = Upload.objects.get(id=id, created_by=request.user)
+            discard_upload(upload)
+            return Response(status=204)
+        except Upload.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class DownloadAttachment(APIView):
+    def get(self, request, id):
+        try:
+            attachment = Attachment.objects.get(id=id)
+            try:
+                byte_range = parse_range(request.headers.get('Range'), attachment.size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f"bytes */{attachment.size}"
+                return response
+            if request.headers.get('If-Range', f'"{attachment.sha256}"') != f'"{attachment.sha256}"':
+                byte_range = None
+
+            if settings.ATTACHMENT_ACCEL_REDIRECT:
+                # The proxy serves the blob with sendfile and handles Range itself.
+                response = HttpResponse(content_type=attachment.content_type)
+                response['X-Accel-Redirect'] = (
+                    f"{settings.ATTACHMENT_ACCEL_REDIRECT.rstrip('/')}/{blob_path(attachment.sha256).relative_to(settings.ATTACHMENT_ROOT)}"
+                )
+            else:
+                file = open(blob_path(attachment.sha256), 'rb')
+                if byte_range is None:
+                    response = FileResponse(file, content_type=attachment.content_type)
+                else:
+                    start, end = byte_range
+                    response = FileResponse(FileRange(file, start, end - start + 1), content_type=attachment.content_type, status=206)
+                    response['Content-Length'] = str(end - start + 1)
+                    response['Content-Range'] = f"bytes {start}-{end}/{attachment.size}"
+
+            response['Content-Disposition'] = content_disposition_header(True, attachment.filename)
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = f'"{attachment.sha256}"'
+            return response
+        except Attachment.DoesNotExist:
+            return Response({'error': 'Attachment not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class EditMessage(APIView):
+    def patch(self, request, id):
+        try:
+            message = Message.objects.select_related('room').get(id=id, created_by=request.user, deleted_at__isnull=True)
+            serializer = MessageEditSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=400)
+            edit_message(message, serializer.validated_data['message'])
+            return Response(MessageChangeSerializer(message).data, status=200)
+        except Message.DoesNotExist:
+            return Response({'error': 'Message not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+    def delete(self, request, id):
+        try:
+            message = Message.objects.select_related('room').get(
+                Q(created_by=request.user) | Q(room__created_by=request.user), id=id, deleted_at__isnull=True
+            )
+            delete_message(message)
+            return Response(MessageChangeSerializer(message).data, status=200)
+        except Message.DoesNotExist:
+            return Response({'error': 'Message not found'}, status=404)
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class MessageChanges(APIView):
+    """
+    Edits and deletes in a room after ``since``. Read the room's
+    ``change_seq`` before fetching history and pass it as the first ``since``;
+    afterwards pass back the ``seq`` of the previous response.
+    """
+
+    def get(self, request, id):
+        try:
+            room = Room.objects.get(id=id)
+            try:
+                since = max(int(request.query_params.get('since', 0)), 0)
+                limit = int(request.query_params.get('limit', DEFAULT_CHANGES_LIMIT))
+            except ValueError:
+                return Response({'error': 'since and limit must be integers.'}, status=400)
+
+            changes, seq, has_more = changes_since(room, since, max(1, min(limit, DEFAULT_CHANGES_LIMIT)))
+            return Response({
+                'changes': MessageChangeSerializer(changes, many=True).data,
+                'seq': seq,
+                'has_more': has_more
+            }, status=200)
+        except Room.DoesNotExist:
+            return Response({'error': 'Room not found'}, status=404)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
@@ -0,0 +1,90 @@
+"""
+Node-wide admission control for WebSocket connects.
+
+Every worker process admits at most WEBSOCKET_ADMISSION['max_connections']
+sockets, and stops admitting while its event loop lags by more than
+'max_loop_lag' seconds. A rejected client is told how long to wait before
+retrying, with jitter so a burst of rejections does not come back at once.
+"""
+import json
+import random
+
+from django.conf import settings
+
+from . import metrics
+from .looplag import get_loop_monitor
+
+
+TRY_AGAIN_LATER = 1013
+DEFAULT_ADMISSION = {'max_connections': 2000, 'max_loop_lag': 0.1, 'retry_after': 5}
+
+active_connections = metrics.gauge('ws_connections_active', 'WebSocket connections admitted by this worker.')
+rejected_connections = metrics.counter('ws_connections_rejected_total', 'WebSocket connects refused by admission control.')
+
+_active = 0
+
+
+def get_config():
+    return {**DEFAULT_ADMISSION, **getattr(settings, 'WEBSOCKET_ADMISSION', {})}
+
+
+def check_admission():
+    """Return None when a new socket may be admitted, else the reason it may not."""
+    config = get_config()
+    if _active >= config['max_connections']:
+        return 'budget'
+    if get_loop_monitor().lag > config['max_loop_lag']:
+        return 'loop_lag'
+    return None
+
+
+def retry_after():
+    base = get_config()['retry_after']
+    return round(base * random.uniform(1, 2))
+
+
+async def admit(consumer):
+    """
+    Call first thing in ``connect()``. Returns True and counts the socket
+    against the budget, or turns the client away with a retry hint and
+    returns False.
+    """
+    global _active
+    reason = check_admission()
+    if reason is None:
+        _active += 1
+        active_connections.set(_active)
+        consumer.admitted = True
+        return True
+
+    await turn_away(consumer, reason)
+    return False
+
+
+def busy_frame(wait):
+    return json.dumps({
+        'type': 'error',
+        'message': 'Server is busy. Please try again later.',
+        'retry_after': wait
+    })
+
+
+async def turn_away(consumer, reason):
+    """
+    Accept and at once close a socket that cannot be served right now, with
+    TRY_AGAIN_LATER and a retry hint. Must run before ``consumer`` accepted.
+    """
+    rejected_connections.inc(reason=reason)
+    wait = retry_after()
+    await consumer.accept()
+    await consumer.send(text_data=busy_frame(wait))
+    await consumer.close(code=TRY_AGAIN_LATER, reason=f"Server busy, retry after {wait}s")
+
+
+def release(consumer):
+    """Call from ``disconnect()``; safe for sockets that were never admitted."""
+    global _active
+    if getattr(consumer, 'admitted', False):
+        consumer.admitted = False
+        _active -= 1
+        active_connections.set(_active)
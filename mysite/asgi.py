@@ -1,26 +1,31 @@
 import os
 import django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
-django.setup()
-from channels.routing import ProtocolTypeRouter, URLRouter
-from django.core.asgi import get_asgi_application
-# from .channelsmiddleware import JWTAuthMiddlewareStack
-from chats.routers import websocket_urlpatterns
-from channels.sessions import CookieMiddleware
-from . channel_middleware import AuthenticationMiddleware
 
+if os.environ.get('ASGI_PROFILE') == 'websocket':
+    # WebSocket-only worker: lean settings, no HTTP stack (see asgi_ws.py).
+    from .asgi_ws import application  # noqa: F401
+else:
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+    from channels.routing import ProtocolTypeRouter, URLRouter
+    from django.core.asgi import get_asgi_application
+    # from .channelsmiddleware import JWTAuthMiddlewareStack
+    from chats.routers import websocket_urlpatterns
+    from channels.sessions import CookieMiddleware
+    from . channel_middleware import AuthenticationMiddleware
 
 
-# from Chat.routings import websocket_urlpatterns
 
-application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
-    'websocket': CookieMiddleware(
-        AuthenticationMiddleware(
+    # from Chat.routings import websocket_urlpatterns
 
-        URLRouter(
-            websocket_urlpatterns
-        )
+    application = ProtocolTypeRouter({
+        'http': get_asgi_application(),
+        'websocket': CookieMiddleware(
+            AuthenticationMiddleware(
+
+            URLRouter(
+                websocket_urlpatterns
+            )
+            )
         )
-    )
-})
\ No newline at end of file
+    })
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Lean ASGI application for workers that only serve ws/chat and ws/video-call.
+
+Selected by ASGI_PROFILE=websocket in mysite/asgi.py. It sets up Django with
+mysite.settings_ws (override with DJANGO_WS_SETTINGS_MODULE) and never
+imports the HTTP stack; plain HTTP requests only get /healthz for readiness
+probes.
+"""
+import os
+
+import django
+
+
+os.environ['DJANGO_SETTINGS_MODULE'] = os.environ.get('DJANGO_WS_SETTINGS_MODULE', 'mysite.settings_ws')
+django.setup(set_prefix=False)
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.sessions import CookieMiddleware  # noqa: E402
+
+from chats.routers import websocket_urlpatterns  # noqa: E402
+from .channel_middleware import AuthenticationMiddleware  # noqa: E402
+
+
+async def health_check(scope, receive, send):
+    found = scope['path'] == '/healthz'
+    await send({
+        'type': 'http.response.start',
+        'status': 200 if found else 404,
+        'headers': [(b'content-type', b'text/plain')],
+    })
+    await send({'type': 'http.response.body', 'body': b'ok' if found else b'not found'})
+
+
+application = ProtocolTypeRouter({
+    'http': health_check,
+    'websocket': CookieMiddleware(
+        AuthenticationMiddleware(
+            URLRouter(
+                websocket_urlpatterns
+            )
+        )
+    )
+})
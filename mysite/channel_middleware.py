@@ -1,9 +1,10 @@
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from django.db import close_old_connections
 from django.contrib.auth import get_user_model
+from mysite.executors import orm_async, run_async
+from authenticate.tokens import stateless_auth_enabled, is_token_revoked, user_from_claims
 
 
 User = get_user_model()
@@ -28,8 +29,15 @@ class AuthenticationMiddleware:
                 token = AccessToken(access_token)
                 user_id = token['user_id']
 
-                
-                user = await self.get_user(user_id)
+                user = None
+                if stateless_auth_enabled():
+                    user = user_from_claims(token)
+                    if user is not None and await run_async('redis', is_token_revoked, token):
+                        scope['user'] = AnonymousUser()
+                        return await self.app(scope, receive, send)
+
+                if user is None:
+                    user = await self.get_user(user_id)
                 
                 if user is None or not user.is_active:  
                     scope['user'] = AnonymousUser()
@@ -45,7 +53,7 @@ class AuthenticationMiddleware:
 
   
 
-    @database_sync_to_async
+    @orm_async
     def get_user(self, user_id:str):
         try:
             return User.objects.get(id=user_id)
@@ -0,0 +1,113 @@
+"""
+Response compression.
+
+CompressionMiddleware compresses buffered responses of at least
+COMPRESSION['min_size'] bytes whose content type is listed in
+'content_types'. Brotli is used when the optional ``brotli`` package is
+installed and the client accepts it, gzip otherwise. Responses that already
+carry a Content-Encoding are passed through, so views can serve bytes they
+compressed and cached earlier (see chats.history).
+"""
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+DEFAULT_COMPRESSION = {
+    'min_size': 1024,
+    'gzip_level': 6,
+    'brotli_quality': 5,
+    'content_types': ('application/json', 'application/x-ndjson', 'text/'),
+}
+
+compressed_responses = metrics.counter('http_compressed_responses_total', 'Responses compressed, by encoding.')
+compression_saved_bytes = metrics.counter('http_compression_saved_bytes_total', 'Bytes saved by response compression.')
+
+
+def get_config():
+    return {**DEFAULT_COMPRESSION, **getattr(settings, 'COMPRESSION', {})}
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """The best encoding we support that ``accept_encoding`` allows, or None."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[token] = quality
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    config = get_config()
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['brotli_quality'])
+    return gzip.compress(data, compresslevel=config['gzip_level'], mtime=0)
+
+
+def is_compressible(response):
+    config = get_config()
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return (
+        not response.streaming
+        and not response.has_header('Content-Encoding')
+        and len(response.content) >= config['min_size']
+        and content_type.startswith(tuple(config['content_types']))
+    )
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not is_compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        original_size = len(response.content)
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= original_size:
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The encoded body is a different representation, so a strong ETag
+        # computed over the original bytes no longer applies byte for byte.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        compressed_responses.inc(encoding=encoding)
+        compression_saved_bytes.inc(original_size - len(compressed))
+        return response
@@ -0,0 +1,167 @@
+"""
+Bounded thread pools, one per workload class.
+
+``hashing`` runs password hashing for the auth views. ``orm`` and ``redis``
+replace the shared ``database_sync_to_async`` thread for consumer and
+WebSocket middleware work: a slow query then only queues behind other ORM
+calls, never behind presence updates, and a sync view holding the shared
+thread cannot stall message saves. Sizes come from settings.EXECUTORS.
+
+Every pool reports its queue depth, in-flight jobs, rejections and queue
+wait to the metrics registry, labelled by pool name.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from . import metrics
+
+
+queue_depth = metrics.gauge('executor_queue_depth', 'Jobs accepted by an executor and waiting for a thread.')
+in_flight_jobs = metrics.gauge('executor_in_flight', 'Jobs running or waiting in an executor.')
+rejected_jobs = metrics.counter('executor_rejected_total', 'Jobs refused because an executor was saturated.')
+queue_wait = metrics.histogram('executor_wait_seconds', 'Time jobs spent waiting for an executor thread.')
+
+
+class ExecutorSaturated(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """
+    A thread pool that refuses work instead of queueing without limit. At most
+    ``max_workers`` jobs run and ``max_pending`` wait; anything beyond that
+    raises ``ExecutorSaturated`` straight away so callers can shed load.
+
+    ``thread_sensitive`` keeps work on the caller's side instead: ``run``
+    calls it inline and ``run_async`` falls back to asgiref's shared thread.
+    Tests use it so ORM calls see the test case's transaction.
+    """
+
+    def __init__(self, name, max_workers, max_pending, thread_sensitive=False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.thread_sensitive = thread_sensitive
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-executor")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return self._queued
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            rejected_jobs.inc(executor=self.name)
+            raise ExecutorSaturated(self.name)
+        with self._lock:
+            self._in_flight += 1
+            self._queued += 1
+            self._report()
+        try:
+            future = self._executor.submit(self._start, time.perf_counter(), fn, args, kwargs)
+        except Exception:
+            self._dequeue()
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        if self.thread_sensitive:
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _start(self, submitted_at, fn, args, kwargs):
+        queue_wait.observe(time.perf_counter() - submitted_at, executor=self.name)
+        self._dequeue()
+        return fn(*args, **kwargs)
+
+    def _dequeue(self):
+        with self._lock:
+            self._queued -= 1
+            self._report()
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+            self._report()
+        self._slots.release()
+
+    def _report(self):
+        queue_depth.set(self._queued, executor=self.name)
+        in_flight_jobs.set(self._in_flight, executor=self.name)
+
+
+DEFAULT_EXECUTORS = {
+    'hashing': {'max_workers': os.cpu_count() or 1, 'max_pending': 16},
+    'orm': {'max_workers': 8, 'max_pending': 1000},
+    'redis': {'max_workers': 8, 'max_pending': 1000},
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                config = {**DEFAULT_EXECUTORS.get(name, {}), **getattr(settings, 'EXECUTORS', {}).get(name, {})}
+                executor = _executors[name] = BoundedExecutor(name, **config)
+    return executor
+
+
+@receiver(setting_changed)
+def _reset_executors(setting, **kwargs):
+    if setting == 'EXECUTORS':
+        with _executors_lock:
+            for executor in _executors.values():
+                executor.shutdown(wait=False)
+            _executors.clear()
+
+
+def _with_db_connections(fn, *args, **kwargs):
+    # What database_sync_to_async does around each call.
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_async(name, fn, *args, **kwargs):
+    """Await ``fn(*args, **kwargs)`` on the named executor."""
+    executor = get_executor(name)
+    if executor.thread_sensitive:
+        return await sync_to_async(fn, thread_sensitive=True)(*args, **kwargs)
+    return await asyncio.wrap_future(executor.submit(fn, *args, **kwargs))
+
+
+def orm_async(fn):
+    """Drop-in for ``database_sync_to_async`` that runs on the ``orm`` executor."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_async('orm', _with_db_connections, fn, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,91 @@
+"""
+Logging plumbing wired up by settings.LOGGING.
+
+Records are rendered to a string on the calling thread and handed to a
+bounded queue; a background QueueListener formats them as JSON lines and
+does the actual write, so logging from the event loop never blocks on
+stdout. When the queue is full records are dropped and counted rather than
+stalling the caller.
+"""
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from . import metrics
+
+
+dropped_records = metrics.counter('log_records_dropped_total', 'Log records dropped because the log queue was full.')
+
+# Attributes every LogRecord has; anything else on a record came from extra=.
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueLogHandler(QueueHandler):
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.queue, target)
+        self.listener.start()
+
+    def close(self):
+        # logging.shutdown() closes handlers at exit; drain the queue first.
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+    def prepare(self, record):
+        # Resolve args and tracebacks now, while they still mean what the
+        # caller meant, but leave the formatting to the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of high-volume records. Records opt in by passing
+    ``extra={'event': name}``; ``rates`` maps event names to the fraction
+    kept. Warnings and above are never sampled out.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
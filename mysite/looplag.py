@@ -0,0 +1,103 @@
+"""
+Event loop lag monitor for ASGI workers.
+
+A task on each serving loop sleeps for ``interval`` and records how late it
+wakes up. A watchdog thread watches the task's heartbeat: when the loop has
+not come back for ``stall_threshold`` seconds it logs the loop thread's
+current stack, which points at the blocking call while it is still blocking.
+With ``debug`` on, the loop also runs in asyncio debug mode, which logs every
+callback slower than ``slow_callback`` together with the task/coroutine that
+ran it. Debug mode slows every callback down, so it is opt-in and separate
+from Django's DEBUG.
+
+The monitor starts with the first socket a loop admits (mysite/admission.py).
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOOP_MONITOR = {'interval': 0.1, 'stall_threshold': 0.25, 'slow_callback': 0.1, 'debug': False}
+
+lag_histogram = metrics.histogram(
+    'event_loop_lag_seconds', 'How late periodic loop wake-ups are.',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+recent_lag = metrics.gauge('event_loop_lag_recent_seconds', 'Decaying peak of recent event loop lag.')
+stalls = metrics.counter('event_loop_stalls_total', 'Times the loop was blocked past the stall threshold.')
+
+_monitors = {}
+
+
+def get_config():
+    return {**DEFAULT_LOOP_MONITOR, **getattr(settings, 'LOOP_MONITOR', {})}
+
+
+class LoopLagMonitor:
+    """
+    ``lag`` holds the worst recent delay and decays by a fifth per sample, so
+    one slow callback sheds load for about a second rather than until the
+    next spike.
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.interval = config['interval']
+        self.stall_threshold = config['stall_threshold']
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.lag = 0.0
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.ensure_future(self.run())
+        self.watchdog = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.watchdog.start()
+        if config['debug']:
+            self.loop.set_debug(True)
+            self.loop.slow_callback_duration = config['slow_callback']
+
+    async def run(self):
+        while True:
+            started = self.loop.time()
+            await asyncio.sleep(self.interval)
+            delay = max(self.loop.time() - started - self.interval, 0.0)
+            self.heartbeat = time.monotonic()
+            self.lag = max(delay, self.lag * 0.8)
+            lag_histogram.observe(delay)
+            recent_lag.set(self.lag)
+
+    def watch(self):
+        reported = False
+        while not (self.loop.is_closed() or self.task.done()):
+            time.sleep(self.interval)
+            blocked = time.monotonic() - self.heartbeat - self.interval
+            if blocked < self.stall_threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            stalls.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            logger.warning("Event loop blocked", extra={
+                'blocked_seconds': round(blocked, 3),
+                'stack': ''.join(traceback.format_stack(frame)) if frame else None,
+            })
+
+
+def get_loop_monitor():
+    loop = asyncio.get_running_loop()
+    monitor = _monitors.get(loop)
+    if monitor is None or monitor.task.done():
+        for stale in [key for key in _monitors if key.is_closed()]:
+            del _monitors[stale]
+        monitor = _monitors[loop] = LoopLagMonitor()
+    return monitor
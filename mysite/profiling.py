@@ -0,0 +1,196 @@
+"""
+Opt-in cProfile capture for HTTP requests and consumer handlers.
+
+Profiling is off until switched on, either at runtime with
+``manage.py profiling enable`` (shared through the cache, picked up by every
+worker within PROFILING['poll_interval'] seconds) or per request with an
+``X-Profile`` header carrying PROFILING['header_token']. A capture can be
+sampled (``rate``) or aimed at named users.
+
+Captures are merged per endpoint into ``<PROFILING['dir']>/<endpoint>.prof``;
+open them with snakeviz, or turn them into a flamegraph with flameprof.
+While disabled the cost is one timestamp comparison per request or handler;
+consumers re-read the switch on the 'redis' pool, so the event loop never
+waits on the cache.
+
+cProfile sees the whole thread, so a consumer capture also includes other
+coroutines that ran on the loop while the handler was suspended. Only one
+capture runs at a time per process.
+"""
+import asyncio
+import cProfile
+import logging
+import pstats
+import random
+import re
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .executors import ExecutorSaturated, get_executor
+
+
+logger = logging.getLogger(__name__)
+
+CONFIG_CACHE_KEY = 'profiling:config'
+DEFAULT_PROFILING = {'dir': 'profiles', 'header_token': None, 'poll_interval': 5}
+UNSAFE_CHARS_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+captured = metrics.counter('profiles_captured_total', 'Profiles captured per endpoint.')
+
+_config = None
+_config_checked_at = 0.0
+_capture_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def get_settings():
+    return {**DEFAULT_PROFILING, **getattr(settings, 'PROFILING', {})}
+
+
+def enable(rate=1.0, users=(), minutes=10):
+    cache.set(CONFIG_CACHE_KEY, {'rate': rate, 'users': list(users)}, timeout=int(minutes * 60))
+
+
+def disable():
+    cache.delete(CONFIG_CACHE_KEY)
+
+
+def config_due():
+    return time.monotonic() - _config_checked_at >= get_settings()['poll_interval']
+
+
+def refresh_config():
+    global _config, _config_checked_at
+    _config_checked_at = time.monotonic()
+    try:
+        _config = cache.get(CONFIG_CACHE_KEY)
+    except Exception:
+        logger.warning("Could not read profiling switch", exc_info=True)
+        _config = None
+    return _config
+
+
+def get_config():
+    """The runtime switch, re-read from the cache at most every poll interval."""
+    if config_due():
+        refresh_config()
+    return _config
+
+
+def schedule_refresh():
+    """
+    Re-read the switch on the 'redis' pool when it is due, for callers on the
+    event loop. Until that lands they keep seeing the previous value.
+    """
+    global _config_checked_at
+    if not config_due():
+        return
+    # Claim the interval first so concurrent handlers submit a single read.
+    _config_checked_at = time.monotonic()
+    try:
+        get_executor('redis').submit(refresh_config)
+    except ExecutorSaturated:
+        pass
+
+
+def should_profile(header=None, get_username=None, poll=True):
+    """
+    ``get_username`` is only called when the switch targets specific users.
+    With ``poll=False`` the last value read is used and the cache is not touched.
+    """
+    token = get_settings()['header_token']
+    if token and header == token:
+        return True
+    config = get_config() if poll else _config
+    if not config:
+        return False
+    if config['users']:
+        return get_username is not None and get_username() in config['users']
+    return random.random() < config['rate']
+
+
+def request_username(request):
+    # DRF authenticates inside the view, so resolve the JWT cookie here.
+    from authenticate.authenticate import CustomJwtAuthentication
+    try:
+        result = CustomJwtAuthentication().authenticate(request)
+    except Exception:
+        return None
+    return result[0].username if result else None
+
+
+def profile_path(endpoint):
+    return Path(get_settings()['dir']) / f"{UNSAFE_CHARS_RE.sub('_', endpoint).strip('_') or 'root'}.prof"
+
+
+def save_profile(endpoint, profile):
+    path = profile_path(endpoint)
+    with _write_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stats = pstats.Stats(profile)
+        if path.exists():
+            stats.add(str(path))
+        stats.dump_stats(str(path))
+    captured.inc(endpoint=endpoint)
+
+
+def start_capture():
+    """Return an enabled profiler, or None if another capture is running."""
+    if not _capture_lock.acquire(blocking=False):
+        return None
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def stop_capture(profile):
+    profile.disable()
+    _capture_lock.release()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request.headers.get('X-Profile'), lambda: request_username(request)):
+            return self.get_response(request)
+
+        profile = start_capture()
+        if profile is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_capture(profile)
+
+        match = getattr(request, 'resolver_match', None)
+        save_profile(f"http {request.method} {match.route if match else 'unmatched'}", profile)
+        return response
+
+
+class ProfiledDispatchMixin:
+    """Mix into a consumer to profile individual handler invocations."""
+
+    async def dispatch(self, message):
+        header = getattr(self, '_profile_header', False)
+        if header is False:
+            header = self._profile_header = dict(self.scope.get('headers', [])).get(b'x-profile', b'').decode('latin-1') or None
+        schedule_refresh()
+        if not should_profile(header, lambda: getattr(self.scope.get('user'), 'username', None), poll=False):
+            return await super().dispatch(message)
+
+        profile = start_capture()
+        if profile is None:
+            return await super().dispatch(message)
+        try:
+            return await super().dispatch(message)
+        finally:
+            stop_capture(profile)
+            endpoint = f"ws {type(self).__name__}.{message['type']}"
+            asyncio.get_running_loop().run_in_executor(None, save_profile, endpoint, profile)
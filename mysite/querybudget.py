@@ -0,0 +1,155 @@
+"""
+Per-request query accounting.
+
+QueryBudgetMiddleware records every SQL statement a request runs: how many,
+how long they took, exact duplicates (same SQL and parameters) and similar
+queries (same SQL shape, different parameters) repeated often enough to look
+like an N+1. In DEBUG the numbers go out as X-DB-* response headers; always
+they feed the metrics registry and requests over their QUERY_BUDGETS entry or
+with N+1 patterns are logged.
+
+Tests enforce the same budgets with ``query_budget()``.
+"""
+import logging
+import re
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+DEFAULT_SIMILAR_THRESHOLD = 5
+DEFAULT_MAX_TRACKED = 1000
+
+request_queries = metrics.histogram(
+    'http_db_queries', 'SQL statements per request.', buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+request_db_seconds = metrics.histogram('http_db_seconds', 'Time spent in SQL per request.')
+budget_exceeded = metrics.counter('http_db_budget_exceeded_total', 'Requests that ran more queries than their budget.')
+repeated_queries = metrics.counter('http_db_repeated_queries_total', 'Requests with an N+1 query pattern.')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """
+    Totals for every statement, plus per-shape counts and timings and a hash
+    of each statement's parameters for duplicate detection. At most
+    ``max_tracked`` shapes and hashes are kept, so a request running thousands
+    of statements does not hold on to their SQL and parameters.
+    """
+    def __init__(self, max_tracked=None):
+        self.max_tracked = max_tracked or getattr(settings, 'QUERY_MAX_TRACKED', DEFAULT_MAX_TRACKED)
+        self.count = 0
+        self.duration = 0.0
+        self.duplicates = 0
+        self.shapes = {}
+        self.seen = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, params, time.perf_counter() - started)
+
+    def record(self, sql, params, elapsed):
+        self.count += 1
+        self.duration += elapsed
+
+        statement = hash((sql, repr(params)))
+        if statement in self.seen:
+            self.duplicates += 1
+        elif len(self.seen) < self.max_tracked:
+            self.seen.add(statement)
+
+        shape = IN_LIST_RE.sub('IN (...)', sql)
+        totals = self.shapes.get(shape)
+        if totals is None:
+            if len(self.shapes) >= self.max_tracked:
+                return
+            totals = self.shapes[shape] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += elapsed
+
+    def similar(self, threshold=None):
+        """SQL shapes repeated at least ``threshold`` times, with their counts."""
+        threshold = threshold or getattr(settings, 'QUERY_SIMILAR_THRESHOLD', DEFAULT_SIMILAR_THRESHOLD)
+        return {sql: count for sql, (count, _) in self.shapes.items() if count >= threshold}
+
+
+@contextmanager
+def record_queries(using=None):
+    recorder = QueryRecorder()
+    aliases = [using] if using else list(connections)
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+def budget_for(route):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(route)
+
+
+@contextmanager
+def query_budget(max_queries=None, route=None, max_duplicates=0, allow_similar=False, using=None):
+    """
+    Fail with QueryBudgetExceeded if the block runs more than ``max_queries``
+    statements (or the QUERY_BUDGETS entry for ``route``), repeats a statement
+    more than ``max_duplicates`` times, or shows an N+1 pattern.
+    """
+    if max_queries is None and route is not None:
+        max_queries = budget_for(route)
+    with record_queries(using) as recorder:
+        yield recorder
+
+    problems = []
+    if max_queries is not None and recorder.count > max_queries:
+        problems.append(f"{recorder.count} queries, budget is {max_queries}")
+    if recorder.duplicates > max_duplicates:
+        problems.append(f"{recorder.duplicates} duplicate queries")
+    if not allow_similar:
+        problems.extend(f"{count}x similar query: {sql}" for sql, count in recorder.similar().items())
+    if problems:
+        raise QueryBudgetExceeded("; ".join(problems))
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+        request_queries.observe(recorder.count, route=route)
+        request_db_seconds.observe(recorder.duration, route=route)
+
+        budget = budget_for(route)
+        if budget is not None and recorder.count > budget:
+            budget_exceeded.inc(route=route)
+            logger.warning("Query budget exceeded", extra={
+                'route': route, 'queries': recorder.count, 'budget': budget
+            })
+        similar = recorder.similar()
+        if similar:
+            repeated_queries.inc(route=route)
+            logger.warning("Repeated similar queries", extra={'route': route, 'similar': similar})
+
+        if settings.DEBUG:
+            response['X-DB-Query-Count'] = str(recorder.count)
+            response['X-DB-Query-Time-Ms'] = f"{recorder.duration * 1000:.1f}"
+            response['X-DB-Duplicate-Queries'] = str(recorder.duplicates)
+            response['X-DB-Similar-Queries'] = str(sum(similar.values()))
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -55,8 +56,34 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
     'ROTATE_REFRESH_TOKENS': True,
 }
+
+# When enabled, access tokens carry the user fields needed by the API and the
+# socket middleware, so authenticated requests skip the user-table lookup.
+# Revocation goes through authenticate.tokens.bump_token_version.
+STATELESS_AUTH = os.environ.get('STATELESS_AUTH', 'False') == 'True'
+
+# 'db' keeps simplejwt's OutstandingToken/BlacklistedToken tables, 'redis' keeps
+# blacklisted JTIs in Redis until the token expires. Move existing rows with
+# `manage.py migrate_token_blacklist` before switching.
+TOKEN_BLACKLIST_BACKEND = os.environ.get('TOKEN_BLACKLIST_BACKEND', 'db')
+
+# Bounded pools for work that must not run on the shared sync_to_async thread.
+# Once max_workers jobs are running and max_pending are waiting, new work is
+# rejected (login and register answer 503 with Retry-After).
+# 'orm' and 'redis' carry consumer and WebSocket auth work, so reporting
+# queries in sync views cannot delay message saves or presence updates. Each
+# orm worker holds its own database connection; keep orm max_workers within
+# the database's connection limit.
+EXECUTORS = {
+    'hashing': {'max_workers': 2, 'max_pending': 16},
+    'orm': {'max_workers': int(os.environ.get('ORM_EXECUTOR_WORKERS', 8)), 'max_pending': 1000},
+    'redis': {'max_workers': int(os.environ.get('REDIS_EXECUTOR_WORKERS', 8)), 'max_pending': 1000},
+}
 MIDDLEWARE = [
+    'mysite.querybudget.QueryBudgetMiddleware',
+    'mysite.profiling.ProfilingMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    'mysite.compression.CompressionMiddleware',
      "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -107,6 +134,7 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'anon': '10/minute',
         'user': '20/minute',
+        'attachment_chunks': '600/minute',
     }
 }
 
@@ -149,15 +177,120 @@ STORAGES = {
 
 # settings.py
 
+# Redis instances that room state is spread over. Each room's channel-layer
+# groups and presence set live on the shard picked by hashing the room id
+# (see mysite/sharding.py); run `manage.py rebalance_shards` after changing it.
+REDIS_SHARDS = os.environ.get('REDIS_SHARDS', 'redis://redis:6379').split(',')
+PRESENCE_REDIS_DB = 4
+
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'mysite.sharding.ShardedRedisChannelLayer',
         'CONFIG': {
-            "hosts": [("redis", 6379)], 
+            "hosts": REDIS_SHARDS,
         },
     },
 }
 
+# Outbound frames per socket are queued and written by one task per
+# connection. When a client falls behind, 'drop_oldest' sheds ephemeral frames
+# (typing, presence, read receipts), 'coalesce' first replaces queued state
+# such as user counts with the newer value, and 'close' disconnects it (4008).
+SOCKET_SEND_QUEUE = {
+    'max_frames': 256,
+    'max_bytes': 1024 * 1024,
+    'policy': os.environ.get('SOCKET_SEND_QUEUE_POLICY', 'coalesce'),
+}
+
+# Attachments are uploaded in chunks of at most ATTACHMENT_MAX_CHUNK_SIZE bytes
+# and stored by SHA-256 under ATTACHMENT_ROOT. When ATTACHMENT_ACCEL_REDIRECT is
+# set (e.g. '/protected/attachments/'), downloads are handed to the front-end
+# proxy with X-Accel-Redirect instead of being streamed by Django.
+ATTACHMENT_ROOT = os.environ.get('ATTACHMENT_ROOT', BASE_DIR / 'media' / 'attachments')
+ATTACHMENT_MAX_SIZE = 100 * 1024 * 1024
+ATTACHMENT_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+ATTACHMENT_ACCEL_REDIRECT = os.environ.get('ATTACHMENT_ACCEL_REDIRECT')
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+
+# New rooms and messages get UUIDv7 primary keys (time-ordered, so inserts
+# append to the primary-key index) instead of random UUID4. Both are plain
+# UUIDs and can be mixed; compare with `manage.py bench_ids`.
+TIME_ORDERED_IDS = os.environ.get('TIME_ORDERED_IDS', 'False') == 'True'
+
+# Per-worker limits on WebSocket connects. A worker refuses new sockets once
+# it holds max_connections or its event loop lags by more than max_loop_lag
+# seconds; the client gets close code 1013 and a retry_after hint (seconds,
+# jittered up to twice the base value).
+WEBSOCKET_ADMISSION = {
+    'max_connections': int(os.environ.get('MAX_SOCKETS_PER_WORKER', 2000)),
+    'max_loop_lag': 0.1,
+    'retry_after': 5,
+}
+
+# Responses of at least min_size bytes with a listed content type are
+# compressed with brotli (if the brotli package is installed) or gzip. Closed
+# pages of message history are cached with their compressed bytes and ETag
+# for HISTORY_CACHE_TIMEOUT seconds.
+COMPRESSION = {
+    'min_size': 1024,
+    'gzip_level': 6,
+    'brotli_quality': 5,
+}
+HISTORY_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Broadcast rooms (category '3'): only the room's creator posts, listeners are
+# not capped by MAX_CHAT_USERS, and each worker subscribes once per room and
+# fans out locally. Listener counts are refreshed every presence_interval
+# seconds; a worker that stops reporting drops out after presence_ttl.
+BROADCAST_ROOMS = {
+    'presence_interval': 5,
+    'presence_ttl': 30,
+}
+
+# Most SQL statements a request to each route should need (including the user
+# lookup done by JWT authentication). Requests over budget are logged and
+# counted; tests enforce them with mysite.querybudget.query_budget(route=...).
+# The same SQL repeated QUERY_SIMILAR_THRESHOLD times in one request is
+# reported as an N+1 pattern. Per request at most QUERY_MAX_TRACKED distinct
+# SQL shapes and parameter hashes are kept for that bookkeeping.
+QUERY_BUDGETS = {
+    'api/chat/create-room': 3,
+    'api/chat/get-rooms': 3,
+    'api/chat/search-rooms': 3,
+    'api/chat/get-room/<id>': 2,
+    'api/chat/get-messages/<id>': 3,
+    'api/chat/room-stats/<id>': 3,
+    'api/chat/inbox': 3,
+    'api/chat/changes/<id>': 4,
+}
+QUERY_SIMILAR_THRESHOLD = 5
+QUERY_MAX_TRACKED = 1000
+
+# cProfile captures for HTTP requests and socket handlers, merged per endpoint
+# into PROFILING['dir']. Off unless `manage.py profiling enable` is run or a
+# request carries `X-Profile: <header_token>`.
+PROFILING = {
+    'dir': os.environ.get('PROFILING_DIR', BASE_DIR / 'profiles'),
+    'header_token': os.environ.get('PROFILING_HEADER_TOKEN'),
+    'poll_interval': 5,
+}
+
+# Event loop monitor (mysite/looplag.py): lag is sampled every `interval`
+# seconds, the loop thread's stack is logged when it stays blocked for
+# `stall_threshold`, and with `debug` asyncio runs in debug mode and reports
+# callbacks slower than `slow_callback` along with the coroutine that ran
+# them. Debug mode adds overhead to every callback, so it is off unless asked
+# for, independently of DEBUG.
+LOOP_MONITOR = {
+    'interval': 0.1,
+    'stall_threshold': 0.25,
+    'slow_callback': 0.1,
+    'debug': os.environ.get('LOOP_MONITOR_DEBUG', 'False') == 'True',
+}
+
+# Addresses allowed to scrape /metrics when DEBUG is off.
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -190,3 +323,47 @@ STATIC_ROOT = BASE_DIR/ 'static'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Logging
+# Records go through mysite.log.QueueLogHandler: the caller only enqueues and a
+# listener thread writes JSON lines to stderr. LOG_LEVELS sets per-module levels,
+# e.g. "chats.consumers=DEBUG,django.db.backends=INFO". LOG_SAMPLING keeps a
+# fraction of records logged with extra={'event': <name>}.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = dict(
+    item.split('=', 1) for item in os.environ.get('LOG_LEVELS', '').split(',') if '=' in item
+)
+LOG_SAMPLING = {
+    'chat.connect': 1.0,
+    'chat.disconnect': 1.0,
+    'chat.message_dropped': 0.1,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'mysite.log.SamplingFilter',
+            'rates': LOG_SAMPLING,
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'mysite.log.QueueLogHandler',
+            'filters': ['sampling'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': LOG_LEVEL,
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        **{name: {'level': level.upper()} for name, level in LOG_LEVELS.items()},
+    },
+}
@@ -0,0 +1,23 @@
+"""
+Settings for WebSocket-only workers (ASGI_PROFILE=websocket, see
+mysite/asgi_ws.py).
+
+Only the apps whose models the consumers and the socket auth middleware
+touch are installed; admin, jet, sessions, messages, staticfiles, the HTTP
+middleware stack and templates are left out so django.setup() has less to
+import and the worker is ready sooner.
+"""
+from .settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework_simplejwt.token_blacklist',
+    'chats',
+    'authenticate',
+]
+
+MIDDLEWARE = []
+
+TEMPLATES = []
@@ -0,0 +1,99 @@
+"""
+Consistent-hash placement of room state across several Redis instances.
+
+Everything that belongs to one room (its chat/video channel-layer groups and
+its presence set) hashes on the room id, so a room lives on exactly one shard
+and adding a shard only moves roughly 1/N of the rooms. After changing
+REDIS_SHARDS, run ``manage.py rebalance_shards`` to move existing keys.
+"""
+import bisect
+import hashlib
+import re
+import threading
+
+import redis
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+
+ROOM_NAME_RE = re.compile(r'^(?:room:)?(?:chat|video_call)_(?P<room>[^:]+)(?::users)?$')
+REPLICAS = 128
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def shard_key(name):
+    """Map group names and presence keys to their room id; other names hash as-is."""
+    match = ROOM_NAME_RE.match(name)
+    return match.group('room') if match else name
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def get_index(self, key):
+        if len(self.nodes) == 1:
+            return 0
+        position = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._indexes[position]
+
+    def get_node(self, key):
+        return self.nodes[self.get_index(key)]
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer that places room groups by room id on a hash ring
+    instead of CRC32 modulo the number of hosts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = HashRing([
+            host.get('address') or f"redis://{host['host']}:{host['port']}" for host in self.hosts
+        ])
+
+    def consistent_hash(self, value):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        if '!' in value:
+            # Process-local channels must land where their reader polls.
+            value = self.non_local_name(value)
+        return self.ring.get_index(shard_key(value))
+
+
+_ring = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_ring():
+    global _ring
+    if _ring is None:
+        _ring = HashRing(settings.REDIS_SHARDS)
+    return _ring
+
+
+def get_client(url):
+    client = _clients.get(url)
+    if client is None:
+        with _lock:
+            client = _clients.get(url)
+            if client is None:
+                client = _clients[url] = redis.Redis.from_url(url, db=settings.PRESENCE_REDIS_DB)
+    return client
+
+
+def get_shard_client(name):
+    """Presence client for the shard owning ``name`` (a group name, presence key or room id)."""
+    return get_client(get_ring().get_node(shard_key(name)))
@@ -0,0 +1,47 @@
+"""
+Child process for ``manage.py bench_startup``: imports mysite.asgi under the
+current ASGI_PROFILE, opens one socket through the application and prints a
+JSON line with the timings. Run it directly with ``python -m mysite.startup_probe``.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+
+async def first_socket(application, path, cookie):
+    from channels.testing import WebsocketCommunicator
+
+    headers = [(b'cookie', cookie.encode('latin-1'))] if cookie else []
+    communicator = WebsocketCommunicator(application, path, headers=headers)
+    started = time.perf_counter()
+    connected, detail = await communicator.connect(timeout=30)
+    elapsed = time.perf_counter() - started
+    await communicator.disconnect()
+    return elapsed, connected, None if connected else detail
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', required=True)
+    parser.add_argument('--cookie', default='')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    from mysite.asgi import application
+    imported = time.perf_counter()
+    handshake, accepted, close_code = asyncio.run(first_socket(application, args.path, args.cookie))
+
+    print(json.dumps({
+        'import_seconds': imported - started,
+        'handshake_seconds': handshake,
+        'first_socket_seconds': time.perf_counter() - started,
+        'accepted': accepted,
+        'close_code': close_code,
+        'modules': len(sys.modules),
+    }))
+
+
+if __name__ == '__main__':
+    main()
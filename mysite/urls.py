@@ -16,10 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from .metrics import metrics_view
 
 urlpatterns = [
     path('jet/', include('jet.urls', 'jet')), 
     path('admin/', admin.site.urls),
     path('api/auth/' , include("authenticate.urls")),
-    path('api/chat/' , include("chats.urls"))
+    path('api/chat/' , include("chats.urls")),
+    path('metrics', metrics_view),
 ]